@@ -0,0 +1,84 @@
+import os
+from contextlib import contextmanager
+
+# Ingest requests allowed in flight at once (waiting on the database or the spool)
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+
+# Event types per priority tier; anything not listed is "normal"
+ADMISSION_CRITICAL_TYPES = os.getenv("ADMISSION_CRITICAL_TYPES", "purchase,user_signup").split(",")
+ADMISSION_LOW_TYPES = os.getenv("ADMISSION_LOW_TYPES", "page_view,product_view").split(",")
+
+# Load (0-1) at which each tier starts being shed. Bulk is /api/track/batch and
+# /api/track/ndjson: backfills can wait, live events can't.
+TIER_SHARES = {
+    "critical": 1.0,
+    "normal": float(os.getenv("ADMISSION_NORMAL_SHARE", "0.8")),
+    "low": float(os.getenv("ADMISSION_LOW_SHARE", "0.5")),
+    "bulk": float(os.getenv("ADMISSION_BULK_SHARE", "0.5"))
+}
+
+# Retry-After sent with 429/503 responses, including the ingest buffer's when it is full
+ADMISSION_RETRY_AFTER_S = int(os.getenv("ADMISSION_RETRY_AFTER_S", "1"))
+
+class Shed(Exception):
+    """Raised when a request is refused by admission control"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class AdmissionControl:
+    """Priority load shedding for ingestion.
+
+    Load is the highest of in-flight requests over ADMISSION_MAX_INFLIGHT and any
+    extra signals (such as ingest buffer fill). A tier is refused once load
+    reaches its share: 429 while higher tiers are still admitted, 503 once
+    everything is (load >= 1).
+    """
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT, shares=TIER_SHARES):
+        self.max_inflight = max_inflight
+        self.shares = shares
+        self.signals = {}
+        self.inflight = 0
+        self.counters = {tier: {"admitted": 0, "shed": 0} for tier in shares}
+
+    def add_signal(self, name: str, signal):
+        """Include signal() (a 0-1 fill ratio) in the load"""
+        self.signals[name] = signal
+
+    def tier_for(self, event_type: str) -> str:
+        if event_type in ADMISSION_CRITICAL_TYPES:
+            return "critical"
+        if event_type in ADMISSION_LOW_TYPES:
+            return "low"
+        return "normal"
+
+    def load(self) -> float:
+        return max([self.inflight / self.max_inflight] + [signal() for signal in self.signals.values()])
+
+    @contextmanager
+    def admit(self, tier: str):
+        """Hold an in-flight slot for the request, or raise Shed"""
+        load = self.load()
+        if load >= self.shares[tier]:
+            self.counters[tier]["shed"] += 1
+            status_code = 503 if load >= 1 else 429
+            raise Shed(status_code, f"Ingest overloaded (load {load:.2f}), {tier} events are being shed")
+        self.counters[tier]["admitted"] += 1
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "load": round(self.load(), 3),
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "signals": {name: round(signal(), 3) for name, signal in self.signals.items()},
+            "shares": self.shares,
+            "tiers": self.counters
+        }
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+# Set CACHE_ENABLED=false to always run the analytics queries
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+
+# Cached results kept, least recently used evicted first
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+
+# Seconds a result stays fresh, per cached function; CACHE_TTLS overrides them,
+# e.g. "funnel=5,recent_events=1"
+CACHE_TTL_S = {
+    "funnel": 10,
+    "ordered_funnel": 30,
+    "user_analytics": 30,
+    "campaign_performance": 30,
+    "breakdown": 30,
+    "product_revenue": 30,
+    "revenue_metrics": 10,
+    "event_timeline": 30,
+    "recent_events": 2,
+    "dashboard": 10
+}
+for override in filter(None, os.getenv("CACHE_TTLS", "").split(",")):
+    name, _, ttl = override.partition("=")
+    CACHE_TTL_S[name.strip()] = float(ttl)
+
+# Once events have been ingested after a result was computed, it goes stale this soon
+# instead of waiting out its TTL
+CACHE_MIN_FRESH_S = float(os.getenv("CACHE_MIN_FRESH_S", "1"))
+
+# How long past staleness a result is still served while it is refreshed in the
+# background; older results are recomputed before responding. Worst-case age of a
+# response is TTL + CACHE_STALE_S.
+CACHE_STALE_S = float(os.getenv("CACHE_STALE_S", "30"))
+
+# Set per request (Cache-Control: no-cache) to skip cached results
+bypass_cache = ContextVar("bypass_cache", default=False)
+
+class Entry:
+    __slots__ = ("value", "computed_at", "watermark")
+
+    def __init__(self, value, computed_at: float, watermark: int):
+        self.value = value
+        self.computed_at = computed_at
+        self.watermark = watermark
+
+class ResultCache:
+    """LRU cache of analytics results with TTLs, stale-while-revalidate and
+    invalidation by ingest watermark.
+
+    The watermark counts committed writes in this process; multi-process
+    deployments still get the TTL bound, just not the early refresh.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttls=CACHE_TTL_S,
+                 min_fresh=CACHE_MIN_FRESH_S, stale=CACHE_STALE_S):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.min_fresh = min_fresh
+        self.stale = stale
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.watermark = 0
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "evictions": 0
+        }
+
+    def note_ingest(self):
+        """Advance the watermark; called after every committed write to events"""
+        self.watermark += 1
+
+    def is_fresh(self, name: str, entry: Entry, now: float) -> bool:
+        age = now - entry.computed_at
+        if age >= self.ttls.get(name, 10):
+            return False
+        return entry.watermark == self.watermark or age < self.min_fresh
+
+    async def get(self, name: str, key, compute):
+        """Cached compute(), refreshed according to the rules above"""
+        if bypass_cache.get():
+            # Not shared with an in-flight query, which may predate the caller's writes
+            self.counters["bypasses"] += 1
+            return await self._compute(key, compute, shared=False)
+
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if self.is_fresh(name, entry, now):
+                self.counters["hits"] += 1
+                return entry.value
+            if now - entry.computed_at < self.ttls.get(name, 10) + self.stale:
+                self.counters["stale_hits"] += 1
+                if key not in self.inflight:
+                    self._start(key, compute)
+                return entry.value
+
+        self.counters["misses"] += 1
+        return await self._load(key, compute)
+
+    async def _load(self, key, compute):
+        # Single flight: concurrent misses for the same key share one query
+        if key not in self.inflight:
+            self._start(key, compute)
+        return await asyncio.shield(self.inflight[key])
+
+    def _start(self, key, compute):
+        task = asyncio.ensure_future(self._compute(key, compute))
+        task.add_done_callback(self._log_refresh_error)
+        self.inflight[key] = task
+
+    async def _compute(self, key, compute, shared=True):
+        # The watermark is read before running the query, so writes that race it
+        # leave the entry marked stale rather than wrongly fresh
+        watermark = self.watermark
+        try:
+            value = await compute()
+        finally:
+            if shared:
+                self.inflight.pop(key, None)
+        self.counters["refreshes"] += 1
+        self.entries[key] = Entry(value, time.monotonic(), watermark)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+        return value
+
+    def _log_refresh_error(self, task):
+        if not task.cancelled() and task.exception():
+            self.counters["refresh_errors"] += 1
+            print(f"❌ Cache refresh failed: {task.exception()}")
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        return {
+            "enabled": CACHE_ENABLED,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "watermark": self.watermark,
+            **self.counters,
+            "hit_rate": round((lookups - self.counters["misses"]) / lookups, 4) if lookups else 0.0
+        }
+
+result_cache = ResultCache()
+
+def cached(name: str):
+    """Serve an async get_* function through result_cache, keyed by name and arguments"""
+    def decorator(fn):
+        if not CACHE_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return await result_cache.get(name, key, lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorator
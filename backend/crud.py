@@ -1,44 +1,625 @@
-from sqlalchemy import text
-from datetime import datetime, timedelta
-from .db import SessionLocal
+from sqlalchemy import text, bindparam
+from sqlalchemy.dialects.postgresql import JSONB
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+import base64
+import os
+import numpy as np
+import orjson
+from .cache import cached, result_cache
+from .db import ingest_session, ingest_connection, analytics_session, json_dumps
+from .hot_window import hot_window
+from .live import live_metrics
+from .matviews import view_refreshed_at
+from .sketches import SKETCH_KINDS
+from .sessions import ORDERED_FUNNEL_STEPS
+from .downsample import lttb
 
-def create_event(event_data: dict):
-    """Insert event into database"""
-    db = SessionLocal()
-    try:
-        query = text("""
-            INSERT INTO events (
-                event_type, timestamp, session_id, user_id, page_url,
-                utm_source, utm_medium, utm_campaign, platform, device,
-                revenue, metadata
-            ) VALUES (
-                :event_type, :timestamp, :session_id, :user_id, :page_url,
-                :utm_source, :utm_medium, :utm_campaign, :platform, :device,
-                :revenue, CAST(:metadata AS jsonb)
-            ) RETURNING id
-        """)
-        result = db.execute(query, event_data)
-        db.commit()
-        return result.fetchone()[0]
-    finally:
-        db.close()
-
-def get_funnel_metrics(hours: int = 168):
-    """Get aggregated funnel counts for the past N hours"""
-    db = SessionLocal()
-    try:
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
-        query = text("""
-            SELECT
-                COUNT(*) FILTER (WHERE event_type = 'ad_click') as ad_clicks,
-                COUNT(*) FILTER (WHERE event_type = 'page_view' AND metadata->>'landing' = 'true') as landings,
-                COUNT(*) FILTER (WHERE event_type = 'product_view') as product_views,
-                COUNT(*) FILTER (WHERE event_type = 'add_to_cart') as adds,
-                COUNT(*) FILTER (WHERE event_type = 'purchase') as purchases
+EVENT_COLUMNS = (
+    "id", "event_type", "timestamp", "session_id", "user_id", "page_url",
+    "utm_source", "utm_medium", "utm_campaign", "platform", "device",
+    "revenue", "metadata"
+)
+
+# Rows per INSERT statement; keeps bind params well under asyncpg's 32767 limit
+BATCH_CHUNK_SIZE = 1000
+
+# Rows fetched per round trip while streaming raw events
+EVENTS_STREAM_CHUNK_ROWS = 500
+
+# Timeline bucket sizes in seconds. Buckets are aligned to the Unix epoch, so days
+# are UTC days. Hours and days are summed from the hourly rollup; finer buckets
+# count raw events.
+TIMELINE_INTERVALS = {"minute": 60, "5min": 300, "hour": 3600, "day": 86400}
+
+# Points a timeline returns at most, unless asked for another budget; longer
+# series are downsampled with LTTB (backend/downsample.py)
+TIMELINE_MAX_POINTS = 1000
+
+TIMELINE_SERIES = ("ad_clicks", "page_views", "product_views", "adds", "purchases", "revenue")
+
+# Queries live at module level so scripts (benchmarks, EXPLAIN tooling) can run
+# exactly the SQL the API runs. metadata is passed as a dict and bound as jsonb
+# by the driver, instead of a JSON string cast in SQL. events is partitioned on
+# timestamp, so the key (and the conflict target) is (id, timestamp): retries are
+# idempotent as long as they carry the same timestamp (see ingest.prepare_event),
+# and client ids that can't are claimed in client_event_ids first (claim_client_ids).
+INSERT_EVENT_QUERY = text("""
+    INSERT INTO events (
+        id, event_type, timestamp, session_id, user_id, page_url,
+        utm_source, utm_medium, utm_campaign, platform, device,
+        revenue, metadata
+    ) VALUES (
+        :id, :event_type, :timestamp, :session_id, :user_id, :page_url,
+        :utm_source, :utm_medium, :utm_campaign, :platform, :device,
+        :revenue, :metadata
+    )
+    ON CONFLICT (id, timestamp) DO NOTHING
+""").bindparams(bindparam("metadata", type_=JSONB))
+
+# Client event ids that aren't UUIDv7 and arrive without a timestamp are stamped with
+# the time they were received, which differs on every retry, so the (id, timestamp)
+# key can't tell a retry from a new event. Those ids are claimed in client_event_ids
+# (unique on id alone) in the insert's transaction; ids already there are repeats.
+CLAIM_CLIENT_IDS_SQL = """
+    INSERT INTO client_event_ids (id)
+    SELECT unnest({ids})
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+"""
+CLAIM_CLIENT_IDS_QUERY = text(CLAIM_CLIENT_IDS_SQL.format(ids="CAST(:ids AS uuid[])"))
+
+# Bulk loads COPY into a per-connection staging table, then merge so that
+# duplicate ids are skipped just like the INSERT paths
+STAGING_TABLE_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS events_staging
+    (LIKE events INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+
+MERGE_STAGING_SQL = f"""
+    INSERT INTO events ({", ".join(EVENT_COLUMNS)})
+    SELECT {", ".join(EVENT_COLUMNS)} FROM events_staging
+    ON CONFLICT (id, timestamp) DO NOTHING
+    RETURNING id
+"""
+
+# Analytics queries read whole hours from event_rollup_hourly (kept current by a
+# trigger, see scripts/init_db.py) and only scan events for the partial hour between
+# :cutoff and :rollup_from. Both sources come out in the same shape as window_rows.
+# campaign, landing, product_name, user_email and user_name are metadata keys promoted
+# to generated columns (PROMOTED_COLUMNS in scripts/init_db.py).
+WINDOW_ROWS = """
+    WITH window_rows AS (
+        SELECT hour, event_type, campaign, events, landings, revenue, revenue_count, revenue_max
+        FROM event_rollup_hourly
+        WHERE hour >= :rollup_from
+        UNION ALL
+        SELECT
+            date_trunc('hour', timestamp, 'UTC'),
+            event_type,
+            campaign,
+            1,
+            CASE WHEN landing THEN 1 ELSE 0 END,
+            COALESCE(revenue, 0),
+            CASE WHEN revenue IS NULL THEN 0 ELSE 1 END,
+            revenue
+        FROM events
+        WHERE timestamp >= :cutoff AND timestamp < :rollup_from
+    )
+"""
+
+FUNNEL_QUERY = text(WINDOW_ROWS + """
+    SELECT
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'ad_click'), 0)::bigint as ad_clicks,
+        COALESCE(SUM(landings) FILTER (WHERE event_type = 'page_view'), 0)::bigint as landings,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'product_view'), 0)::bigint as product_views,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'add_to_cart'), 0)::bigint as adds,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'purchase'), 0)::bigint as purchases
+    FROM window_rows
+""")
+
+# Distinct users and sessions can't be summed across hours: exact counts scan events,
+# approximate ones merge the hourly HyperLogLog sketches in event_sketches_hourly
+# (see backend/sketches.py for the error bound) plus the partial hour's raw events.
+# Both fragments define distinct_counts, grouped by () and campaign.
+DISTINCT_COUNTS_EXACT = """
+    , distinct_counts AS (
+        SELECT
+            CASE WHEN GROUPING(campaign) = 0 THEN 'campaign' ELSE 'total' END as grouping_set,
+            campaign,
+            COUNT(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL) as total_users,
+            COUNT(DISTINCT session_id) as sessions,
+            COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_signup') as new_users,
+            COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_login') as returning_users
+        FROM (
+            SELECT user_id, session_id, event_type, campaign
             FROM events
             WHERE timestamp >= :cutoff
-        """)
-        result = db.execute(query, {"cutoff": cutoff})
+        ) windowed
+        GROUP BY GROUPING SETS ((), (campaign))
+    )
+"""
+
+# hll_estimate is installed by scripts/init_db.py
+DISTINCT_COUNTS_APPROX = f"""
+    , sketch_registers AS (
+        SELECT campaign, kind, register, rho
+        FROM event_sketches_hourly
+        WHERE hour >= :rollup_from
+        UNION ALL
+        SELECT campaign, kind, register, rho
+        FROM events, LATERAL event_sketch_entries(user_id, session_id, event_type)
+        WHERE timestamp >= :cutoff AND timestamp < :rollup_from
+    ), campaign_registers AS (
+        SELECT campaign, kind, register, MAX(rho) as rho
+        FROM sketch_registers
+        GROUP BY campaign, kind, register
+    ), merged_registers AS (
+        SELECT 'campaign' as grouping_set, campaign, kind, rho
+        FROM campaign_registers
+        UNION ALL
+        SELECT 'total', NULL, kind, MAX(rho)
+        FROM campaign_registers
+        GROUP BY kind, register
+    ), estimates AS (
+        SELECT grouping_set, campaign, kind, hll_estimate(array_agg(rho)) as estimate
+        FROM merged_registers
+        GROUP BY grouping_set, campaign, kind
+    ), distinct_counts AS (
+        SELECT
+            grouping_set,
+            campaign,
+            {", ".join(
+                f"ROUND(MAX(estimate) FILTER (WHERE kind = {kind}))::bigint as {name}"
+                for name, kind in SKETCH_KINDS.items()
+            )}
+        FROM estimates
+        GROUP BY grouping_set, campaign
+    )
+"""
+
+USER_ANALYTICS_QUERY = text(WINDOW_ROWS + """
+    SELECT
+        COUNT(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL) as total_users,
+        COUNT(DISTINCT session_id) as total_sessions,
+        (SELECT COALESCE(SUM(events), 0)::bigint FROM window_rows) as total_events,
+        COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_signup') as new_users,
+        COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_login') as returning_users
+    FROM events
+    WHERE timestamp >= :cutoff
+""")
+
+# Exact distinct counts as of the last refresh of window_distinct_counts, a
+# materialized view holding them for the windows in MATVIEW_WINDOWS_HOURS (see
+# backend/matviews.py); only read when view_refreshed_at allows (see view_params)
+DISTINCT_COUNTS_VIEW = """
+    , distinct_counts AS (
+        SELECT grouping_set, campaign, total_users, sessions, new_users, returning_users
+        FROM window_distinct_counts
+        WHERE window_hours = :window_hours
+    )
+"""
+
+# {distinct_counts} is DISTINCT_COUNTS_APPROX or DISTINCT_COUNTS_VIEW
+USER_ANALYTICS_DISTINCT_SQL = WINDOW_ROWS + """
+    {distinct_counts}
+    SELECT total_users, sessions, total_events, new_users, returning_users
+    FROM (SELECT COALESCE(SUM(events), 0)::bigint as total_events FROM window_rows) totals
+    LEFT JOIN distinct_counts ON grouping_set = 'total'
+"""
+
+USER_ANALYTICS_APPROX_QUERY = text(USER_ANALYTICS_DISTINCT_SQL.format(distinct_counts=DISTINCT_COUNTS_APPROX))
+
+USER_ANALYTICS_VIEW_QUERY = text(USER_ANALYTICS_DISTINCT_SQL.format(distinct_counts=DISTINCT_COUNTS_VIEW))
+
+# {sessions} is a CTE of (campaign, sessions), exact or from the sketches
+CAMPAIGN_PERFORMANCE_SQL = WINDOW_ROWS + """
+    , totals AS (
+        SELECT
+            campaign,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'ad_click'), 0)::bigint as clicks,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'purchase'), 0)::bigint as purchases,
+            COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as revenue
+        FROM window_rows
+        GROUP BY campaign
+    )
+    {sessions}
+    SELECT totals.campaign, clicks, COALESCE(sessions, 0), purchases, revenue
+    FROM totals LEFT JOIN sessions USING (campaign)
+    ORDER BY clicks DESC
+    LIMIT 10
+"""
+
+CAMPAIGN_PERFORMANCE_QUERY = text(CAMPAIGN_PERFORMANCE_SQL.format(sessions="""
+    , sessions AS (
+        SELECT
+            campaign,
+            COUNT(DISTINCT session_id) as sessions
+        FROM events
+        WHERE timestamp >= :cutoff
+        GROUP BY campaign
+    )
+"""))
+
+# Sessions per campaign from distinct_counts
+CAMPAIGN_SESSIONS = """
+    , sessions AS (
+        SELECT campaign, sessions
+        FROM distinct_counts
+        WHERE grouping_set = 'campaign'
+    )
+"""
+
+CAMPAIGN_PERFORMANCE_APPROX_QUERY = text(CAMPAIGN_PERFORMANCE_SQL.format(sessions=DISTINCT_COUNTS_APPROX + CAMPAIGN_SESSIONS))
+
+CAMPAIGN_PERFORMANCE_VIEW_QUERY = text(CAMPAIGN_PERFORMANCE_SQL.format(sessions=DISTINCT_COUNTS_VIEW + CAMPAIGN_SESSIONS))
+
+REVENUE_QUERY = text(WINDOW_ROWS + """
+    SELECT
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'purchase'), 0)::bigint as total_purchases,
+        COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as total_revenue,
+        COALESCE(
+            SUM(revenue) FILTER (WHERE event_type = 'purchase')
+            / NULLIF(SUM(revenue_count) FILTER (WHERE event_type = 'purchase'), 0),
+            0
+        ) as avg_order_value,
+        COALESCE(MAX(revenue_max) FILTER (WHERE event_type = 'purchase'), 0) as max_order_value
+    FROM window_rows
+""")
+
+# Purchases and revenue per product. The rollup has no product dimension, so this
+# scans the window's events; windows in MATVIEW_WINDOWS_HOURS are read from the
+# product_revenue materialized view instead when recent enough (see view_params).
+PRODUCT_REVENUE_QUERY = text("""
+    SELECT
+        product_name,
+        COUNT(*) as purchases,
+        COALESCE(SUM(revenue), 0) as revenue,
+        COALESCE(AVG(revenue), 0) as avg_order_value,
+        COALESCE(MAX(revenue), 0) as max_order_value
+    FROM events
+    WHERE timestamp >= :cutoff AND event_type = 'purchase'
+    GROUP BY product_name
+    ORDER BY revenue DESC
+    LIMIT :limit
+""")
+
+PRODUCT_REVENUE_VIEW_QUERY = text("""
+    SELECT product_name, purchases, revenue, avg_order_value, max_order_value
+    FROM product_revenue
+    WHERE window_hours = :window_hours
+    ORDER BY revenue DESC
+    LIMIT :limit
+""")
+
+# window_rows straight from events, for timeline buckets finer than the rollup's
+# hours: an index-only scan of idx_events_timestamp_covering
+RAW_WINDOW_ROWS = """
+    WITH window_rows AS (
+        SELECT timestamp, event_type, 1 as events, COALESCE(revenue, 0) as revenue
+        FROM events
+        WHERE timestamp >= :cutoff
+    )
+"""
+
+# Follows WINDOW_ROWS or RAW_WINDOW_ROWS; {bucket} is filled in by timeline_query
+TIMELINE_QUERY = """
+    SELECT
+        {bucket} as time_bucket,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'ad_click'), 0)::bigint as ad_clicks,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'page_view'), 0)::bigint as page_views,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'product_view'), 0)::bigint as product_views,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'add_to_cart'), 0)::bigint as adds,
+        COALESCE(SUM(events) FILTER (WHERE event_type = 'purchase'), 0)::bigint as purchases,
+        COALESCE(SUM(revenue), 0) as revenue
+    FROM window_rows
+    GROUP BY time_bucket
+    ORDER BY time_bucket ASC
+"""
+
+# Everything windowed that the dashboard shows, in one statement: additive totals from
+# window_rows grouped by (), campaign and time bucket, joined to {distinct_counts}
+# (DISTINCT_COUNTS_EXACT, DISTINCT_COUNTS_APPROX or DISTINCT_COUNTS_VIEW). {bucket} as
+# in TIMELINE_QUERY.
+DASHBOARD_QUERY = WINDOW_ROWS + """
+    , totals AS (
+        SELECT
+            CASE
+                WHEN GROUPING(campaign) = 0 THEN 'campaign'
+                WHEN GROUPING(time_bucket) = 0 THEN 'timeline'
+                ELSE 'total'
+            END as grouping_set,
+            campaign,
+            time_bucket,
+            COALESCE(SUM(events), 0)::bigint as total_events,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'ad_click'), 0)::bigint as ad_clicks,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'page_view'), 0)::bigint as page_views,
+            COALESCE(SUM(landings) FILTER (WHERE event_type = 'page_view'), 0)::bigint as landings,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'product_view'), 0)::bigint as product_views,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'add_to_cart'), 0)::bigint as adds,
+            COALESCE(SUM(events) FILTER (WHERE event_type = 'purchase'), 0)::bigint as purchases,
+            COALESCE(SUM(revenue), 0) as revenue,
+            COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as purchase_revenue,
+            COALESCE(SUM(revenue_count) FILTER (WHERE event_type = 'purchase'), 0)::bigint as purchase_revenue_count,
+            COALESCE(MAX(revenue_max) FILTER (WHERE event_type = 'purchase'), 0) as max_order_value
+        FROM (SELECT *, {bucket} as time_bucket FROM window_rows) bucketed
+        GROUP BY GROUPING SETS ((), (campaign), (time_bucket))
+    )
+    {distinct_counts}
+    SELECT totals.*, total_users, sessions, new_users, returning_users
+    FROM totals
+    LEFT JOIN distinct_counts
+        ON distinct_counts.grouping_set = totals.grouping_set
+        AND distinct_counts.campaign IS NOT DISTINCT FROM totals.campaign
+"""
+
+# Sessions that started in the window, read from session_funnels (kept current by a
+# trigger, see scripts/init_db.py) rather than replaying their events. steps[k] is
+# when the session reached ORDERED_FUNNEL_STEPS[k - 1]; the time to the first step is
+# counted from the session's first event.
+ORDERED_FUNNEL_QUERY = text(f"""
+    SELECT
+        COUNT(*) as sessions,
+        {", ".join(
+            f"COUNT(*) FILTER (WHERE furthest_step >= {step})"
+            for step in range(1, len(ORDERED_FUNNEL_STEPS) + 1)
+        )},
+        {", ".join(
+            f"AVG(EXTRACT(epoch FROM steps[{step}] - {f'steps[{step - 1}]' if step > 1 else 'first_at'}))"
+            for step in range(1, len(ORDERED_FUNNEL_STEPS) + 1)
+        )}
+    FROM session_funnels
+    WHERE first_at >= :cutoff
+      AND (CAST(:campaign AS text) IS NULL OR campaign = :campaign)
+""")
+
+# Sort memory for breakdown queries, whose distinct session counts sort once per
+# grouping set; at the 4MB default those sorts spill to disk on week-long windows
+BREAKDOWN_WORK_MEM = os.getenv("BREAKDOWN_WORK_MEM", "64MB")
+BREAKDOWN_WORK_MEM_QUERY = text("SELECT set_config('work_mem', :work_mem, true)")
+
+# Columns /api/breakdown can group by, and the metrics it can rank groups on
+BREAKDOWN_DIMENSIONS = ("campaign", "utm_source", "utm_medium", "device", "platform")
+BREAKDOWN_METRICS = ("clicks", "sessions", "purchases", "revenue")
+
+# Every requested grouping in one scan of the window's events. Events are first
+# collapsed to one row per session and combination of dimension values (a hash
+# aggregate), so the sorts COUNT(DISTINCT session_id) needs for each grouping set
+# run over sessions rather than events. {grouping} is GROUPING SETS ((), (a), (b), ...)
+# or CUBE (a, b, ...); grouping_id is the GROUPING() bitmask of the dimensions each
+# row is not grouped by (the bit for the first dimension is the highest). Each
+# grouping set keeps its top :top_k rows by {sort}.
+BREAKDOWN_QUERY = """
+    WITH session_rows AS (
+        SELECT
+            {dimensions},
+            session_id,
+            COUNT(*) FILTER (WHERE event_type = 'ad_click') as clicks,
+            COUNT(*) FILTER (WHERE event_type = 'purchase') as purchases,
+            COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as revenue
+        FROM events
+        WHERE timestamp >= :cutoff
+        GROUP BY {dimensions}, session_id
+    ), groups AS (
+        SELECT
+            GROUPING({dimensions}) as grouping_id,
+            {dimensions},
+            SUM(clicks)::bigint as clicks,
+            COUNT(DISTINCT session_id) as sessions,
+            SUM(purchases)::bigint as purchases,
+            SUM(revenue) as revenue
+        FROM session_rows
+        GROUP BY {grouping}
+    )
+    SELECT *
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY grouping_id ORDER BY {sort} DESC, clicks DESC) as rank
+        FROM groups
+    ) ranked
+    WHERE rank <= :top_k
+    ORDER BY grouping_id, rank
+"""
+
+RECENT_EVENTS_QUERY = text("""
+    SELECT
+        event_type,
+        user_id,
+        session_id,
+        utm_campaign,
+        revenue,
+        product_name,
+        user_email,
+        user_name,
+        timestamp
+    FROM events
+    ORDER BY timestamp DESC
+    LIMIT :limit
+""")
+
+# Raw events newest first, one page per request. Pages continue from the
+# (timestamp, id) of the previous page's last row instead of an OFFSET, so a page
+# costs the same however deep it is. {conditions} is built by events_page_query from
+# EVENT_FILTERS and the cursor.
+EVENTS_PAGE_QUERY = f"""
+    SELECT {", ".join(EVENT_COLUMNS)}
+    FROM events
+    WHERE {{conditions}}
+    ORDER BY timestamp DESC, id DESC
+    LIMIT :limit
+"""
+
+# Filters on /api/events; only the ones given are added to the query, so each
+# combination gets a plan that can use its index
+EVENT_FILTERS = {
+    "event_type": "event_type = :event_type",
+    "campaign": "campaign = :campaign",
+    "session_id": "session_id = :session_id",
+    "user_id": "user_id = :user_id"
+}
+
+EVENTS_CURSOR_CONDITION = "(timestamp, id) < (:cursor_timestamp, :cursor_id)"
+
+def cutoff_for(hours: int) -> datetime:
+    """Start of the N-hour window ending now"""
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
+def window_params(hours: int) -> dict:
+    """:cutoff and :rollup_from (the first whole UTC hour after it) for WINDOW_ROWS queries"""
+    cutoff = cutoff_for(hours)
+    rollup_from = cutoff.replace(minute=0, second=0, microsecond=0)
+    if rollup_from < cutoff:
+        rollup_from += timedelta(hours=1)
+    return {"cutoff": cutoff, "rollup_from": rollup_from}
+
+def rejected_by_postgres(error: Exception) -> bool:
+    """Whether a write failed on the rows themselves (SQLSTATE class 22, data exception,
+    or 23, integrity violation), so retrying the same rows can never succeed"""
+    sqlstate = getattr(getattr(error, "orig", error), "sqlstate", None) or ""
+    return sqlstate[:2] in ("22", "23")
+
+async def write_isolating(writer, events: list):
+    """writer(events), bisecting on rows Postgres rejects so the rest are still written.
+
+    Returns (rows inserted, [(event, error)] rejected). Any other error is raised as is:
+    rows written before it are skipped by ON CONFLICT when the caller retries.
+    """
+    try:
+        return await writer(events), []
+    except Exception as e:
+        if not rejected_by_postgres(e):
+            raise
+        if len(events) == 1:
+            return 0, [(events[0], e)]
+    middle = len(events) // 2
+    first, first_rejected = await write_isolating(writer, events[:middle])
+    second, second_rejected = await write_isolating(writer, events[middle:])
+    return first + second, first_rejected + second_rejected
+
+def unclaimed_repeats(events: list, claimed) -> list:
+    """events without the claim_id ones whose ids weren't newly claimed (repeats)"""
+    claimed = set(claimed)
+    return [event for event in events if not event.get("claim_id") or event["id"] in claimed]
+
+async def claim_client_ids(db, events: list) -> list:
+    """Claim the claim_id events' ids in client_event_ids; the events left to insert"""
+    ids = [event["id"] for event in events if event.get("claim_id")]
+    if not ids:
+        return events
+    result = await db.execute(CLAIM_CLIENT_IDS_QUERY, {"ids": ids})
+    return unclaimed_repeats(events, result.scalars())
+
+async def create_event(event_data: dict) -> bool:
+    """Insert event into database; False if this event (id and timestamp) already exists"""
+    async with ingest_session() as db:
+        if not await claim_client_ids(db, [event_data]):
+            return False
+        result = await db.execute(INSERT_EVENT_QUERY, event_data)
+        await db.commit()
+    result_cache.note_ingest()
+    if result.rowcount == 1:
+        hot_window.append([event_data])
+        live_metrics.publish([event_data])
+    return result.rowcount == 1
+
+def inserted_events(events: list, ids) -> list:
+    """The events whose ids an INSERT ... RETURNING id returned, each at most once"""
+    ids = set(ids)
+    inserted = []
+    for event in events:
+        if event["id"] in ids:
+            ids.discard(event["id"])
+            inserted.append(event)
+    return inserted
+
+def _values_row(index: int):
+    """Build the VALUES tuple for the index-th row of a multi-row insert"""
+    return "(" + ", ".join(f":{column}_{index}" for column in EVENT_COLUMNS) + ")"
+
+async def create_events(events: list) -> int:
+    """Insert a batch of events in one transaction using multi-row INSERTs.
+
+    Rows already stored (same id and timestamp) are skipped; returns the number inserted.
+    """
+    if not events:
+        return 0
+    async with ingest_session() as db:
+        inserted = []
+        for start in range(0, len(events), BATCH_CHUNK_SIZE):
+            chunk = await claim_client_ids(db, events[start:start + BATCH_CHUNK_SIZE])
+            if not chunk:
+                continue
+            values = ",\n".join(_values_row(i) for i in range(len(chunk)))
+            query = text(f"""
+                INSERT INTO events ({", ".join(EVENT_COLUMNS)})
+                VALUES {values}
+                ON CONFLICT (id, timestamp) DO NOTHING
+                RETURNING id
+            """).bindparams(*(bindparam(f"metadata_{i}", type_=JSONB) for i in range(len(chunk))))
+            params = {
+                f"{column}_{i}": event[column]
+                for i, event in enumerate(chunk)
+                for column in EVENT_COLUMNS
+            }
+            result = await db.execute(query, params)
+            inserted.extend(inserted_events(chunk, result.scalars()))
+        await db.commit()
+    result_cache.note_ingest()
+    hot_window.append(inserted)
+    live_metrics.publish(inserted)
+    return len(inserted)
+
+async def copy_events(chunks) -> dict:
+    """COPY an async iterator of event chunks into events, one transaction per chunk.
+
+    Each chunk is committed as it arrives, so memory is bounded by the chunk
+    size and a failure only loses the chunk in flight.
+    """
+    copied = inserted = 0
+    async with ingest_connection() as conn:
+        # COPY needs the asyncpg connection itself
+        driver = (await conn.get_raw_connection()).driver_connection
+        await driver.execute(STAGING_TABLE_SQL)
+        async for chunk in chunks:
+            copied += len(chunk)
+            async with driver.transaction():
+                claim_ids = [event["id"] for event in chunk if event["claim_id"]]
+                if claim_ids:
+                    claimed = await driver.fetch(CLAIM_CLIENT_IDS_SQL.format(ids="$1::uuid[]"), claim_ids)
+                    chunk = unclaimed_repeats(chunk, (row[0] for row in claimed))
+                # The raw driver's jsonb codec takes the encoded string
+                records = [
+                    tuple(event[column] for column in EVENT_COLUMNS[:-1]) + (json_dumps(event["metadata"]),)
+                    for event in chunk
+                ]
+                await driver.copy_records_to_table(
+                    "events_staging", records=records, columns=EVENT_COLUMNS
+                )
+                ids = await driver.fetch(MERGE_STAGING_SQL)
+            inserted += len(ids)
+            result_cache.note_ingest()
+            new_events = inserted_events(chunk, (row[0] for row in ids))
+            hot_window.append(new_events)
+            live_metrics.publish(new_events)
+    return {"accepted": inserted, "duplicates": copied - inserted}
+
+async def view_params(db, view: str, name: str, hours: int, precomputed: bool):
+    """(refreshed_at as ISO 8601, query params) if view may answer the cached function
+    name for this window, else (None, None). By default only a view no older than name's
+    cache TTL is read, so it is no staler than a cached result; precomputed=True accepts
+    one up to MATVIEW_MAX_STALENESS_S old."""
+    max_age_s = float("inf") if precomputed else result_cache.ttls.get(name, 10)
+    refreshed_at = await view_refreshed_at(db, view, hours, max_age_s)
+    if refreshed_at is None:
+        return None, None
+    return refreshed_at.isoformat(), {**window_params(hours), "window_hours": hours}
+
+@cached("funnel")
+async def get_funnel_metrics(hours: int = 168):
+    """Get aggregated funnel counts for the past N hours"""
+    if hot_window.covers(hours):
+        return hot_window.funnel(hours)
+    async with analytics_session() as db:
+        result = await db.execute(FUNNEL_QUERY, window_params(hours))
         row = result.fetchone()
         return {
             "ad_clicks": row[0] or 0,
@@ -47,55 +628,44 @@ def get_funnel_metrics(hours: int = 168):
             "adds": row[3] or 0,
             "purchases": row[4] or 0
         }
-    finally:
-        db.close()
 
-def get_user_analytics(hours: int = 168):
-    """Get user analytics for the past N hours"""
-    db = SessionLocal()
-    try:
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
-        query = text("""
-            SELECT
-                COUNT(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL) as total_users,
-                COUNT(DISTINCT session_id) as total_sessions,
-                COUNT(*) as total_events,
-                COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_signup') as new_users,
-                COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_login') as returning_users
-            FROM events
-            WHERE timestamp >= :cutoff
-        """)
-        result = db.execute(query, {"cutoff": cutoff})
+@cached("user_analytics")
+async def get_user_analytics(hours: int = 168, approx: bool = False, precomputed: bool = False):
+    """Get user analytics for the past N hours; approx estimates the distinct counts,
+    precomputed accepts them from a view up to MATVIEW_MAX_STALENESS_S old.
+    refreshed_at is the view's last refresh when the distinct counts came from it."""
+    async with analytics_session() as db:
+        # Exact counts from the view are cheaper than either query
+        refreshed_at, params = await view_params(db, "window_distinct_counts", "user_analytics", hours, precomputed)
+        if refreshed_at:
+            query = USER_ANALYTICS_VIEW_QUERY
+        else:
+            query, params = USER_ANALYTICS_APPROX_QUERY if approx else USER_ANALYTICS_QUERY, window_params(hours)
+        result = await db.execute(query, params)
         row = result.fetchone()
         return {
             "total_users": row[0] or 0,
             "total_sessions": row[1] or 0,
             "total_events": row[2] or 0,
             "new_users": row[3] or 0,
-            "returning_users": row[4] or 0
+            "returning_users": row[4] or 0,
+            "refreshed_at": refreshed_at
         }
-    finally:
-        db.close()
 
-def get_campaign_performance(hours: int = 168):
-    """Get campaign performance metrics"""
-    db = SessionLocal()
-    try:
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
-        query = text("""
-            SELECT
-                COALESCE(metadata->>'campaign', utm_campaign, 'direct') as campaign,
-                COUNT(*) FILTER (WHERE event_type = 'ad_click') as clicks,
-                COUNT(DISTINCT session_id) as sessions,
-                COUNT(*) FILTER (WHERE event_type = 'purchase') as purchases,
-                COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as revenue
-            FROM events
-            WHERE timestamp >= :cutoff
-            GROUP BY campaign
-            ORDER BY clicks DESC
-            LIMIT 10
-        """)
-        result = db.execute(query, {"cutoff": cutoff})
+@cached("campaign_performance")
+async def get_campaign_performance(hours: int = 168, approx: bool = False, precomputed: bool = False):
+    """Get campaign performance metrics; approx estimates sessions, precomputed accepts
+    them from a view up to MATVIEW_MAX_STALENESS_S old (refreshed_at on each row)"""
+    if hot_window.covers(hours):
+        # Exact sessions from memory are cheaper than the estimate from SQL
+        return hot_window.campaigns(hours)
+    async with analytics_session() as db:
+        refreshed_at, params = await view_params(db, "window_distinct_counts", "campaign_performance", hours, precomputed)
+        if refreshed_at:
+            query = CAMPAIGN_PERFORMANCE_VIEW_QUERY
+        else:
+            query, params = CAMPAIGN_PERFORMANCE_APPROX_QUERY if approx else CAMPAIGN_PERFORMANCE_QUERY, window_params(hours)
+        result = await db.execute(query, params)
         campaigns = []
         for row in result:
             campaigns.append({
@@ -103,27 +673,117 @@ def get_campaign_performance(hours: int = 168):
                 "clicks": row[1] or 0,
                 "sessions": row[2] or 0,
                 "purchases": row[3] or 0,
-                "revenue": float(row[4] or 0)
+                "revenue": float(row[4] or 0),
+                "refreshed_at": refreshed_at
             })
         return campaigns
-    finally:
-        db.close()
 
-def get_revenue_metrics(hours: int = 168):
+@cached("product_revenue")
+async def get_product_revenue(hours: int = 168, limit: int = 10, precomputed: bool = False):
+    """Purchases and revenue per product over the past N hours, top products by revenue;
+    precomputed accepts them from a view up to MATVIEW_MAX_STALENESS_S old"""
+    async with analytics_session() as db:
+        refreshed_at, _ = await view_params(db, "product_revenue", "product_revenue", hours, precomputed)
+        if refreshed_at:
+            result = await db.execute(PRODUCT_REVENUE_VIEW_QUERY, {"window_hours": hours, "limit": limit})
+        else:
+            result = await db.execute(PRODUCT_REVENUE_QUERY, {"cutoff": cutoff_for(hours), "limit": limit})
+        return [
+            {
+                "product_name": row[0],
+                "purchases": row[1],
+                "revenue": float(row[2]),
+                "avg_order_value": float(row[3]),
+                "max_order_value": float(row[4]),
+                "refreshed_at": refreshed_at
+            }
+            for row in result
+        ]
+
+def breakdown_query(dimensions: tuple, cube: bool = False, sort: str = "clicks"):
+    """BREAKDOWN_QUERY grouped by each dimension on its own (or every combination of them,
+    with cube), plus the total; ValueError for names outside BREAKDOWN_DIMENSIONS/METRICS"""
+    unknown = [name for name in dimensions if name not in BREAKDOWN_DIMENSIONS]
+    if not dimensions or unknown:
+        raise ValueError(f"dimensions must be some of {', '.join(BREAKDOWN_DIMENSIONS)}")
+    if sort not in BREAKDOWN_METRICS:
+        raise ValueError(f"sort must be one of {', '.join(BREAKDOWN_METRICS)}")
+    columns = ", ".join(dimensions)
+    if cube:
+        grouping = f"CUBE ({columns})"
+    else:
+        grouping = "GROUPING SETS ((), " + ", ".join(f"({name})" for name in dimensions) + ")"
+    return text(BREAKDOWN_QUERY.format(dimensions=columns, grouping=grouping, sort=sort))
+
+@cached("breakdown")
+async def get_breakdown(hours: int = 168, dimensions: tuple = ("campaign",), cube: bool = False,
+                        top_k: int = 10, sort: str = "clicks"):
+    """Clicks, sessions, purchases and revenue per value of each dimension (or combination,
+    with cube) over the past N hours, top_k groups per breakdown by sort"""
+    query = breakdown_query(dimensions, cube, sort)
+    async with analytics_session() as db:
+        # For this transaction only
+        await db.execute(BREAKDOWN_WORK_MEM_QUERY, {"work_mem": BREAKDOWN_WORK_MEM})
+        result = await db.execute(query, {"cutoff": cutoff_for(hours), "top_k": top_k})
+        rows = [row._mapping for row in result]
+
+    total = None
+    breakdowns = {}
+    for row in rows:
+        grouped = tuple(
+            name for i, name in enumerate(dimensions)
+            if not row["grouping_id"] >> (len(dimensions) - 1 - i) & 1
+        )
+        group = {name: row[name] for name in grouped}
+        group.update({
+            "clicks": row["clicks"],
+            "sessions": row["sessions"],
+            "purchases": row["purchases"],
+            "revenue": float(row["revenue"])
+        })
+        if grouped:
+            breakdowns.setdefault(grouped, []).append(group)
+        else:
+            total = group
+    return {
+        "total": total or {"clicks": 0, "sessions": 0, "purchases": 0, "revenue": 0.0},
+        "breakdowns": [
+            {"dimensions": list(grouped), "groups": breakdowns[grouped]}
+            # Single dimensions first, in the order asked for, then combinations
+            for grouped in sorted(breakdowns, key=lambda grouped: (len(grouped), [dimensions.index(name) for name in grouped]))
+        ]
+    }
+
+@cached("ordered_funnel")
+async def get_ordered_funnel(hours: int = 168, campaign: str = None):
+    """Sessions started in the past N hours and how far they got through the funnel steps in order.
+
+    campaign filters on the session's first-touch campaign.
+    """
+    async with analytics_session() as db:
+        result = await db.execute(ORDERED_FUNNEL_QUERY, {"cutoff": cutoff_for(hours), "campaign": campaign})
+        row = result.fetchone()
+    reached = row[1:len(ORDERED_FUNNEL_STEPS) + 1]
+    seconds = row[len(ORDERED_FUNNEL_STEPS) + 1:]
+    return {
+        "sessions": row[0],
+        "steps": [
+            {
+                "event_type": step,
+                "sessions": reached[i],
+                "avg_seconds": float(seconds[i]) if seconds[i] is not None else None
+            }
+            for i, step in enumerate(ORDERED_FUNNEL_STEPS)
+        ]
+    }
+
+@cached("revenue_metrics")
+async def get_revenue_metrics(hours: int = 168):
     """Get revenue analytics"""
-    db = SessionLocal()
-    try:
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
-        query = text("""
-            SELECT
-                COUNT(*) FILTER (WHERE event_type = 'purchase') as total_purchases,
-                COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as total_revenue,
-                COALESCE(AVG(revenue) FILTER (WHERE event_type = 'purchase'), 0) as avg_order_value,
-                COALESCE(MAX(revenue) FILTER (WHERE event_type = 'purchase'), 0) as max_order_value
-            FROM events
-            WHERE timestamp >= :cutoff
-        """)
-        result = db.execute(query, {"cutoff": cutoff})
+    if hot_window.covers(hours):
+        return hot_window.revenue(hours)
+    async with analytics_session() as db:
+        result = await db.execute(REVENUE_QUERY, window_params(hours))
         row = result.fetchone()
         return {
             "total_purchases": row[0] or 0,
@@ -131,86 +791,201 @@ def get_revenue_metrics(hours: int = 168):
             "avg_order_value": float(row[2] or 0),
             "max_order_value": float(row[3] or 0)
         }
-    finally:
-        db.close()
 
-def get_event_timeline(hours: int = 168, interval: str = 'hour'):
-    """Get event counts over time"""
-    db = SessionLocal()
+def default_interval(hours: int) -> str:
+    """Timeline interval used when none is asked for: hours up to a day, days beyond"""
+    return "hour" if hours <= 24 else "day"
+
+def timeline_bucket(interval: str, column: str = "hour") -> str:
+    """SQL for the start of the TIMELINE_INTERVALS bucket a timestamp column falls in"""
+    return f"date_bin(INTERVAL '{TIMELINE_INTERVALS[interval]} seconds', {column}, TIMESTAMPTZ 'epoch')"
+
+def timeline_query(interval: str):
+    """Timeline SQL for one of TIMELINE_INTERVALS: rollup rows for hours and days, raw events below"""
+    if TIMELINE_INTERVALS[interval] < 3600:
+        return text(RAW_WINDOW_ROWS + TIMELINE_QUERY.format(bucket=timeline_bucket(interval, "timestamp")))
+    return text(WINDOW_ROWS + TIMELINE_QUERY.format(bucket=timeline_bucket(interval)))
+
+def dashboard_query(hours: int, approx: bool = False, from_view: bool = False):
+    """Dashboard SQL with the same timeline buckets as get_event_timeline's default;
+    from_view reads the distinct counts from window_distinct_counts"""
+    if from_view:
+        distinct_counts = DISTINCT_COUNTS_VIEW
+    else:
+        distinct_counts = DISTINCT_COUNTS_APPROX if approx else DISTINCT_COUNTS_EXACT
+    return text(DASHBOARD_QUERY.format(bucket=timeline_bucket(default_interval(hours)), distinct_counts=distinct_counts))
+
+def timeline_point(row) -> dict:
+    """Format a TIMELINE_QUERY (or dashboard timeline) row; the timestamp stays a datetime
+    until shape_timeline"""
+    return {
+        "timestamp": row["time_bucket"],
+        "ad_clicks": row["ad_clicks"] or 0,
+        "page_views": row["page_views"] or 0,
+        "product_views": row["product_views"] or 0,
+        "adds": row["adds"] or 0,
+        "purchases": row["purchases"] or 0,
+        "revenue": float(row["revenue"] or 0)
+    }
+
+def shape_timeline(points: list, hours: int, interval: str, max_points: int = TIMELINE_MAX_POINTS) -> list:
+    """Timeline points in bucket order, with a zero point for every empty bucket in the
+    window and the series downsampled to max_points with LTTB.
+
+    Downsampling keeps whole points (real buckets with their counts), chosen so the
+    chart keeps its shape, so the kept points don't add up to the window's totals.
+    """
+    step = timedelta(seconds=TIMELINE_INTERVALS[interval])
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    first = epoch + (cutoff_for(hours) - epoch) // step * step
+    last = epoch + (datetime.now(timezone.utc) - epoch) // step * step
+    by_bucket = {point["timestamp"]: point for point in points}
+    timeline = []
+    bucket = first
+    while bucket <= last:
+        timeline.append(by_bucket.pop(bucket, None) or
+                        {"timestamp": bucket, **{name: 0 for name in TIMELINE_SERIES}, "revenue": 0.0})
+        bucket += step
+    # Events timestamped in the future stay where they are, without filling up to them
+    timeline.extend(sorted(by_bucket.values(), key=lambda point: point["timestamp"]))
+
+    if len(timeline) > max_points:
+        x = np.array([(point["timestamp"] - epoch).total_seconds() for point in timeline])
+        y = np.array([[point[name] for name in TIMELINE_SERIES] for point in timeline])
+        timeline = [timeline[i] for i in lttb(x, y, max_points)]
+    return [{**point, "timestamp": point["timestamp"].isoformat()} for point in timeline]
+
+@cached("event_timeline")
+async def get_event_timeline(hours: int = 168, interval: str = None, max_points: int = TIMELINE_MAX_POINTS):
+    """Get event counts over time in TIMELINE_INTERVALS buckets (default_interval(hours) if
+    none is given), gap-filled and downsampled to at most max_points"""
+    interval = interval or default_interval(hours)
+    if hot_window.covers(hours):
+        points = hot_window.timeline(hours, TIMELINE_INTERVALS[interval])
+    else:
+        async with analytics_session() as db:
+            result = await db.execute(timeline_query(interval), window_params(hours))
+            points = [timeline_point(row._mapping) for row in result]
+    return shape_timeline(points, hours, interval, max_points)
+
+def recent_event(row) -> dict:
+    """Format a RECENT_EVENTS_QUERY row"""
+    return {
+        "event_type": row[0],
+        "user_id": row[1],
+        "session_id": row[2],
+        "campaign": row[3] or 'direct',
+        "revenue": float(row[4] or 0),
+        "product_name": row[5],
+        "user_email": row[6],
+        "user_name": row[7],
+        "timestamp": row[8].isoformat() if row[8] else None
+    }
+
+def encode_cursor(event: dict) -> str:
+    """Opaque cursor for the page after this event"""
+    return base64.urlsafe_b64encode(orjson.dumps([event["timestamp"], event["id"]])).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    """:cursor_timestamp and :cursor_id from encode_cursor's output; ValueError if malformed"""
     try:
-        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        timestamp, event_id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        return {"cursor_timestamp": datetime.fromisoformat(timestamp), "cursor_id": UUID(event_id)}
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
-        # Choose interval based on time range
-        if hours <= 24:
-            trunc_str = "DATE_TRUNC('hour', timestamp)"
-        elif hours <= 168:
-            trunc_str = "DATE_TRUNC('day', timestamp)"
-        else:
-            trunc_str = "DATE_TRUNC('day', timestamp)"
-
-        query = text(f"""
-            SELECT
-                {trunc_str} as time_bucket,
-                COUNT(*) FILTER (WHERE event_type = 'ad_click') as ad_clicks,
-                COUNT(*) FILTER (WHERE event_type = 'page_view') as page_views,
-                COUNT(*) FILTER (WHERE event_type = 'product_view') as product_views,
-                COUNT(*) FILTER (WHERE event_type = 'add_to_cart') as adds,
-                COUNT(*) FILTER (WHERE event_type = 'purchase') as purchases,
-                COALESCE(SUM(revenue), 0) as revenue
-            FROM events
-            WHERE timestamp >= :cutoff
-            GROUP BY time_bucket
-            ORDER BY time_bucket ASC
-        """)
-        result = db.execute(query, {"cutoff": cutoff})
-        timeline = []
-        for row in result:
-            timeline.append({
-                "timestamp": row[0].isoformat() if row[0] else None,
-                "ad_clicks": row[1] or 0,
-                "page_views": row[2] or 0,
-                "product_views": row[3] or 0,
-                "adds": row[4] or 0,
-                "purchases": row[5] or 0,
-                "revenue": float(row[6] or 0)
-            })
-        return timeline
-    finally:
-        db.close()
+def events_page_query(filters: dict, cursor: dict = None):
+    """EVENTS_PAGE_QUERY with a condition for each filter given, and the cursor's"""
+    conditions = [EVENT_FILTERS[name] for name, value in filters.items() if value is not None]
+    if cursor:
+        conditions.append(EVENTS_CURSOR_CONDITION)
+    return text(EVENTS_PAGE_QUERY.format(conditions=" AND ".join(conditions) or "TRUE"))
+
+def page_event(row) -> dict:
+    """Format an EVENTS_PAGE_QUERY row"""
+    event = dict(zip(EVENT_COLUMNS, row))
+    event["id"] = str(event["id"])
+    event["timestamp"] = event["timestamp"].isoformat()
+    event["revenue"] = float(event["revenue"]) if event["revenue"] is not None else None
+    return event
+
+async def stream_events(limit: int, filters: dict, position: dict = None):
+    """Yield one page of raw events, newest first, as they are read from a server-side cursor.
+
+    filters maps EVENT_FILTERS names to values (None to skip); position is the
+    decode_cursor() of the previous page's cursor.
+    """
+    params = {"limit": limit, **filters, **(position or {})}
+    async with analytics_session() as db:
+        result = await db.stream(
+            events_page_query(filters, position).execution_options(yield_per=EVENTS_STREAM_CHUNK_ROWS),
+            params
+        )
+        async for row in result:
+            yield page_event(row)
 
-def get_recent_events(limit: int = 20):
+@cached("recent_events")
+async def get_recent_events(limit: int = 20):
     """Get most recent events"""
-    db = SessionLocal()
-    try:
-        query = text("""
-            SELECT
-                event_type,
-                user_id,
-                session_id,
-                utm_campaign,
-                revenue,
-                metadata->>'product_name' as product_name,
-                metadata->>'user_email' as user_email,
-                metadata->>'user_name' as user_name,
-                timestamp
-            FROM events
-            ORDER BY timestamp DESC
-            LIMIT :limit
-        """)
-        result = db.execute(query, {"limit": limit})
-        events = []
-        for row in result:
-            events.append({
-                "event_type": row[0],
-                "user_id": row[1],
-                "session_id": row[2],
-                "campaign": row[3] or 'direct',
-                "revenue": float(row[4] or 0),
-                "product_name": row[5],
-                "user_email": row[6],
-                "user_name": row[7],
-                "timestamp": row[8].isoformat() if row[8] else None
-            })
-        return events
-    finally:
-        db.close()
+    async with analytics_session() as db:
+        result = await db.execute(RECENT_EVENTS_QUERY, {"limit": limit})
+        return [recent_event(row) for row in result]
+
+@cached("dashboard")
+async def get_dashboard(hours: int = 168, limit: int = 20, approx: bool = False, precomputed: bool = False):
+    """Everything the dashboard shows, from one aggregate query and one connection.
+
+    Same shapes as get_funnel_metrics, get_user_analytics, get_campaign_performance,
+    get_revenue_metrics, get_event_timeline and get_recent_events.
+    """
+    async with analytics_session() as db:
+        refreshed_at, params = await view_params(db, "window_distinct_counts", "dashboard", hours, precomputed)
+        result = await db.execute(dashboard_query(hours, approx, refreshed_at is not None), params or window_params(hours))
+        rows = [row._mapping for row in result]
+        recent = await db.execute(RECENT_EVENTS_QUERY, {"limit": limit})
+        recent_events = [recent_event(row) for row in recent]
+
+    total = next(row for row in rows if row["grouping_set"] == "total")
+    campaigns = sorted(
+        (row for row in rows if row["grouping_set"] == "campaign"),
+        key=lambda row: row["ad_clicks"],
+        reverse=True
+    )[:10]
+    timeline = [row for row in rows if row["grouping_set"] == "timeline"]
+    purchase_revenue = float(total["purchase_revenue"])
+    return {
+        "funnel": {
+            "ad_clicks": total["ad_clicks"],
+            "landings": total["landings"],
+            "product_views": total["product_views"],
+            "adds": total["adds"],
+            "purchases": total["purchases"]
+        },
+        "user_analytics": {
+            "total_users": total["total_users"] or 0,
+            "total_sessions": total["sessions"] or 0,
+            "total_events": total["total_events"],
+            "new_users": total["new_users"] or 0,
+            "returning_users": total["returning_users"] or 0,
+            "refreshed_at": refreshed_at
+        },
+        "campaign_performance": [
+            {
+                "campaign": row["campaign"],
+                "clicks": row["ad_clicks"],
+                "sessions": row["sessions"] or 0,
+                "purchases": row["purchases"],
+                "revenue": float(row["purchase_revenue"]),
+                "refreshed_at": refreshed_at
+            }
+            for row in campaigns
+        ],
+        "revenue_metrics": {
+            "total_purchases": total["purchases"],
+            "total_revenue": purchase_revenue,
+            "avg_order_value": purchase_revenue / total["purchase_revenue_count"] if total["purchase_revenue_count"] else 0.0,
+            "max_order_value": float(total["max_order_value"])
+        },
+        "event_timeline": shape_timeline([timeline_point(row) for row in timeline], hours, default_interval(hours)),
+        "recent_events": recent_events
+    }
@@ -1,15 +1,188 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+from collections import deque
+from contextlib import asynccontextmanager
 import os
+import time
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+
+# Optional read replica; analytics queries go here when set
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL") or DATABASE_URL
+
+# Pool settings shared by every engine
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Ingestion and analytics get separate pools so dashboard reads can't starve writes
+INGEST_POOL_SIZE = int(os.getenv("INGEST_POOL_SIZE", "5"))
+INGEST_MAX_OVERFLOW = int(os.getenv("INGEST_MAX_OVERFLOW", "5"))
+ANALYTICS_POOL_SIZE = int(os.getenv("ANALYTICS_POOL_SIZE", "5"))
+ANALYTICS_MAX_OVERFLOW = int(os.getenv("ANALYTICS_MAX_OVERFLOW", "10"))
+
+def async_database_url(url: str):
+    """Point a postgres:// or postgresql:// URL at the asyncpg driver"""
+    parsed = make_url(url.replace("postgres://", "postgresql://", 1))
+    query = dict(parsed.query)
+    # asyncpg takes ssl=..., not libpq's sslmode=...
+    if "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return parsed.set(drivername="postgresql+asyncpg", query=query)
+
+def json_dumps(value) -> str:
+    """jsonb serializer for the engines; orjson is several times faster than json"""
+    return orjson.dumps(value).decode()
+
+def pool_options(pool_size: int, max_overflow: int) -> dict:
+    """Keyword arguments for create_async_engine"""
+    return {
+        "json_serializer": json_dumps,
+        "json_deserializer": orjson.loads,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+class PoolWaitStats:
+    """Tracks how long callers wait to check a connection out of a pool"""
+
+    def __init__(self, window: int = 1000):
+        self.recent = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.recent.append(wait)
+        self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self, pool) -> dict:
+        recent = sorted(self.recent)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(p / 100 * len(recent)))] * 1000, 3) if recent else 0.0
+
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "p50_wait_ms": pct(50),
+            "p99_wait_ms": pct(99),
+            "max_wait_ms": round(self.max_wait * 1000, 3)
+        }
+
+# Sync engine for scripts and tooling; the API itself uses the async engines below
+engine = create_engine(DATABASE_URL, json_serializer=json_dumps, json_deserializer=orjson.loads)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
+ingest_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    **pool_options(INGEST_POOL_SIZE, INGEST_MAX_OVERFLOW)
+)
+analytics_engine = create_async_engine(
+    async_database_url(READ_DATABASE_URL),
+    **pool_options(ANALYTICS_POOL_SIZE, ANALYTICS_MAX_OVERFLOW)
+)
+# Long-running maintenance (materialized view refreshes) opens its own connections to
+# the primary, outside both pools, so it never holds one that writes are waiting on
+maintenance_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    json_serializer=json_dumps,
+    json_deserializer=orjson.loads,
+    poolclass=NullPool
+)
+IngestSessionLocal = async_sessionmaker(ingest_engine, expire_on_commit=False)
+AnalyticsSessionLocal = async_sessionmaker(analytics_engine, expire_on_commit=False)
+MaintenanceSessionLocal = async_sessionmaker(maintenance_engine, expire_on_commit=False)
+
+ingest_pool_stats = PoolWaitStats()
+analytics_pool_stats = PoolWaitStats()
+
+@asynccontextmanager
+async def _timed_session(session_factory, stats: PoolWaitStats):
+    async with session_factory() as db:
+        started = time.perf_counter()
+        try:
+            # Check the connection out now so the wait is measured on its own
+            await db.connection()
+        except PoolTimeoutError:
+            stats.timeouts += 1
+            raise
+        stats.record(time.perf_counter() - started)
+        yield db
+
+@asynccontextmanager
+async def ingest_connection():
+    """Connection on the write pool, held across several transactions (bulk loads)"""
+    started = time.perf_counter()
+    try:
+        conn = await ingest_engine.connect()
+    except PoolTimeoutError:
+        ingest_pool_stats.timeouts += 1
+        raise
+    ingest_pool_stats.record(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+@asynccontextmanager
+async def analytics_connection():
+    """Connection on the read pool, for reads that need the driver itself (exports)"""
+    started = time.perf_counter()
+    try:
+        conn = await analytics_engine.connect()
+    except PoolTimeoutError:
+        analytics_pool_stats.timeouts += 1
+        raise
+    analytics_pool_stats.record(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+def ingest_session():
+    """Session on the write pool, for event ingestion"""
+    return _timed_session(IngestSessionLocal, ingest_pool_stats)
+
+def analytics_session():
+    """Session on the read pool (or replica), for get_* analytics queries"""
+    return _timed_session(AnalyticsSessionLocal, analytics_pool_stats)
+
+def maintenance_session():
+    """Session on a connection of its own to the primary, for long maintenance (view refreshes)"""
+    return MaintenanceSessionLocal()
+
+def pool_stats() -> dict:
+    """Checkout wait and occupancy for each async pool"""
+    return {
+        "ingest": ingest_pool_stats.snapshot(ingest_engine.pool),
+        "analytics": analytics_pool_stats.snapshot(analytics_engine.pool)
+    }
+
+async def dispose_engines():
+    await ingest_engine.dispose()
+    await analytics_engine.dispose()
+    await maintenance_engine.dispose()
+
 def get_db():
     db = SessionLocal()
     try:
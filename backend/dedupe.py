@@ -0,0 +1,64 @@
+import os
+from collections import OrderedDict
+from uuid import UUID
+
+# Client event ids remembered in memory. About 90 bytes each (scripts/bench_dedupe.py),
+# so the default 500k costs ~45 MB and covers the last ~1.2 hours at 10M events/day;
+# older retries fall through to the primary key's ON CONFLICT DO NOTHING. The key is
+# (id, timestamp), which catches retries with the same timestamp or a UUIDv7 id (the
+# timestamp is then taken from the id); other ids sent without one are checked against
+# client_event_ids instead (see crud.claim_client_ids).
+DEDUPE_CAPACITY = int(os.getenv("DEDUPE_CAPACITY", "500000"))
+
+class RecentIds:
+    """Bounded LRU of recently ingested client event ids.
+
+    This is the front-check for idempotent ingestion: a hit answers "duplicate"
+    without touching the database. It has to be exact (no Bloom filter), since a
+    false positive would silently drop a real event. A miss costs nothing extra:
+    the insert itself carries ON CONFLICT DO NOTHING.
+    """
+
+    def __init__(self, capacity: int = DEDUPE_CAPACITY):
+        self.capacity = capacity
+        self.ids = OrderedDict()
+        self.counters = {
+            "checked": 0,
+            "front_hits": 0,
+            "db_conflicts": 0
+        }
+
+    def seen(self, event_id: UUID) -> bool:
+        """Check a client id, counting it toward the hit rate"""
+        self.counters["checked"] += 1
+        key = event_id.int
+        if key in self.ids:
+            self.ids.move_to_end(key)
+            self.counters["front_hits"] += 1
+            return True
+        return False
+
+    def remember(self, event_id: UUID, conflict: bool = False):
+        """Record an id that has been written; conflict=True if the database already had it"""
+        if conflict:
+            self.counters["db_conflicts"] += 1
+        self.ids[event_id.int] = None
+        self.ids.move_to_end(event_id.int)
+        if len(self.ids) > self.capacity:
+            self.ids.popitem(last=False)
+
+    def record_conflicts(self, count: int):
+        """Count duplicates caught by ON CONFLICT where the ids aren't known individually"""
+        self.counters["db_conflicts"] += count
+
+    def stats(self) -> dict:
+        duplicates = self.counters["front_hits"] + self.counters["db_conflicts"]
+        checked = self.counters["checked"]
+        return {
+            "size": len(self.ids),
+            "capacity": self.capacity,
+            **self.counters,
+            "hit_rate": round(duplicates / checked, 4) if checked else 0.0
+        }
+
+recent_ids = RecentIds()
@@ -0,0 +1,37 @@
+import numpy as np
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps out of len(x).
+
+    The first and last points are always kept; between them each of threshold - 2
+    equal slices contributes the point forming the largest triangle with the point
+    kept before it and the average of the next slice, so peaks and dips survive
+    where plain decimation would skip them. y may have one column per series: each
+    is scaled to its own maximum and the triangle areas are summed, so every series
+    counts the same whatever its units.
+    """
+    n = len(x)
+    if threshold < 3 or n <= threshold:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).reshape(n, -1)
+    scale = np.abs(y).max(axis=0)
+    y = y / np.where(scale > 0, scale, 1)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[edges[i + 1]:edges[i + 2]].mean(), y[edges[i + 1]:edges[i + 2]].mean(axis=0)
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end, None]) * (next_y - y[previous])
+        ).sum(axis=1)
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return kept
@@ -0,0 +1,120 @@
+import asyncio
+import os
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .db import analytics_connection
+
+# Rows fetched from the server-side cursor and written per record batch (one
+# Parquet row group each); memory held is about one batch, whatever the range
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+
+# Largest range one export may cover
+EXPORT_MAX_DAYS = int(os.getenv("EXPORT_MAX_DAYS", "31"))
+
+# Media type of each export format
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+# Metadata keys already exported as their own columns (the promoted columns, see
+# PROMOTED_COLUMNS in scripts/init_db.py); the metadata column keeps the rest as JSON
+FLATTENED_METADATA_KEYS = ("campaign", "landing", "product_name", "user_email", "user_name")
+
+EXPORT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("event_type", pa.string()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("page_url", pa.string()),
+    ("utm_source", pa.string()),
+    ("utm_medium", pa.string()),
+    ("utm_campaign", pa.string()),
+    ("platform", pa.string()),
+    ("device", pa.string()),
+    ("revenue", pa.float64()),
+    ("campaign", pa.string()),
+    ("landing", pa.bool_()),
+    ("product_name", pa.string()),
+    ("user_email", pa.string()),
+    ("user_name", pa.string()),
+    ("metadata", pa.string())
+])
+
+# Events in [start, end), read straight off the daily partitions in order, so rows
+# come out grouped by day and each row group's timestamp statistics stay narrow.
+# Columns match EXPORT_SCHEMA; values are cast here so pyarrow needn't convert them.
+EXPORT_QUERY = """
+    SELECT
+        id::text, event_type, timestamp, session_id, user_id, page_url,
+        utm_source, utm_medium, utm_campaign, platform, device, revenue::float8,
+        campaign, landing, product_name, user_email, user_name,
+        NULLIF(metadata - '{{{keys}}}'::text[], '{{}}'::jsonb)::text
+    FROM events
+    WHERE timestamp >= $1 AND timestamp < $2
+""".format(keys=",".join(FLATTENED_METADATA_KEYS))
+
+class ChunkSink:
+    """File-like object the Arrow writers write to, drained after every batch"""
+
+    closed = False
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def open_writer(sink: ChunkSink, export_format: str):
+    """Parquet or Arrow IPC stream writer over the sink"""
+    handle = pa.PythonFile(sink, mode="w")
+    if export_format == "parquet":
+        return pq.ParquetWriter(handle, EXPORT_SCHEMA, compression="zstd")
+    return pa.ipc.new_stream(handle, EXPORT_SCHEMA)
+
+def record_batch(records) -> pa.RecordBatch:
+    """EXPORT_QUERY rows to one record batch, converted a column at a time"""
+    columns = zip(*records)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, EXPORT_SCHEMA)],
+        schema=EXPORT_SCHEMA
+    )
+
+def write_batch(writer, sink: ChunkSink, records) -> bytes:
+    writer.write_batch(record_batch(records))
+    return sink.drain()
+
+def close_writer(writer, sink: ChunkSink) -> bytes:
+    writer.close()
+    return sink.drain()
+
+async def export_events(start: datetime, end: datetime, export_format: str = "parquet"):
+    """Yield events in [start, end) as a Parquet file or Arrow IPC stream, in chunks.
+
+    Rows are read EXPORT_BATCH_ROWS at a time from a server-side cursor and each
+    batch is encoded off the event loop while the next one is fetched.
+    """
+    sink = ChunkSink()
+    writer = open_writer(sink, export_format)
+    async with analytics_connection() as conn:
+        # Server-side cursors need the asyncpg connection itself
+        driver = (await conn.get_raw_connection()).driver_connection
+        async with driver.transaction(readonly=True):
+            cursor = await driver.cursor(EXPORT_QUERY, start, end)
+            records = await cursor.fetch(EXPORT_BATCH_ROWS)
+            while records:
+                encoding = asyncio.create_task(asyncio.to_thread(write_batch, writer, sink, records))
+                records = await cursor.fetch(EXPORT_BATCH_ROWS) if len(records) == EXPORT_BATCH_ROWS else []
+                yield await encoding
+    yield await asyncio.to_thread(close_writer, writer, sink)
@@ -0,0 +1,329 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import orjson
+from .db import ingest_connection
+
+# Hours of recent events kept in memory as column arrays, so funnel, revenue, timeline
+# and campaign queries over windows up to this long are answered without Postgres.
+# 0 (the default) turns the store off. About 41 bytes per event (41 MB per million)
+# plus the dictionaries. Each process only sees the events it ingests itself, so
+# only enable this when a single API process takes all the writes.
+HOT_WINDOW_HOURS = int(os.getenv("HOT_WINDOW_HOURS", "0"))
+
+# Appended events are staged as tuples and converted to arrays this many at a time
+# (or before the next query)
+HOT_WINDOW_BLOCK_ROWS = 4096
+
+# Rows fetched per round trip by the startup backfill
+HOT_WINDOW_LOAD_ROWS = 50000
+
+# How often rows that have aged out of the window are dropped
+HOT_WINDOW_EVICT_S = 60
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# session_id is kept as its hash, for distinct counts; events without one get this
+NO_SESSION = 0
+
+COLUMN_TYPES = {
+    "timestamp": np.int64,  # microseconds since the epoch
+    "event_type": np.int32,
+    "campaign": np.int32,
+    "source": np.int32,
+    "device": np.int32,
+    "landing": np.bool_,
+    "revenue": np.float64,  # NaN when null
+    "session": np.int64
+}
+DICTIONARY_COLUMNS = ("event_type", "campaign", "source", "device")
+
+# Rows in the shape the store stages them: (timestamp in microseconds, event_type,
+# campaign, utm_source, device, landing, revenue, session_id). campaign and landing
+# are the promoted columns, computed the same way as in PROMOTED_COLUMNS.
+LOAD_QUERY = """
+    SELECT
+        (extract(epoch FROM timestamp) * 1000000)::int8, event_type, campaign,
+        utm_source, device, landing, revenue::float8, session_id
+    FROM events
+    WHERE timestamp >= $1
+"""
+
+def json_text(value):
+    """value as metadata->>'key' would return it"""
+    if value is None or isinstance(value, str):
+        return value
+    return orjson.dumps(value).decode()
+
+def event_row(event: dict) -> tuple:
+    """A prepared event (see ingest.prepare_event) as a LOAD_QUERY row"""
+    metadata = event["metadata"] or {}
+    campaign = json_text(metadata.get("campaign"))
+    if campaign is None:
+        campaign = event["utm_campaign"] if event["utm_campaign"] is not None else "direct"
+    return (
+        (event["timestamp"] - EPOCH) // MICROSECOND,
+        event["event_type"],
+        campaign,
+        event["utm_source"],
+        event["device"],
+        json_text(metadata.get("landing")) == "true",
+        event["revenue"],
+        event["session_id"]
+    )
+
+class Dictionary:
+    """Dictionary encoding of one string column: each distinct value gets a small integer"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values) -> np.ndarray:
+        codes = self.codes
+        encoded = []
+        for value in values:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self.values)
+                self.values.append(value)
+            encoded.append(code)
+        return np.array(encoded, dtype=np.int32)
+
+    def code(self, value) -> int:
+        """value's code, or -1 if it has never been seen"""
+        return self.codes.get(value, -1)
+
+class HotWindow:
+    """The last N hours of events in memory as NumPy column arrays, with string columns
+    dictionary-encoded, and the windowed analytics computed from them with vectorized
+    aggregation. Fed by crud's write paths after each commit plus a backfill at startup.
+    """
+
+    def __init__(self, hours=HOT_WINDOW_HOURS, block_rows=HOT_WINDOW_BLOCK_ROWS):
+        self.hours = hours
+        self.block_rows = block_rows
+        self.ready = False
+        self.dictionaries = {name: Dictionary() for name in DICTIONARY_COLUMNS}
+        self.columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMN_TYPES.items()}
+        self.size = 0
+        self.staged = []
+        self.evicted_at = time.monotonic()
+        self.counters = {"appended": 0, "evicted": 0, "queries": 0, "load_ms": 0.0}
+
+    def covers(self, hours: int) -> bool:
+        """Whether a window of this many hours can be answered from memory"""
+        return self.ready and 0 < hours <= self.hours
+
+    async def load(self):
+        """Backfill the window from events; call before the API starts taking writes.
+
+        Reads the primary rather than the read replica, which may lag behind writes
+        the store would then never see.
+        """
+        if self.hours <= 0:
+            return
+        started = time.perf_counter()
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.hours)
+        async with ingest_connection() as conn:
+            # Server-side cursors need the asyncpg connection itself
+            driver = (await conn.get_raw_connection()).driver_connection
+            async with driver.transaction(readonly=True):
+                cursor = await driver.cursor(LOAD_QUERY, cutoff)
+                while records := await cursor.fetch(HOT_WINDOW_LOAD_ROWS):
+                    self.append_block(records)
+        self.ready = True
+        self.counters["load_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        print(f"🔥 Hot window loaded: {self.size:,} events from the last {self.hours}h")
+
+    def append(self, events: list):
+        """Stage newly inserted events (prepared dicts); duplicates must already be dropped"""
+        if not self.ready:
+            return
+        self.staged.extend(event_row(event) for event in events)
+        self.counters["appended"] += len(events)
+        if len(self.staged) >= self.block_rows:
+            self.flush()
+
+    def append_block(self, rows):
+        """Add LOAD_QUERY-shaped rows to the column arrays"""
+        timestamp, event_type, campaign, source, device, landing, revenue, session = zip(*rows)
+        block = {
+            "timestamp": np.array(timestamp, dtype=np.int64),
+            "event_type": self.dictionaries["event_type"].encode(event_type),
+            "campaign": self.dictionaries["campaign"].encode(campaign),
+            "source": self.dictionaries["source"].encode(source),
+            "device": self.dictionaries["device"].encode(device),
+            "landing": np.array(landing, dtype=np.bool_),
+            # None becomes NaN
+            "revenue": np.array(revenue, dtype=np.float64),
+            "session": np.array([NO_SESSION if s is None else hash(s) for s in session], dtype=np.int64)
+        }
+        count = len(rows)
+        start, end = self.size, self.size + count
+        capacity = len(self.columns["timestamp"])
+        if end > capacity:
+            # Grow geometrically, like a list, so appends stay amortized O(1)
+            capacity = max(end, capacity * 2, self.block_rows)
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self.columns[name] = grown
+        for name, values in block.items():
+            self.columns[name][start:end] = values
+        self.size = end
+
+        # Rows stay sorted by timestamp, so a window is a slice. Blocks mostly arrive
+        # in order; late ones only re-sort the tail from where their first row belongs.
+        timestamps = self.columns["timestamp"]
+        if start and timestamps[start] >= timestamps[start - 1] and np.all(np.diff(timestamps[start:end]) >= 0):
+            return
+        first = int(np.searchsorted(timestamps[:start], timestamps[start:end].min(), side="right"))
+        order = np.argsort(timestamps[first:end], kind="stable")
+        for column in self.columns.values():
+            column[first:end] = column[first:end][order]
+
+    def flush(self):
+        """Convert staged events to arrays and drop rows older than the window"""
+        if self.staged:
+            self.append_block(self.staged)
+            self.staged = []
+        if time.monotonic() - self.evicted_at >= HOT_WINDOW_EVICT_S:
+            self.evict()
+
+    def evict(self):
+        first = self.first_row(self.hours)
+        if first:
+            for column in self.columns.values():
+                column[:self.size - first] = column[first:self.size]
+            self.counters["evicted"] += first
+            self.size -= first
+        self.evicted_at = time.monotonic()
+
+    def first_row(self, hours: int) -> int:
+        """Index of the first row at or after the start of the N-hour window"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours) - EPOCH) // MICROSECOND
+        return int(np.searchsorted(self.columns["timestamp"][:self.size], cutoff))
+
+    def window(self, hours: int, *names) -> list:
+        """Views of the named columns over the events in the N-hour window"""
+        self.flush()
+        self.counters["queries"] += 1
+        first = self.first_row(hours)
+        return [self.columns[name][first:self.size] for name in names]
+
+    def type_code(self, event_type: str) -> int:
+        return self.dictionaries["event_type"].code(event_type)
+
+    def funnel(self, hours: int) -> dict:
+        """Same result as crud.get_funnel_metrics"""
+        event_types, landing = self.window(hours, "event_type", "landing")
+        counts = np.bincount(event_types, minlength=len(self.dictionaries["event_type"].values))
+
+        def count(event_type):
+            code = self.type_code(event_type)
+            return int(counts[code]) if code >= 0 else 0
+
+        return {
+            "ad_clicks": count("ad_click"),
+            "landings": int(np.count_nonzero(landing & (event_types == self.type_code("page_view")))),
+            "product_views": count("product_view"),
+            "adds": count("add_to_cart"),
+            "purchases": count("purchase")
+        }
+
+    def revenue(self, hours: int) -> dict:
+        """Same result as crud.get_revenue_metrics"""
+        event_types, revenue = self.window(hours, "event_type", "revenue")
+        purchases = revenue[event_types == self.type_code("purchase")]
+        amounts = purchases[~np.isnan(purchases)]
+        total = float(amounts.sum())
+        return {
+            "total_purchases": len(purchases),
+            "total_revenue": total,
+            "avg_order_value": total / len(amounts) if len(amounts) else 0.0,
+            "max_order_value": float(amounts.max()) if len(amounts) else 0.0
+        }
+
+    def timeline(self, hours: int, bucket_s: int) -> list:
+        """Same points as crud's TIMELINE_QUERY, before shape_timeline: the non-empty
+        buckets of bucket_s seconds, aligned to the epoch"""
+        timestamps, event_types, revenue = self.window(hours, "timestamp", "event_type", "revenue")
+        bucket_us = bucket_s * 1_000_000
+        size = len(self.dictionaries["event_type"].values)
+        codes = [self.type_code(event_type) for event_type in
+                 ("ad_click", "page_view", "product_view", "add_to_cart", "purchase")]
+        timeline = []
+        start = 0
+        # Rows are sorted by timestamp, so each non-empty bucket is one slice
+        while start < len(timestamps):
+            bucket = int(timestamps[start]) // bucket_us
+            end = int(np.searchsorted(timestamps, (bucket + 1) * bucket_us))
+            counts = np.bincount(event_types[start:end], minlength=size)
+            series = [int(counts[code]) if code >= 0 else 0 for code in codes]
+            timeline.append({
+                "timestamp": EPOCH + bucket * bucket_us * MICROSECOND,
+                "ad_clicks": series[0],
+                "page_views": series[1],
+                "product_views": series[2],
+                "adds": series[3],
+                "purchases": series[4],
+                "revenue": float(np.nansum(revenue[start:end]))
+            })
+            start = end
+        return timeline
+
+    def campaigns(self, hours: int, limit: int = 10) -> list:
+        """Same result as crud.get_campaign_performance (exact sessions), top campaigns by clicks"""
+        event_types, campaigns, revenue, sessions = self.window(
+            hours, "event_type", "campaign", "revenue", "session"
+        )
+        size = len(self.dictionaries["campaign"].values)
+        purchase = event_types == self.type_code("purchase")
+        clicks = np.bincount(campaigns[event_types == self.type_code("ad_click")], minlength=size)
+        purchases = np.bincount(campaigns[purchase], minlength=size)
+        revenues = np.bincount(campaigns[purchase], weights=np.nan_to_num(revenue[purchase]), minlength=size)
+
+        # Distinct (campaign, session) pairs, each pair folded into one 64-bit key
+        has_session = sessions != NO_SESSION
+        session_campaigns = campaigns[has_session]
+        keys = sessions[has_session].view(np.uint64) ^ (
+            session_campaigns.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        )
+        order = np.argsort(keys)
+        keys = keys[order]
+        first = np.empty(len(keys), dtype=np.bool_)
+        first[:1] = True
+        np.not_equal(keys[1:], keys[:-1], out=first[1:])
+        session_counts = np.bincount(session_campaigns[order[first]], minlength=size)
+
+        present = np.unique(campaigns)
+        top = present[np.argsort(-clicks[present], kind="stable")][:limit]
+        names = self.dictionaries["campaign"].values
+        return [
+            {
+                "campaign": names[code],
+                "clicks": int(clicks[code]),
+                "sessions": int(session_counts[code]),
+                "purchases": int(purchases[code]),
+                "revenue": float(revenues[code]),
+                "refreshed_at": None
+            }
+            for code in top
+        ]
+
+    def stats(self) -> dict:
+        allocated = sum(column.nbytes for column in self.columns.values())
+        return {
+            "hours": self.hours,
+            "ready": self.ready,
+            "events": self.size + len(self.staged),
+            "allocated_mb": round(allocated / 1e6, 2),
+            "bytes_per_event": sum(np.dtype(dtype).itemsize for dtype in COLUMN_TYPES.values()),
+            "dictionary_sizes": {name: len(d.values) for name, d in self.dictionaries.items()},
+            **self.counters
+        }
+
+hot_window = HotWindow()
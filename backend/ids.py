@@ -0,0 +1,24 @@
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+def uuid7(timestamp_ns: int = None) -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 version 7).
+
+    The top 48 bits are the Unix time in milliseconds and the next 12 bits hold
+    the sub-millisecond fraction, so ids generated by one process sort in
+    creation order and new rows land at the right edge of the primary key index.
+    """
+    ns = time.time_ns() if timestamp_ns is None else timestamp_ns
+    ms, sub_ms = divmod(ns, 1_000_000)
+    rand_a = sub_ms * 4096 // 1_000_000
+    rand_b = int.from_bytes(os.urandom(8), "big") & 0x3FFF_FFFF_FFFF_FFFF
+    value = (ms & 0xFFFF_FFFF_FFFF) << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b
+    return uuid.UUID(int=value)
+
+def uuid7_time(value: uuid.UUID):
+    """Creation time embedded in a UUIDv7, or None for other versions"""
+    if value.version != 7:
+        return None
+    return datetime.fromtimestamp((value.int >> 80) / 1000, timezone.utc)
@@ -0,0 +1,129 @@
+import os
+import zlib
+from datetime import datetime, timezone
+from pydantic import ValidationError
+from .models import EventCreate
+from .ids import uuid7, uuid7_time
+
+# Rows per COPY transaction for NDJSON uploads
+NDJSON_CHUNK_ROWS = int(os.getenv("NDJSON_CHUNK_ROWS", "5000"))
+
+# Longest line accepted; anything bigger is rejected without being buffered
+NDJSON_MAX_LINE_BYTES = int(os.getenv("NDJSON_MAX_LINE_BYTES", str(1 << 20)))
+
+# Per-line errors kept in the summary; further rejects are only counted
+NDJSON_MAX_ERRORS = int(os.getenv("NDJSON_MAX_ERRORS", "1000"))
+
+# Cap on bytes produced per decompress call, so a small gzip body can't inflate all at once
+INFLATE_STEP_BYTES = 1 << 20
+
+def parse_event(body: bytes) -> EventCreate:
+    """Validate a JSON event straight from bytes (one parse, no intermediate dict)"""
+    return EventCreate.model_validate_json(body)
+
+def prepare_event(event: EventCreate, received_at: datetime = None) -> dict:
+    """Convert a validated event into insert parameters.
+
+    Fields are read off the model rather than copied with .dict(), and metadata
+    stays a dict: the engines bind it as jsonb with orjson (see db.py). Events
+    without a timestamp get received_at (default now), so repeats within one
+    request share it. claim_id marks client ids that then can't be deduplicated
+    by the (id, timestamp) key (see crud.claim_client_ids).
+    """
+    timestamp = event.timestamp
+    if timestamp is None and event.event_id:
+        # The timestamp is part of the primary key, so a retried event has to get
+        # the same one; a client UUIDv7 carries its own creation time
+        timestamp = uuid7_time(event.event_id)
+    claim_id = timestamp is None and event.event_id is not None
+    if timestamp is None:
+        timestamp = received_at or datetime.now(timezone.utc)
+    elif timestamp.tzinfo is None:
+        # Naive client timestamps are UTC
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return {
+        "id": event.event_id or uuid7(),
+        "event_type": event.event_type,
+        "timestamp": timestamp,
+        "session_id": event.session_id,
+        "user_id": event.user_id,
+        "page_url": event.page_url,
+        "utm_source": event.utm_source,
+        "utm_medium": event.utm_medium,
+        "utm_campaign": event.utm_campaign,
+        "platform": event.platform,
+        "device": event.device,
+        "revenue": event.revenue,
+        "metadata": event.metadata,
+        "claim_id": claim_id
+    }
+
+async def inflate(stream):
+    """Gunzip an async byte stream incrementally, including concatenated members"""
+    inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    async for data in stream:
+        while data:
+            yield inflater.decompress(data, INFLATE_STEP_BYTES)
+            data = inflater.unconsumed_tail
+            if inflater.eof and inflater.unused_data:
+                data = inflater.unused_data
+                inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if not inflater.eof:
+        raise zlib.error("gzip stream ended early")
+
+async def read_lines(stream):
+    """Split an async byte stream into (line_number, line) pairs.
+
+    Oversized lines come back as None, without ever being held whole.
+    """
+    pending = bytearray()
+    number = 0
+    oversized = False
+    async for data in stream:
+        pending += data
+        while True:
+            end = pending.find(b"\n")
+            if end < 0:
+                break
+            number += 1
+            yield number, None if oversized or end > NDJSON_MAX_LINE_BYTES else bytes(pending[:end])
+            del pending[:end + 1]
+            oversized = False
+        if len(pending) > NDJSON_MAX_LINE_BYTES:
+            # Keep discarding until the newline that ends this line
+            oversized = True
+            pending.clear()
+    if pending or oversized:
+        yield number + 1, None if oversized else bytes(pending)
+
+def reject(summary: dict, line: int, error: str):
+    summary["rejected"] += 1
+    if len(summary["errors"]) < NDJSON_MAX_ERRORS:
+        summary["errors"].append({"line": line, "error": error})
+
+async def ndjson_chunks(stream, summary: dict, gzip: bool = False, chunk_rows: int = NDJSON_CHUNK_ROWS):
+    """Parse an NDJSON byte stream into lists of insert parameters of at most chunk_rows.
+
+    Line counts and per-line errors are recorded in summary as parsing goes.
+    """
+    if gzip:
+        stream = inflate(stream)
+    received_at = datetime.now(timezone.utc)
+    chunk = []
+    async for number, line in read_lines(stream):
+        summary["lines"] = number
+        if line is None:
+            reject(summary, number, f"Line longer than {NDJSON_MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+        try:
+            chunk.append(prepare_event(parse_event(line), received_at))
+        except ValidationError as e:
+            reject(summary, number, str(e))
+            continue
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from .crud import create_events, write_isolating
+from .dedupe import recent_ids
+
+# "direct" writes each event in its own transaction, "buffered" goes through IngestBuffer
+INGEST_MODE = os.getenv("INGEST_MODE", "direct")
+
+# Bounded queue size; producers get BufferFull instead of growing memory without limit
+BUFFER_MAX_ROWS = int(os.getenv("BUFFER_MAX_ROWS", "10000"))
+
+# Flush when this many rows are waiting...
+BUFFER_FLUSH_ROWS = int(os.getenv("BUFFER_FLUSH_ROWS", "500"))
+
+# ...or when the oldest waiting row is this old
+BUFFER_FLUSH_MS = int(os.getenv("BUFFER_FLUSH_MS", "50"))
+
+# "enqueue" acks as soon as the event is queued, "flush" waits until it is committed
+BUFFER_ACK = os.getenv("BUFFER_ACK", "enqueue")
+
+# A flush that fails for any reason but its rows (a dropped connection, a failover) is
+# retried this many times, the delay doubling from BUFFER_RETRY_BACKOFF_MS, before its
+# events are failed. With a spool, failed flushes are spooled right away instead.
+BUFFER_FLUSH_RETRIES = int(os.getenv("BUFFER_FLUSH_RETRIES", "3"))
+BUFFER_RETRY_BACKOFF_MS = int(os.getenv("BUFFER_RETRY_BACKOFF_MS", "100"))
+
+# How long a request waits for its flush when BUFFER_ACK=flush
+BUFFER_ACK_TIMEOUT_S = float(os.getenv("BUFFER_ACK_TIMEOUT_S", "5"))
+
+_STOP = object()
+
+class BufferFull(Exception):
+    """Raised when the ingest queue is at capacity"""
+
+class IngestBuffer:
+    """Bounded in-memory queue drained into the events table in batches by a background task"""
+
+    def __init__(self, max_rows=BUFFER_MAX_ROWS, flush_rows=BUFFER_FLUSH_ROWS,
+                 flush_ms=BUFFER_FLUSH_MS, writer=create_events, spool=None,
+                 retries=BUFFER_FLUSH_RETRIES, retry_backoff_ms=BUFFER_RETRY_BACKOFF_MS):
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000
+        self.writer = writer
+        self.retries = retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        # Failed flushes go to the spool (when enabled) instead of failing their events
+        self.spool = spool
+        self.queue = None
+        self.task = None
+        self.counters = {
+            "enqueued": 0,
+            "rejected": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "failed_rows": 0,
+            "flush_retries": 0,
+            "db_rejected_rows": 0,
+            "spooled_rows": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0
+        }
+
+    def start(self):
+        """Start the flusher task on the running event loop"""
+        self.queue = asyncio.Queue(maxsize=self.max_rows)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 30):
+        """Stop accepting new work and drain everything already queued"""
+        if self.task is None:
+            return
+        # The flusher keeps draining, so this put cannot block for long even when full
+        await self.queue.put(_STOP)
+        await asyncio.wait_for(self.task, timeout)
+        self.task = None
+
+    def submit(self, event: dict) -> asyncio.Future:
+        """Queue an event; the returned future resolves once it is committed"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((event, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise BufferFull(f"Ingest buffer is full ({self.max_rows} events)")
+        self.counters["enqueued"] += 1
+        return future
+
+    def fill(self) -> float:
+        """Fraction of queue capacity in use, as an admission control signal"""
+        return self.queue.qsize() / self.max_rows if self.queue else 0.0
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and flush counters"""
+        queued = self.queue.qsize() if self.queue else 0
+        return {"queued": queued, "capacity": self.max_rows, **self.counters}
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+
+            # Collect until the batch is full or the first row has waited flush_interval
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Graceful drain: anything enqueued before stop() still gets written
+        leftover = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.flush_rows):
+            await self._flush(leftover[start:start + self.flush_rows])
+
+    async def _write(self, events: list):
+        """write_isolating, retrying other failures with backoff unless there is a spool"""
+        backoff = self.retry_backoff
+        for _ in range(0 if self.spool else self.retries):
+            try:
+                return await write_isolating(self.writer, events)
+            except Exception as e:
+                print(f"⚠️ Ingest buffer flush of {len(events)} events failed, retrying in {backoff * 1000:.0f} ms: {e}")
+                self.counters["flush_retries"] += 1
+                await asyncio.sleep(backoff)
+                backoff *= 2
+        return await write_isolating(self.writer, events)
+
+    async def _flush(self, batch):
+        events = [event for event, _ in batch]
+        started = time.perf_counter()
+        try:
+            # Rows the database rejects are split out, so they only fail themselves
+            inserted, rejected = await self._write(events)
+        except Exception as e:
+            print(f"❌ Ingest buffer flush of {len(batch)} events failed: {e}")
+            if self.spool and await self._spool(batch):
+                return
+            self.counters["failed_rows"] += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    # Nobody awaits the future in enqueue-ack mode; mark it retrieved
+                    future.exception()
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        errors = {id(event): error for event, error in rejected}
+        if rejected:
+            print(f"❌ {len(rejected)} buffered events rejected by the database: {rejected[0][1]}")
+            self.counters["db_rejected_rows"] += len(rejected)
+        recent_ids.record_conflicts(len(events) - len(rejected) - inserted)
+        for event, future in batch:
+            if future.done():
+                continue
+            if id(event) in errors:
+                future.set_exception(errors[id(event)])
+                future.exception()
+            else:
+                future.set_result(None)
+        self.counters["flushed_rows"] += len(batch) - len(rejected)
+        self.counters["flushes"] += 1
+        self.counters["last_flush_rows"] = len(batch)
+        self.counters["last_flush_ms"] = round(elapsed_ms, 2)
+
+    async def _spool(self, batch) -> bool:
+        try:
+            await asyncio.gather(*(self.spool.append(event) for event, _ in batch))
+        except Exception as e:
+            print(f"❌ Spooling {len(batch)} events failed: {e}")
+            return False
+        self.counters["spooled_rows"] += len(batch)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+        return True
@@ -0,0 +1,185 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+import orjson
+from .hot_window import json_text
+
+# Events committed within one tick are summed into a single message per subscriber
+LIVE_TICK_MS = int(os.getenv("LIVE_TICK_MS", "1000"))
+
+# Newest events included in each message
+LIVE_EVENTS_PER_TICK = int(os.getenv("LIVE_EVENTS_PER_TICK", "20"))
+
+# Messages queued per subscriber; one that falls this far behind is disconnected
+# (its client reconnects and reloads full totals) instead of holding up the others
+LIVE_SUBSCRIBER_QUEUE = int(os.getenv("LIVE_SUBSCRIBER_QUEUE", "100"))
+
+# Largest number of concurrent /api/live streams; more get 503
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "1000"))
+
+# Idle streams get an SSE comment this often, so proxies don't time them out
+LIVE_KEEPALIVE_S = float(os.getenv("LIVE_KEEPALIVE_S", "15"))
+
+# Funnel counter each event type adds to (landings are page views with landing set)
+FUNNEL_COUNTERS = {
+    "ad_click": "ad_clicks",
+    "product_view": "product_views",
+    "add_to_cart": "adds",
+    "purchase": "purchases"
+}
+
+_CLOSED = object()
+
+def empty_delta() -> dict:
+    return {
+        "total_events": 0,
+        "funnel": {"ad_clicks": 0, "landings": 0, "product_views": 0, "adds": 0, "purchases": 0},
+        "revenue": {"total_purchases": 0, "total_revenue": 0.0, "revenue_count": 0, "max_order_value": 0.0},
+        "recent_events": []
+    }
+
+def live_event(event: dict) -> dict:
+    """A prepared event (see ingest.prepare_event) in crud.recent_event's shape"""
+    metadata = event["metadata"] or {}
+    return {
+        "event_type": event["event_type"],
+        "user_id": event["user_id"],
+        "session_id": event["session_id"],
+        "campaign": event["utm_campaign"] or "direct",
+        "revenue": float(event["revenue"] or 0),
+        "product_name": json_text(metadata.get("product_name")),
+        "user_email": json_text(metadata.get("user_email")),
+        "user_name": json_text(metadata.get("user_name")),
+        "timestamp": event["timestamp"].isoformat()
+    }
+
+class LiveMetrics:
+    """Single producer of the /api/live Server-Sent Events stream.
+
+    Every committed write publishes its new events here (see crud), where they
+    are folded into one pending delta: funnel counts, purchases and revenue,
+    event count and the newest events. Once per tick a non-empty delta is
+    encoded once and queued for every subscriber, so the cost of a tick doesn't
+    depend on the dashboard window and encoding doesn't grow with subscribers.
+
+    Each process only sees its own writes, like the hot window.
+    """
+
+    def __init__(self, tick_ms=LIVE_TICK_MS, events_per_tick=LIVE_EVENTS_PER_TICK,
+                 queue_size=LIVE_SUBSCRIBER_QUEUE, max_subscribers=LIVE_MAX_SUBSCRIBERS,
+                 keepalive_s=LIVE_KEEPALIVE_S):
+        self.tick_s = tick_ms / 1000
+        self.events_per_tick = events_per_tick
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.keepalive_s = keepalive_s
+        self.subscribers = set()
+        self.pending = None
+        self.sequence = 0
+        self.task = None
+        self.counters = {
+            "published_events": 0,
+            "ticks": 0,
+            "messages": 0,
+            "dropped_subscribers": 0
+        }
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        for queue in list(self.subscribers):
+            self._close(queue)
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def full(self) -> bool:
+        return len(self.subscribers) >= self.max_subscribers
+
+    def publish(self, events: list):
+        """Fold newly inserted events (prepared dicts) into the pending delta"""
+        if not events or not self.subscribers:
+            return
+        delta = self.pending or empty_delta()
+        funnel, revenue = delta["funnel"], delta["revenue"]
+        for event in events:
+            event_type = event["event_type"]
+            counter = FUNNEL_COUNTERS.get(event_type)
+            if counter:
+                funnel[counter] += 1
+            if event_type == "page_view" and json_text((event["metadata"] or {}).get("landing")) == "true":
+                funnel["landings"] += 1
+            if event_type == "purchase" and event["revenue"] is not None:
+                amount = float(event["revenue"])
+                revenue["total_revenue"] += amount
+                revenue["revenue_count"] += 1
+                revenue["max_order_value"] = max(revenue["max_order_value"], amount)
+        revenue["total_purchases"] = funnel["purchases"]
+        delta["total_events"] += len(events)
+        # Newest first, like recent_events
+        newest = [live_event(event) for event in reversed(events[-self.events_per_tick:])]
+        delta["recent_events"] = (newest + delta["recent_events"])[:self.events_per_tick]
+        self.pending = delta
+        self.counters["published_events"] += len(events)
+
+    async def stream(self):
+        """Server-Sent Events for one subscriber, until it disconnects or falls behind"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        try:
+            # Clients reconnect after this many milliseconds if the stream drops
+            yield b"retry: 2000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.keepalive_s)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if message is _CLOSED:
+                    return
+                yield message
+        finally:
+            self.subscribers.discard(queue)
+
+    def _close(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        # Make room for the sentinel; the subscriber is going away anyway
+        while queue.full():
+            queue.get_nowait()
+        queue.put_nowait(_CLOSED)
+
+    def _broadcast(self, delta: dict):
+        self.sequence += 1
+        delta["sequence"] = self.sequence
+        delta["at"] = datetime.now(timezone.utc).isoformat()
+        message = b"id: %d\nevent: metrics\ndata: %s\n\n" % (self.sequence, orjson.dumps(delta))
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+                self.counters["messages"] += 1
+            except asyncio.QueueFull:
+                self.counters["dropped_subscribers"] += 1
+                self._close(queue)
+        self.counters["ticks"] += 1
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.tick_s)
+            if self.pending is not None:
+                delta, self.pending = self.pending, None
+                self._broadcast(delta)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "tick_ms": round(self.tick_s * 1000),
+            **self.counters
+        }
+
+live_metrics = LiveMetrics()
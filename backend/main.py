@@ -1,20 +1,108 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 from .models import EventCreate, FunnelMetrics, InsightsRequest, InsightsResponse
 from .crud import (
     create_event,
+    create_events,
+    copy_events,
     get_funnel_metrics,
+    get_ordered_funnel,
     get_user_analytics,
     get_campaign_performance,
+    get_breakdown,
+    get_product_revenue,
     get_revenue_metrics,
     get_event_timeline,
-    get_recent_events
+    TIMELINE_INTERVALS,
+    TIMELINE_MAX_POINTS,
+    get_recent_events,
+    get_dashboard,
+    stream_events,
+    decode_cursor,
+    encode_cursor,
+    rejected_by_postgres
 )
+from .db import dispose_engines, pool_stats
+from .dedupe import recent_ids
+from .cache import bypass_cache, result_cache
+from .ingest import parse_event, prepare_event, ndjson_chunks
 from .openai_client import generate_insights
-import json
-from datetime import datetime
+from .ingest_buffer import (
+    INGEST_MODE,
+    BUFFER_ACK,
+    BUFFER_ACK_TIMEOUT_S,
+    IngestBuffer,
+    BufferFull
+)
+from .admission import ADMISSION_RETRY_AFTER_S, AdmissionControl, Shed
+from .spool import SPOOL_DIR, SPOOL_WRITE_BUDGET_MS, Spool
+from .partitions import PartitionMaintenance
+from .export import EXPORT_FORMATS, EXPORT_MAX_DAYS, export_events
+from .hot_window import hot_window
+from .matviews import MATVIEW_REFRESHER, MatviewRefresher
+from .live import live_metrics
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import asyncio
+import orjson
+import os
+import time
+import zlib
+
+# Largest array accepted by /api/track/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "5000"))
+
+# Largest page served by /api/events
+EVENTS_PAGE_MAX_ROWS = int(os.getenv("EVENTS_PAGE_MAX_ROWS", "10000"))
+
+# Largest max_points accepted by /api/event_timeline
+TIMELINE_POINTS_LIMIT = int(os.getenv("TIMELINE_POINTS_LIMIT", "10000"))
+
+# Largest top_k accepted by /api/breakdown
+BREAKDOWN_MAX_TOP_K = int(os.getenv("BREAKDOWN_MAX_TOP_K", "1000"))
 
-app = FastAPI(title="AI Customer Journey Tracker")
+# Events serialized per chunk of a streamed /api/events response
+EVENTS_RESPONSE_CHUNK = 100
+
+spool = Spool() if SPOOL_DIR else None
+ingest_buffer = IngestBuffer(spool=spool) if INGEST_MODE == "buffered" else None
+
+admission = AdmissionControl()
+if ingest_buffer:
+    admission.add_signal("buffer", ingest_buffer.fill)
+
+partition_maintenance = PartitionMaintenance()
+matview_refresher = MatviewRefresher()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        # Before the spool or buffer replay any writes, so the backfill doesn't race them
+        await hot_window.load()
+    except Exception as e:
+        print(f"❌ Hot window load failed, analytics will query Postgres: {e}")
+    partition_maintenance.start()
+    live_metrics.start()
+    if MATVIEW_REFRESHER == "api":
+        matview_refresher.start()
+    if spool:
+        spool.start()
+    if ingest_buffer:
+        ingest_buffer.start()
+    yield
+    if ingest_buffer:
+        await ingest_buffer.stop()
+    if spool:
+        await spool.stop()
+    await matview_refresher.stop()
+    await live_metrics.stop()
+    await partition_maintenance.stop()
+    await dispose_engines()
+
+app = FastAPI(title="AI Customer Journey Tracker", lifespan=lifespan)
 
 # CORS for demo site and dashboard
 app.add_middleware(
@@ -30,31 +118,234 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/api/track")
-def track_event(event: EventCreate):
+@app.middleware("http")
+async def cache_control(request: Request, call_next):
+    """Cache-Control: no-cache on a request skips cached analytics results"""
+    if "no-cache" in request.headers.get("cache-control", ""):
+        bypass_cache.set(True)
+    return await call_next(request)
+
+@app.exception_handler(Shed)
+async def shed_handler(request: Request, exc: Shed):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(ADMISSION_RETRY_AFTER_S)}
+    )
+
+def json_response(content) -> Response:
+    """Serialize with orjson directly, skipping FastAPI's jsonable_encoder pass"""
+    return Response(orjson.dumps(content), media_type="application/json")
+
+def request_schema(schema: dict) -> dict:
+    """openapi_extra for endpoints that read and validate the raw body themselves"""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+# The ingest endpoints take the raw body: pydantic-core validates the JSON bytes
+# in one pass instead of json.loads followed by model construction
+@app.post("/api/track", openapi_extra=request_schema(EventCreate.model_json_schema()))
+async def track_event(request: Request):
     """Ingest a single event"""
+    body = await request.body()
+    try:
+        event = parse_event(body)
+    except ValidationError as e:
+        # Same shape as FastAPI's own 422s
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
+    with admission.admit(admission.tier_for(event.event_type)):
+        return json_response(await ingest_event(event))
+
+async def ingest_event(event: EventCreate) -> dict:
+    """Write (or buffer, or spool) one validated event"""
+    # Retried client events are acked without touching the database
+    if event.event_id and recent_ids.seen(event.event_id):
+        return {"ok": True, "id": str(event.event_id), "duplicate": True}
+
+    event_dict = prepare_event(event)
+    if ingest_buffer:
+        return await buffer_event(event, event_dict)
+    if spool and spool.degraded:
+        return await spool_event(event, event_dict)
+    try:
+        inserted = await write_event(event_dict)
+    except Exception as e:
+        if rejected_by_postgres(e):
+            # Spooling wouldn't help: the replay would be rejected the same way
+            raise HTTPException(status_code=422, detail=str(getattr(e, "orig", e)))
+        if not spool:
+            raise HTTPException(status_code=500, detail=str(e))
+        print(f"⚠️ Spooling events, database write failed or was slow: {e!r}")
+        spool.degraded = True
+        return await spool_event(event, event_dict)
+
+    if event.event_id:
+        recent_ids.remember(event.event_id, conflict=not inserted)
+    response = {"ok": True, "id": str(event_dict['id'])}
+    if not inserted:
+        response["duplicate"] = True
+    return response
+
+async def write_event(event_dict: dict) -> bool:
+    """create_event, bounded by SPOOL_WRITE_BUDGET_MS when the spool is enabled"""
+    if not spool:
+        return await create_event(event_dict)
+    # Shielded so a slow write finishes in the background instead of being cancelled
+    # mid-query; if it lands after all, replaying the spooled copy is a no-op
+    write = asyncio.ensure_future(create_event(event_dict))
+    write.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return await asyncio.wait_for(asyncio.shield(write), SPOOL_WRITE_BUDGET_MS / 1000)
+
+async def spool_event(event: EventCreate, event_dict: dict):
+    """Append an event to the local spool; the replayer loads it once the database recovers"""
+    try:
+        await spool.append(event_dict)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if event.event_id:
+        recent_ids.remember(event.event_id)
+    return {"ok": True, "id": str(event_dict['id']), "spooled": True}
+
+async def buffer_event(event: EventCreate, event_dict: dict):
+    """Hand an event to the ingest buffer and ack according to BUFFER_ACK"""
+    try:
+        future = ingest_buffer.submit(event_dict)
+    except BufferFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(ADMISSION_RETRY_AFTER_S)})
+
+    event_id = str(event_dict['id'])
+    if BUFFER_ACK != "flush":
+        # Remembered at enqueue time: the client is acked now
+        if event.event_id:
+            recent_ids.remember(event.event_id)
+        return {"ok": True, "id": event_id, "queued": True}
+    try:
+        await asyncio.wait_for(future, BUFFER_ACK_TIMEOUT_S)
+    except Exception as e:
+        if rejected_by_postgres(e):
+            raise HTTPException(status_code=422, detail=str(getattr(e, "orig", e)))
+        raise HTTPException(status_code=500, detail=str(e))
+    # Only once committed, so the retry of a failed flush is written rather than acked
+    if event.event_id:
+        recent_ids.remember(event.event_id)
+    return {"ok": True, "id": event_id}
+
+@app.post(
+    "/api/track/batch",
+    openapi_extra=request_schema({"type": "array", "items": EventCreate.model_json_schema()})
+)
+async def track_events_batch(request: Request):
+    """Ingest an array of events in a single transaction"""
+    # Checked before the body is read, so shed requests cost almost nothing
+    with admission.admit("bulk"):
+        return await ingest_batch(await request.body())
+
+async def ingest_batch(body: bytes):
+    """Validate and write a JSON array of events, reporting per-item results"""
     try:
-        event_dict = event.dict()
-        if event_dict['timestamp'] is None:
-            event_dict['timestamp'] = datetime.utcnow()
+        events = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    if len(events) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch of {len(events)} events exceeds limit of {MAX_BATCH_SIZE}"
+        )
+
+    # Validate everything up front so one bad item doesn't abort the write
+    results = []
+    rows = []
+    client_ids = []
+    rejected = 0
+    received_at = datetime.now(timezone.utc)
+    for index, item in enumerate(events):
+        try:
+            event = EventCreate.model_validate(item)
+        except ValidationError as e:
+            results.append({"index": index, "ok": False, "error": str(e)})
+            rejected += 1
+            continue
 
-        # Convert metadata dict to JSON string for postgres
-        event_dict['metadata'] = json.dumps(event_dict['metadata'])
+        # Repeats within the batch itself are left to ON CONFLICT DO NOTHING
+        if event.event_id and recent_ids.seen(event.event_id):
+            results.append({"index": index, "ok": True, "id": str(event.event_id), "duplicate": True})
+            continue
+        if event.event_id:
+            client_ids.append(event.event_id)
+        row = prepare_event(event, received_at)
+        rows.append(row)
+        results.append({"index": index, "ok": True, "id": str(row['id'])})
 
-        event_id = create_event(event_dict)
-        return {"ok": True, "id": str(event_id)}
+    try:
+        started = time.perf_counter()
+        inserted = await create_events(rows)
+        elapsed = time.perf_counter() - started
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    for client_id in client_ids:
+        recent_ids.remember(client_id)
+    recent_ids.record_conflicts(len(rows) - inserted)
+
+    return json_response({
+        "ok": True,
+        "accepted": inserted,
+        "rejected": rejected,
+        "duplicates": len(events) - rejected - inserted,
+        "results": results,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "rows_per_sec": round(len(rows) / elapsed, 1) if rows and elapsed > 0 else 0
+    })
+
+@app.post("/api/track/ndjson")
+async def track_events_ndjson(request: Request):
+    """Stream newline-delimited JSON events (optionally gzip) into the database via COPY"""
+    with admission.admit("bulk"):
+        return await ingest_ndjson(request)
+
+async def ingest_ndjson(request: Request):
+    """Parse the streamed body and COPY it in chunks, summarizing accepted and rejected lines"""
+    gzip = request.headers.get("content-encoding", "").lower() == "gzip"
+    summary = {"lines": 0, "rejected": 0, "errors": []}
+    started = time.perf_counter()
+    try:
+        written = await copy_events(ndjson_chunks(request.stream(), summary, gzip=gzip))
+    except zlib.error as e:
+        # Chunks before the corrupt point are already committed
+        raise HTTPException(status_code=400, detail={"error": f"Invalid gzip body: {e}", **summary})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={"error": str(e), **summary})
+    elapsed = time.perf_counter() - started
+
+    # Bulk backfills skip the recent-id front-check so they don't evict live retries
+    return {
+        "ok": True,
+        **written,
+        **summary,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "rows_per_sec": round(written["accepted"] / elapsed, 1) if elapsed > 0 else 0
+    }
+
 @app.get("/api/funnel", response_model=FunnelMetrics)
-def get_funnel(hours: int = 168):
+async def get_funnel(hours: int = 168):
     """Get funnel metrics for the past N hours"""
     try:
-        metrics = get_funnel_metrics(hours)
+        metrics = await get_funnel_metrics(hours)
         return metrics
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/ordered_funnel")
+async def get_ordered(hours: int = 168, campaign: str = None):
+    """Sessions that went ad_click -> product_view -> add_to_cart -> purchase in order"""
+    try:
+        return await get_ordered_funnel(hours, campaign)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Left sync on purpose: the OpenAI client blocks, so FastAPI runs this in its threadpool
 @app.post("/api/generate_insights", response_model=InsightsResponse)
 def get_insights(request: InsightsRequest):
     """Generate AI insights from metrics"""
@@ -65,50 +356,170 @@ def get_insights(request: InsightsRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/user_analytics")
-def get_users(hours: int = 168):
-    """Get user analytics for the past N hours"""
+async def get_users(hours: int = 168, approx: bool = False, precomputed: bool = False):
+    """Get user analytics for the past N hours; approx=true estimates distinct counts from sketches,
+    precomputed=true accepts them from a materialized view up to MATVIEW_MAX_STALENESS_S old"""
     try:
-        analytics = get_user_analytics(hours)
+        analytics = await get_user_analytics(hours, approx, precomputed)
         return analytics
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/campaign_performance")
-def get_campaigns(hours: int = 168):
-    """Get campaign performance metrics"""
+async def get_campaigns(hours: int = 168, approx: bool = False, precomputed: bool = False):
+    """Get campaign performance metrics; approx=true estimates sessions from sketches,
+    precomputed=true accepts them from a materialized view up to MATVIEW_MAX_STALENESS_S old"""
     try:
-        campaigns = get_campaign_performance(hours)
+        campaigns = await get_campaign_performance(hours, approx, precomputed)
         return campaigns
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/breakdown")
+async def get_breakdown_data(hours: int = 168, dimensions: str = "campaign", cube: bool = False,
+                             top_k: int = 10, sort: str = "clicks"):
+    """Clicks, sessions, purchases and revenue broken down by any of campaign, utm_source,
+    utm_medium, device and platform (comma-separated), each breakdown's top_k groups by sort"""
+    if not 1 <= top_k <= BREAKDOWN_MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {BREAKDOWN_MAX_TOP_K}")
+    # Duplicates dropped, order kept
+    names = tuple(dict.fromkeys(name.strip() for name in dimensions.split(",") if name.strip()))
+    try:
+        return await get_breakdown(hours, names, cube, top_k, sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/product_revenue")
+async def get_products(hours: int = 168, limit: int = 10, precomputed: bool = False):
+    """Get purchases and revenue per product; precomputed=true accepts them from a
+    materialized view up to MATVIEW_MAX_STALENESS_S old"""
+    try:
+        return await get_product_revenue(hours, limit, precomputed)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/revenue_metrics")
-def get_revenue(hours: int = 168):
+async def get_revenue(hours: int = 168):
     """Get revenue metrics"""
     try:
-        revenue = get_revenue_metrics(hours)
+        revenue = await get_revenue_metrics(hours)
         return revenue
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/event_timeline")
-def get_timeline(hours: int = 168):
-    """Get event timeline data"""
+async def get_timeline(hours: int = 168, interval: str = None, max_points: int = TIMELINE_MAX_POINTS):
+    """Get event timeline data in minute, 5min, hour or day buckets, at most max_points of them"""
+    if interval is not None and interval not in TIMELINE_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(TIMELINE_INTERVALS)}")
+    if not 3 <= max_points <= TIMELINE_POINTS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"max_points must be between 3 and {TIMELINE_POINTS_LIMIT}")
     try:
-        timeline = get_event_timeline(hours)
+        timeline = await get_event_timeline(hours, interval, max_points)
         return timeline
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/recent_events")
-def get_recent(limit: int = 20):
+async def get_recent(limit: int = 20):
     """Get most recent events"""
     try:
-        events = get_recent_events(limit)
+        events = await get_recent_events(limit)
         return events
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/events")
+async def browse_events(limit: int = 100, cursor: str = None, event_type: str = None,
+                        campaign: str = None, session_id: str = None, user_id: str = None):
+    """Raw events newest first, a page at a time; pass next_cursor back as cursor for the next page"""
+    if not 1 <= limit <= EVENTS_PAGE_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {EVENTS_PAGE_MAX_ROWS}")
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = {"event_type": event_type, "campaign": campaign, "session_id": session_id, "user_id": user_id}
+    return StreamingResponse(events_page_body(limit, filters, position), media_type="application/json")
+
+async def events_page_body(limit: int, filters: dict, position: dict):
+    """{"events": [...], "next_cursor": ...}, written as rows arrive from the database.
+
+    next_cursor is null on the last page. The status line is already sent by the
+    time rows are read, so a failure mid-page truncates the body instead of a 500.
+    """
+    yield b'{"events":['
+    chunk = []
+    last = None
+    count = 0
+    async for event in stream_events(limit, filters, position):
+        chunk.append(orjson.dumps(event))
+        last = event
+        count += 1
+        if len(chunk) == EVENTS_RESPONSE_CHUNK:
+            yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+            chunk = []
+    if chunk:
+        yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+    next_cursor = encode_cursor(last) if count == limit else None
+    yield b'],"next_cursor":' + orjson.dumps(next_cursor) + b"}"
+
+@app.get("/api/export")
+async def export(start: datetime, end: datetime, format: str = "parquet"):
+    """Events in [start, end) as a Parquet file or Arrow IPC stream, for offline analysis"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    # Naive times are UTC, as for tracked events
+    start, end = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (start, end))
+    if not start < end <= start + timedelta(days=EXPORT_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"end must be after start and at most {EXPORT_MAX_DAYS} days later")
+    filename = f"events_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{format}"
+    return StreamingResponse(
+        export_events(start, end, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/api/live")
+async def live_stream():
+    """Server-Sent Events stream of metric deltas (funnel counts, revenue, event count)
+    and the newest events, one message per tick in which events were ingested"""
+    if live_metrics.full():
+        raise HTTPException(status_code=503, detail="Too many live subscribers")
+    return StreamingResponse(
+        live_metrics.stream(),
+        media_type="text/event-stream",
+        # Proxies (nginx) would otherwise buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/dashboard")
+async def get_dashboard_data(hours: int = 168, limit: int = 20, approx: bool = False, precomputed: bool = False):
+    """Funnel, users, campaigns, revenue, timeline and recent events in one response"""
+    try:
+        return await get_dashboard(hours, limit, approx, precomputed)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stats")
+async def get_stats():
+    """Ingest pipeline and connection pool counters"""
+    return {
+        "ingest_mode": INGEST_MODE,
+        "buffer": ingest_buffer.stats() if ingest_buffer else None,
+        "spool": spool.stats() if spool else None,
+        "admission": admission.stats(),
+        "cache": result_cache.stats(),
+        "partitions": partition_maintenance.stats(),
+        "matviews": matview_refresher.stats(),
+        "pools": pool_stats(),
+        "dedupe": recent_ids.stats(),
+        "hot_window": hot_window.stats(),
+        "live": live_metrics.stats()
+    }
+
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from .db import maintenance_session
+
+# Aggregations too costly to compute per request (exact distinct counts and per-product
+# revenue over multi-week windows) are kept in materialized views over events (see
+# scripts/init_db.py), each row computed for one of these windows ending at the
+# view's last refresh. crud reads a view for these windows when it is no older than
+# the endpoint's cache TTL, or than MATVIEW_MAX_STALENESS_S for callers that opt in to
+# precomputed results, and runs its raw query otherwise.
+#
+# Changing the windows means redefining the views: drop them and the next startup
+# recreates them.
+MATVIEW_WINDOWS_HOURS = (168, 720)
+
+# Seconds between refreshes of each view; MATVIEW_REFRESH_INTERVALS overrides them,
+# e.g. "product_revenue=600"
+MATVIEW_REFRESH_INTERVAL_S = {
+    "window_distinct_counts": 300,
+    "product_revenue": 300
+}
+for override in filter(None, os.getenv("MATVIEW_REFRESH_INTERVALS", "").split(",")):
+    name, _, interval = override.partition("=")
+    MATVIEW_REFRESH_INTERVAL_S[name.strip()] = float(interval)
+
+# Views last refreshed longer ago than this are never read, even by callers that opt in
+# to precomputed results; crud falls back to raw queries
+MATVIEW_MAX_STALENESS_S = float(os.getenv("MATVIEW_MAX_STALENESS_S", "900"))
+
+# Where views are refreshed: "api" (a background task in the API process) or "worker"
+# (python scripts/refresh_views.py, for deployments with several API processes)
+MATVIEW_REFRESHER = os.getenv("MATVIEW_REFRESHER", "api")
+
+# Sort memory for refreshes, whose distinct counts spill to disk at the 4MB default
+MATVIEW_WORK_MEM = os.getenv("MATVIEW_WORK_MEM", "64MB")
+
+# Held for the refresh's transaction, so a refresh already running in another process
+# is skipped rather than queued behind
+REFRESH_LOCK_QUERY = text("SELECT pg_try_advisory_xact_lock(hashtext(:view))")
+REFRESH_WORK_MEM_QUERY = text("SELECT set_config('work_mem', :work_mem, true)")
+
+# Every view has a refreshed_at column: now() as of its last refresh
+VIEW_REFRESHED_QUERY = "SELECT MAX(refreshed_at) FROM {view} WHERE window_hours = :window_hours"
+
+async def view_refreshed_at(db, view: str, hours: int, max_age_s: float):
+    """When view's N-hour window was last refreshed, or None if it doesn't hold that
+    window or is older than max_age_s (capped at MATVIEW_MAX_STALENESS_S)"""
+    if hours not in MATVIEW_WINDOWS_HOURS:
+        return None
+    refreshed = (await db.execute(text(VIEW_REFRESHED_QUERY.format(view=view)), {"window_hours": hours})).scalar()
+    max_age_s = min(max_age_s, MATVIEW_MAX_STALENESS_S)
+    if refreshed is None or refreshed < datetime.now(timezone.utc) - timedelta(seconds=max_age_s):
+        return None
+    return refreshed
+
+class MatviewRefresher:
+    """Background task that refreshes each materialized view on its own interval.
+
+    Refreshes are CONCURRENTLY, so reads of a view never wait on one. A refresh
+    still running when the next is due (here or in another process) is left to
+    finish and that turn is skipped.
+    """
+
+    def __init__(self, intervals=MATVIEW_REFRESH_INTERVAL_S):
+        self.intervals = intervals
+        self.tasks = []
+        self.refreshing = {}
+        self.counters = {
+            view: {
+                "refreshes": 0,
+                "skipped": 0,
+                "failures": 0,
+                "last_refresh_at": None,
+                "last_refresh_ms": 0.0
+            }
+            for view in intervals
+        }
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._loop(view)) for view in self.intervals]
+
+    async def stop(self):
+        for task in [*self.tasks, *self.refreshing.values()]:
+            task.cancel()
+        for task in [*self.tasks, *self.refreshing.values()]:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        self.refreshing = {}
+
+    async def refresh(self, view: str) -> bool:
+        """Refresh view once; False if another process was already refreshing it"""
+        counters = self.counters[view]
+        started = time.perf_counter()
+        # Not on the ingest pool: a refresh holds its connection for tens of seconds
+        async with maintenance_session() as db:
+            if not (await db.execute(REFRESH_LOCK_QUERY, {"view": view})).scalar():
+                counters["skipped"] += 1
+                return False
+            await db.execute(REFRESH_WORK_MEM_QUERY, {"work_mem": MATVIEW_WORK_MEM})
+            await db.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+            await db.commit()
+        counters["refreshes"] += 1
+        counters["last_refresh_at"] = datetime.now(timezone.utc).isoformat()
+        counters["last_refresh_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return True
+
+    async def _refresh_logged(self, view: str):
+        try:
+            await self.refresh(view)
+        except Exception as e:
+            print(f"❌ Refreshing {view} failed: {e}")
+            self.counters[view]["failures"] += 1
+
+    async def _loop(self, view: str):
+        while True:
+            running = self.refreshing.get(view)
+            if running and not running.done():
+                self.counters[view]["skipped"] += 1
+            else:
+                self.refreshing[view] = asyncio.create_task(self._refresh_logged(view))
+            await asyncio.sleep(self.intervals[view])
+
+    def stats(self) -> dict:
+        return {
+            "refresher": MATVIEW_REFRESHER,
+            "max_staleness_s": MATVIEW_MAX_STALENESS_S,
+            "views": {
+                view: {
+                    "interval_s": self.intervals[view],
+                    "refreshing": view in self.refreshing and not self.refreshing[view].done(),
+                    **counters
+                }
+                for view, counters in self.counters.items()
+            }
+        }
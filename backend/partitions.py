@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from sqlalchemy import text
+from .cache import result_cache
+from .db import ingest_session
+
+# events is range-partitioned by day (UTC) on timestamp; see scripts/init_db.py.
+# Partitions are created this many days ahead, so inserts never wait on DDL.
+PARTITION_DAYS_AHEAD = int(os.getenv("PARTITION_DAYS_AHEAD", "7"))
+
+# Days of raw events kept; older partitions are dropped whole. 0 keeps everything.
+# Rollup-backed analytics keep their history; distinct users/sessions and recent
+# events only see what is retained, so keep this at least as long as the longest
+# dashboard window (30 days).
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "0"))
+
+# Past days given their own partition when the table is first created; older
+# backfilled events land in events_default
+PARTITION_DAYS_BACK = int(os.getenv("PARTITION_DAYS_BACK", str(EVENTS_RETENTION_DAYS or 30)))
+
+# How often the API creates upcoming partitions and applies retention
+PARTITION_MAINTENANCE_INTERVAL_S = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_S", "3600"))
+
+# Both functions are installed by scripts/init_db.py, so cron or pg_cron can
+# call them just as well
+ENSURE_PARTITIONS_QUERY = text("SELECT ensure_event_partitions(:days_back, :days_ahead)")
+DROP_EXPIRED_PARTITIONS_QUERY = text("SELECT drop_expired_event_partitions(:retention_days)")
+PARTITION_SUMMARY_QUERY = text("""
+    SELECT COUNT(*), MIN(lower_bound), MAX(upper_bound)
+    FROM event_partition_bounds()
+""")
+
+class PartitionMaintenance:
+    """Background task that keeps future partitions created and drops expired ones"""
+
+    def __init__(self, days_ahead=PARTITION_DAYS_AHEAD, retention_days=EVENTS_RETENTION_DAYS,
+                 interval_s=PARTITION_MAINTENANCE_INTERVAL_S):
+        self.days_ahead = days_ahead
+        self.retention_days = retention_days
+        self.interval_s = interval_s
+        self.task = None
+        self.counters = {
+            "runs": 0,
+            "failures": 0,
+            "created": 0,
+            "dropped": 0,
+            "partitions": 0,
+            "oldest": None,
+            "newest": None,
+            "last_run_ms": 0.0
+        }
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self) -> dict:
+        """Create upcoming partitions and drop expired ones, once"""
+        started = time.perf_counter()
+        async with ingest_session() as db:
+            created = (await db.execute(ENSURE_PARTITIONS_QUERY, {
+                "days_back": 0,
+                "days_ahead": self.days_ahead
+            })).scalar()
+            dropped = 0
+            if self.retention_days:
+                dropped = (await db.execute(DROP_EXPIRED_PARTITIONS_QUERY, {
+                    "retention_days": self.retention_days
+                })).scalar()
+            count, oldest, newest = (await db.execute(PARTITION_SUMMARY_QUERY)).one()
+            await db.commit()
+        if dropped:
+            result_cache.note_ingest()
+        self.counters["runs"] += 1
+        self.counters["created"] += created
+        self.counters["dropped"] += dropped
+        self.counters["partitions"] = count
+        self.counters["oldest"] = oldest.isoformat() if oldest else None
+        self.counters["newest"] = newest.isoformat() if newest else None
+        self.counters["last_run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return {"created": created, "dropped": dropped}
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                # Usually a lock timeout behind a long query; the next run catches up
+                print(f"❌ Partition maintenance failed: {e}")
+                self.counters["failures"] += 1
+            await asyncio.sleep(self.interval_s)
+
+    def stats(self) -> dict:
+        return {
+            "days_ahead": self.days_ahead,
+            "retention_days": self.retention_days,
+            **self.counters
+        }
@@ -0,0 +1,7 @@
+# Steps of the ordered funnel. A session reaches a step with its first event of that
+# type after it reached the previous one; session_funnels (see scripts/init_db.py)
+# keeps the time each step was reached, folded in as events arrive.
+#
+# Changing the steps means refolding every session: drop session_funnels and the
+# next startup rebuilds it from events.
+ORDERED_FUNNEL_STEPS = ["ad_click", "product_view", "add_to_cart", "purchase"]
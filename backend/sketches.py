@@ -0,0 +1,20 @@
+# Distinct users and sessions per hour and campaign are kept as HyperLogLog sketches
+# in event_sketches_hourly (see scripts/init_db.py), so approx=true queries merge
+# sketches instead of running COUNT(DISTINCT) over every event in the window.
+#
+# Each sketch has 2^HLL_PRECISION registers. Changing the precision means rebuilding
+# the sketches: drop the table and the next startup backfills it from events.
+HLL_PRECISION = 11
+HLL_REGISTERS = 2 ** HLL_PRECISION
+
+# Relative standard error of an estimate, whatever the window or cardinality: 2.3%,
+# so about 95% of estimates land within ±4.6% of the exact count and 99.7% within ±6.9%.
+HLL_STANDARD_ERROR = 1.04 / HLL_REGISTERS ** 0.5
+
+# What each sketch counts, as stored in event_sketches_hourly.kind
+SKETCH_KINDS = {
+    "total_users": 1,
+    "sessions": 2,
+    "new_users": 3,
+    "returning_users": 4
+}
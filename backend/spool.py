@@ -0,0 +1,229 @@
+import asyncio
+import os
+import time
+import orjson
+from collections import deque
+from datetime import datetime
+from uuid import UUID
+from .crud import create_events, write_isolating
+
+# Directory for the write-ahead spool; unset disables spooling
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
+
+# How long /api/track waits on the database before spooling the event instead
+SPOOL_WRITE_BUDGET_MS = int(os.getenv("SPOOL_WRITE_BUDGET_MS", "200"))
+
+# Appends are acked after a shared fsync; this is how long one fsync waits to batch appends
+SPOOL_FSYNC_MS = int(os.getenv("SPOOL_FSYNC_MS", "10"))
+
+# The active segment is sealed and a new one started past this size
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 << 20)))
+
+# Rows per replay insert, and how long to back off (doubling up to 30s) after a failed replay
+SPOOL_REPLAY_ROWS = int(os.getenv("SPOOL_REPLAY_ROWS", "1000"))
+SPOOL_REPLAY_BACKOFF_S = float(os.getenv("SPOOL_REPLAY_BACKOFF_S", "1"))
+
+# Rows Postgres rejects on replay are moved here (in SPOOL_DIR), one JSON line each with
+# the error and the spooled row, so they can't hold up the segments behind them
+SPOOL_DEAD_LETTER = "dead_letter.jsonl"
+
+def encode_row(event: dict) -> bytes:
+    """Serialize insert parameters as one spool line"""
+    # orjson writes the UUID and datetime natively
+    return orjson.dumps(event) + b"\n"
+
+def decode_row(line: bytes) -> dict:
+    """Inverse of encode_row"""
+    row = orjson.loads(line)
+    row["id"] = UUID(row["id"])
+    row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
+
+class Spool:
+    """Segmented append-only log of events that couldn't be written in time.
+
+    Appends are group-committed: every appender waits for the same fsync, which
+    runs at most every SPOOL_FSYNC_MS. A background task replays sealed segments
+    into the events table and deletes them. Replays are safe to repeat because
+    event ids are assigned before the first write attempt, so rows that did land
+    after all are skipped by ON CONFLICT DO NOTHING. Rows the database rejects
+    outright are isolated and moved to the dead-letter file; any other failure
+    retries the segment with backoff.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES,
+                 fsync_ms=SPOOL_FSYNC_MS, replay_rows=SPOOL_REPLAY_ROWS, writer=create_events):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_ms / 1000
+        self.replay_rows = replay_rows
+        self.writer = writer
+        self.sealed = deque()
+        self.retiring = []
+        self.fd = None
+        self.segment_size = 0
+        self.next_segment = 0
+        self.sync_waiter = None
+        self.task = None
+        # Set when a write misses its budget; /api/track then spools without trying
+        # the database until the replayer has caught up
+        self.degraded = False
+        self.counters = {
+            "depth": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "replay_failures": 0,
+            "corrupt_lines": 0,
+            "dead_lettered": 0,
+            "fsyncs": 0,
+            "last_fsync_ms": 0.0,
+            "replay_rows_per_sec": 0.0
+        }
+
+    def start(self):
+        """Recover segments left by a previous run and start the replayer"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".ndjson"):
+                path = os.path.join(self.directory, name)
+                with open(path, "rb") as segment:
+                    self.counters["depth"] += sum(1 for _ in segment)
+                self.sealed.append(path)
+                self.next_segment = int(name.split(".")[0]) + 1
+        self.degraded = bool(self.sealed)
+        self._open_segment()
+        self.task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self):
+        """Stop replaying and make every appended event durable"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        await self._sync()
+        os.close(self.fd)
+        self.fd = None
+        if self.segment_size == 0:
+            os.remove(self.path)
+
+    async def append(self, event: dict):
+        """Write an event to the spool; returns once it has been fsynced"""
+        line = encode_row(event)
+        if self.segment_size and self.segment_size + len(line) > self.segment_bytes:
+            self._rotate()
+        os.write(self.fd, line)
+        self.segment_size += len(line)
+        self.counters["depth"] += 1
+        self.counters["spooled"] += 1
+        if self.sync_waiter is None:
+            self.sync_waiter = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._sync_later())
+        await asyncio.shield(self.sync_waiter)
+
+    def stats(self) -> dict:
+        return {
+            "degraded": self.degraded,
+            "segments": len(self.sealed) + len(self.retiring) + (1 if self.segment_size else 0),
+            **self.counters
+        }
+
+    def _open_segment(self):
+        self.path = os.path.join(self.directory, f"{self.next_segment:012d}.ndjson")
+        self.next_segment += 1
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segment_size = 0
+
+    def _rotate(self):
+        # The old fd is closed (and the segment handed to the replayer) only
+        # after the next fsync has covered it
+        self.retiring.append((self.fd, self.path))
+        self._open_segment()
+
+    async def _sync_later(self):
+        await asyncio.sleep(self.fsync_interval)
+        await self._sync()
+
+    async def _sync(self):
+        if self.fd is None:
+            return
+        waiter, self.sync_waiter = self.sync_waiter, None
+        retiring, self.retiring = self.retiring, []
+        started = time.perf_counter()
+        try:
+            for fd in [fd for fd, _ in retiring] + [self.fd]:
+                await asyncio.to_thread(os.fsync, fd)
+        except OSError as e:
+            if waiter:
+                waiter.set_exception(e)
+            self.retiring = retiring + self.retiring
+            return
+        for fd, path in retiring:
+            os.close(fd)
+            self.sealed.append(path)
+        self.counters["fsyncs"] += 1
+        self.counters["last_fsync_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if waiter:
+            waiter.set_result(None)
+
+    async def _replay_loop(self):
+        backoff = SPOOL_REPLAY_BACKOFF_S
+        while True:
+            if not self.sealed and self.segment_size:
+                # Seal whatever is in the active segment so it can be replayed
+                self._rotate()
+                await self._sync()
+            if not self.sealed:
+                await asyncio.sleep(SPOOL_REPLAY_BACKOFF_S)
+                continue
+            try:
+                await self._replay(self.sealed[0])
+            except Exception as e:
+                print(f"❌ Spool replay failed, retrying in {backoff:.0f}s: {e}")
+                self.counters["replay_failures"] += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            self.sealed.popleft()
+            backoff = SPOOL_REPLAY_BACKOFF_S
+            if not self.sealed:
+                # Caught up; new events can go straight to the database again
+                self.degraded = False
+
+    def _dead_letter(self, rejected: list):
+        # Durable before the segment holding these rows is deleted
+        with open(os.path.join(self.directory, SPOOL_DEAD_LETTER), "ab") as dead_letter:
+            for event, error in rejected:
+                error = str(getattr(error, "orig", error))
+                dead_letter.write(orjson.dumps({"error": error, "event": event}) + b"\n")
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+
+    async def _replay(self, path: str):
+        with open(path, "rb") as segment:
+            lines = await asyncio.to_thread(segment.readlines)
+        rows = []
+        for line in lines:
+            try:
+                rows.append(decode_row(line))
+            except ValueError:
+                # A torn final line from a crash mid-append; it was never acked
+                self.counters["corrupt_lines"] += 1
+
+        started = time.perf_counter()
+        for start in range(0, len(rows), self.replay_rows):
+            _, rejected = await write_isolating(self.writer, rows[start:start + self.replay_rows])
+            if rejected:
+                await asyncio.to_thread(self._dead_letter, rejected)
+                self.counters["dead_lettered"] += len(rejected)
+                print(f"⚠️ {len(rejected)} spooled events rejected by the database, moved to {SPOOL_DEAD_LETTER}")
+        elapsed = time.perf_counter() - started
+
+        os.remove(path)
+        self.counters["depth"] -= len(lines)
+        self.counters["replayed"] += len(rows)
+        if rows and elapsed > 0:
+            self.counters["replay_rows_per_sec"] = round(len(rows) / elapsed, 1)
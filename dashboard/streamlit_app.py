@@ -6,12 +6,25 @@ import plotly.express as px
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from collections import deque
+import json
+import threading
 import time
 
 load_dotenv()
 
 API_BASE = os.getenv("API_BASE", "https://aixel-pw3d.onrender.com")
 
+# How often live sections re-render from the deltas streamed by /api/live (no requests)
+LIVE_RENDER_S = 2
+
+# Streamed deltas are only ever added, while events that age out of the rolling window
+# are never subtracted, so live mode reloads the full totals this often to stay accurate
+LIVE_RELOAD_S = 300
+
+# A live stream nobody has rendered for this long (the tab was closed) is shut down
+LIVE_IDLE_S = 60
+
 st.set_page_config(
     page_title="AI Journey Tracker - Admin",
     layout="wide",
@@ -248,11 +261,9 @@ selected_range = st.sidebar.selectbox(
 )
 hours = time_range_options[selected_range]
 
-# Auto-refresh toggle
-auto_refresh = st.sidebar.checkbox("🔄 Auto-refresh (30s)", value=False)
-if auto_refresh:
-    time.sleep(30)
-    st.rerun()
+# Live updates: /api/live pushes metric deltas as events arrive and only the KPIs and
+# events feed re-render, instead of sleeping and re-running (and refetching) the page
+live_updates = st.sidebar.checkbox("🔴 Live updates", value=False)
 
 # Manual refresh button
 if st.sidebar.button("⚡ Refresh Dashboard", type="primary", use_container_width=True):
@@ -270,20 +281,136 @@ st.markdown('<div class="main-header">🎯 AI CUSTOMER JOURNEY TRACKER</div>', u
 st.markdown(f'<div class="sub-header">Real-time Analytics & AI-Powered Insights • {selected_range}</div>', unsafe_allow_html=True)
 
 # Fetch all data
-@st.cache_data(ttl=60)
-def fetch_all_data(hours):
+def load_dashboard_data(hours):
     try:
-        funnel = requests.get(f"{API_BASE}/api/funnel?hours={hours}").json()
-        users = requests.get(f"{API_BASE}/api/user_analytics?hours={hours}").json()
-        campaigns = requests.get(f"{API_BASE}/api/campaign_performance?hours={hours}").json()
-        revenue = requests.get(f"{API_BASE}/api/revenue_metrics?hours={hours}").json()
-        timeline = requests.get(f"{API_BASE}/api/event_timeline?hours={hours}").json()
-        recent = requests.get(f"{API_BASE}/api/recent_events?limit=15").json()
-        return funnel, users, campaigns, revenue, timeline, recent
+        # One round trip; the backend computes every section in a single query.
+        # User and session counts are HyperLogLog estimates (within a few percent),
+        # or exact counts from a materialized view for 7 and 30 days (refreshed_at set).
+        data = requests.get(f"{API_BASE}/api/dashboard?hours={hours}&limit=15&approx=true&precomputed=true").json()
+        return (
+            data["funnel"],
+            data["user_analytics"],
+            data["campaign_performance"],
+            data["revenue_metrics"],
+            data["event_timeline"],
+            data["recent_events"]
+        )
     except Exception as e:
         st.error(f"⚠️ Error fetching data: {str(e)}")
         return None, None, None, None, None, None
 
+# Page loads share results for a minute; live mode adds its deltas to a fresh load
+fetch_all_data = st.cache_data(ttl=60)(load_dashboard_data)
+
+class LiveFeed:
+    """Reads /api/live on a background thread and sums the deltas it pushes.
+
+    The page adds the sums to the totals it loaded, so staying live costs one
+    long-lived request however long the window. Deltas pushed while the stream
+    was down are lost, and events leaving the window are never subtracted, so
+    reload_due asks for fresh totals after a reconnect and every LIVE_RELOAD_S.
+    The stream closes once nothing has read the sums for LIVE_IDLE_S.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reset()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def reset(self):
+        """Start summing from zero; called whenever the page loads fresh totals"""
+        with self.lock:
+            self.total_events = 0
+            self.funnel = {"ad_clicks": 0, "landings": 0, "product_views": 0, "adds": 0, "purchases": 0}
+            self.revenue = {"total_purchases": 0, "total_revenue": 0.0, "revenue_count": 0, "max_order_value": 0.0}
+            self.recent_events = deque(maxlen=15)
+            self.needs_reload = False
+            self.last_read = self.loaded_at = time.monotonic()
+
+    def stop(self):
+        self.stopped.set()
+
+    def reload_due(self) -> bool:
+        return self.needs_reload or time.monotonic() - self.loaded_at > LIVE_RELOAD_S
+
+    def idle(self) -> bool:
+        return self.stopped.is_set() or time.monotonic() - self.last_read > LIVE_IDLE_S
+
+    def apply(self, delta):
+        with self.lock:
+            self.total_events += delta["total_events"]
+            for key, value in delta["funnel"].items():
+                self.funnel[key] += value
+            self.revenue["total_purchases"] += delta["revenue"]["total_purchases"]
+            self.revenue["total_revenue"] += delta["revenue"]["total_revenue"]
+            self.revenue["revenue_count"] += delta["revenue"]["revenue_count"]
+            self.revenue["max_order_value"] = max(self.revenue["max_order_value"], delta["revenue"]["max_order_value"])
+            # Deltas list their events newest first
+            self.recent_events.extendleft(reversed(delta["recent_events"]))
+
+    def merged(self, funnel_data, user_data, revenue_data, recent_events):
+        """The loaded totals with everything streamed since added"""
+        with self.lock:
+            self.last_read = time.monotonic()
+            funnel = {key: value + self.funnel.get(key, 0) for key, value in funnel_data.items()}
+            users = {**user_data, "total_events": user_data["total_events"] + self.total_events}
+            purchases = revenue_data["total_purchases"] + self.revenue["total_purchases"]
+            total_revenue = revenue_data["total_revenue"] + self.revenue["total_revenue"]
+            # Order values average over purchases with a revenue, as the backend does;
+            # the loaded count is recovered from its totals
+            loaded_count = round(revenue_data["total_revenue"] / revenue_data["avg_order_value"]) if revenue_data["avg_order_value"] else 0
+            revenue_count = loaded_count + self.revenue["revenue_count"]
+            revenue = {
+                **revenue_data,
+                "total_purchases": purchases,
+                "total_revenue": total_revenue,
+                "avg_order_value": total_revenue / revenue_count if revenue_count else 0,
+                "max_order_value": max(revenue_data["max_order_value"], self.revenue["max_order_value"])
+            }
+            events = (list(self.recent_events) + list(recent_events))[:max(len(recent_events), 15)]
+        return funnel, users, revenue, events
+
+    def _run(self):
+        connects = 0
+        while not self.idle():
+            try:
+                # The API sends a keepalive every 15 s, well inside the read timeout
+                with requests.get(self.url, stream=True, timeout=(5, 60)) as response:
+                    response.raise_for_status()
+                    connects += 1
+                    if connects > 1:
+                        self.needs_reload = True
+                    for line in response.iter_lines():
+                        if self.idle():
+                            return
+                        if line.startswith(b"data: "):
+                            self.apply(json.loads(line[len(b"data: "):]))
+            except (requests.RequestException, ValueError):
+                pass
+            self.stopped.wait(2)
+
+# One stream per browser session, open while live updates are on
+live_feed = st.session_state.get("live_feed")
+if live_updates and (live_feed is None or live_feed.idle()):
+    live_feed = st.session_state["live_feed"] = LiveFeed(f"{API_BASE}/api/live")
+elif not live_updates and live_feed is not None:
+    live_feed.stop()
+    live_feed = st.session_state["live_feed"] = None
+
+def live_section(render):
+    """render(funnel, users, revenue, recent_events) once, or with live updates on, every
+    LIVE_RENDER_S seconds from the loaded totals plus the streamed deltas (rerunning the
+    page for fresh totals when the feed says a reload is due)"""
+    if live_feed is None:
+        return render
+    def live_render(funnel, users, revenue, events):
+        if live_feed.reload_due():
+            st.rerun()
+        render(*live_feed.merged(funnel, users, revenue, events))
+    return st.fragment(run_every=LIVE_RENDER_S)(live_render)
+
 # Fetch AI insights
 def get_ai_insights(metrics):
     try:
@@ -294,7 +421,13 @@ def get_ai_insights(metrics):
         return None
 
 with st.spinner("🔮 Loading dashboard data..."):
-    funnel_data, user_data, campaign_data, revenue_data, timeline_data, recent_events = fetch_all_data(hours)
+    if live_feed is not None:
+        # Reset first: a delta arriving during the load may also be in the snapshot,
+        # but none is dropped, and the next reload settles any overlap
+        live_feed.reset()
+        funnel_data, user_data, campaign_data, revenue_data, timeline_data, recent_events = load_dashboard_data(hours)
+    else:
+        funnel_data, user_data, campaign_data, revenue_data, timeline_data, recent_events = fetch_all_data(hours)
 
 if not funnel_data:
     st.error(f"❌ Failed to load data. Make sure FastAPI is running at {API_BASE}")
@@ -305,56 +438,59 @@ if not funnel_data:
 # ======================
 st.markdown('<div class="section-header">📊 KEY PERFORMANCE INDICATORS</div>', unsafe_allow_html=True)
 
-col1, col2, col3, col4, col5, col6 = st.columns(6)
+def render_kpis(funnel_data, user_data, revenue_data, recent_events):
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
 
-with col1:
-    st.metric(
-        "Total Events",
-        f"{user_data['total_events']:,}",
-        delta=None,
-        help="Total tracked events"
-    )
+    with col1:
+        st.metric(
+            "Total Events",
+            f"{user_data['total_events']:,}",
+            delta=None,
+            help="Total tracked events"
+        )
 
-with col2:
-    st.metric(
-        "Active Users",
-        f"{user_data['total_users']:,}",
-        delta=f"+{user_data['new_users']}" if user_data['new_users'] > 0 else None,
-        help="Unique active users"
-    )
+    with col2:
+        st.metric(
+            "Active Users",
+            f"{user_data['total_users']:,}",
+            delta=f"+{user_data['new_users']}" if user_data['new_users'] > 0 else None,
+            help="Unique active users"
+        )
 
-with col3:
-    st.metric(
-        "Sessions",
-        f"{user_data['total_sessions']:,}",
-        delta=None,
-        help="Total user sessions"
-    )
+    with col3:
+        st.metric(
+            "Sessions",
+            f"{user_data['total_sessions']:,}",
+            delta=None,
+            help="Total user sessions"
+        )
 
-with col4:
-    st.metric(
-        "Purchases",
-        f"{revenue_data['total_purchases']:,}",
-        delta=None,
-        help="Completed purchases"
-    )
+    with col4:
+        st.metric(
+            "Purchases",
+            f"{revenue_data['total_purchases']:,}",
+            delta=None,
+            help="Completed purchases"
+        )
 
-with col5:
-    st.metric(
-        "Revenue",
-        f"${revenue_data['total_revenue']:,.0f}",
-        delta=None,
-        help="Total revenue generated"
-    )
+    with col5:
+        st.metric(
+            "Revenue",
+            f"${revenue_data['total_revenue']:,.0f}",
+            delta=None,
+            help="Total revenue generated"
+        )
 
-with col6:
-    avg_order = revenue_data['avg_order_value']
-    st.metric(
-        "AOV",
-        f"${avg_order:.0f}",
-        delta=None,
-        help="Average Order Value"
-    )
+    with col6:
+        avg_order = revenue_data['avg_order_value']
+        st.metric(
+            "AOV",
+            f"${avg_order:.0f}",
+            delta=None,
+            help="Average Order Value"
+        )
+
+live_section(render_kpis)(funnel_data, user_data, revenue_data, recent_events)
 
 st.markdown("<br>", unsafe_allow_html=True)
 
@@ -572,6 +708,9 @@ with col1:
         st.metric("Sessions/User", f"{sessions_per_user:.2f}")
     with col_b:
         st.metric("Events/Session", f"{events_per_session:.1f}")
+    if user_data.get('refreshed_at'):
+        refreshed_at = datetime.fromisoformat(user_data['refreshed_at'])
+        st.caption(f"🕐 Users and sessions as of {refreshed_at.strftime('%H:%M:%S')}")
 
 with col2:
     st.markdown('<div class="section-header">🎯 CAMPAIGN PERFORMANCE</div>', unsafe_allow_html=True)
@@ -620,57 +759,60 @@ st.markdown("<br>", unsafe_allow_html=True)
 # ======================
 st.markdown('<div class="section-header">🔔 LIVE EVENTS FEED</div>', unsafe_allow_html=True)
 
-col1, col2 = st.columns([2, 1])
+def render_feed(funnel_data, user_data, revenue_data, recent_events):
+    col1, col2 = st.columns([2, 1])
+
+    with col1:
+        if recent_events and len(recent_events) > 0:
+            for event in recent_events:
+                event_type = event['event_type']
+                timestamp = datetime.fromisoformat(event['timestamp']) if event['timestamp'] else None
+                time_str = timestamp.strftime('%H:%M:%S') if timestamp else 'N/A'
+
+                emoji_map = {
+                    'ad_click': '📢',
+                    'page_view': '👁️',
+                    'product_view': '🛍️',
+                    'add_to_cart': '🛒',
+                    'purchase': '💰',
+                    'user_login': '🔑',
+                    'user_signup': '✨',
+                    'checkout_start': '💳'
+                }
 
-with col1:
-    if recent_events and len(recent_events) > 0:
-        for event in recent_events:
-            event_type = event['event_type']
-            timestamp = datetime.fromisoformat(event['timestamp']) if event['timestamp'] else None
-            time_str = timestamp.strftime('%H:%M:%S') if timestamp else 'N/A'
-
-            emoji_map = {
-                'ad_click': '📢',
-                'page_view': '👁️',
-                'product_view': '🛍️',
-                'add_to_cart': '🛒',
-                'purchase': '💰',
-                'user_login': '🔑',
-                'user_signup': '✨',
-                'checkout_start': '💳'
-            }
+                emoji = emoji_map.get(event_type, '📌')
+                user_email = event.get('user_email') or event.get('user_name') or 'Anonymous'
 
-            emoji = emoji_map.get(event_type, '📌')
-            user_email = event.get('user_email') or event.get('user_name') or 'Anonymous'
+                desc = f"{emoji} **{event_type.replace('_', ' ').title()}**"
+                if event.get('product_name'):
+                    desc += f" - {event['product_name']}"
+                if event.get('revenue', 0) > 0:
+                    desc += f" **(${event['revenue']:.2f})**"
+                desc += f" | 👤 {user_email} | 🎯 {event.get('campaign', 'direct')} | 🕐 {time_str}"
 
-            desc = f"{emoji} **{event_type.replace('_', ' ').title()}**"
-            if event.get('product_name'):
-                desc += f" - {event['product_name']}"
-            if event.get('revenue', 0) > 0:
-                desc += f" **(${event['revenue']:.2f})**"
-            desc += f" | 👤 {user_email} | 🎯 {event.get('campaign', 'direct')} | 🕐 {time_str}"
+                st.markdown(f'<div class="event-card">{desc}</div>', unsafe_allow_html=True)
+        else:
+            st.info("📊 No recent events")
 
-            st.markdown(f'<div class="event-card">{desc}</div>', unsafe_allow_html=True)
-    else:
-        st.info("📊 No recent events")
+    with col2:
+        st.markdown("#### 💰 Revenue Stats")
 
-with col2:
-    st.markdown("#### 💰 Revenue Stats")
+        revenue_breakdown = pd.DataFrame({
+            'Metric': ['Total Revenue', 'Avg Order', 'Max Order', 'Purchases'],
+            'Value': [
+                f"${revenue_data['total_revenue']:.2f}",
+                f"${revenue_data['avg_order_value']:.2f}",
+                f"${revenue_data['max_order_value']:.2f}",
+                f"{revenue_data['total_purchases']}"
+            ]
+        })
 
-    revenue_breakdown = pd.DataFrame({
-        'Metric': ['Total Revenue', 'Avg Order', 'Max Order', 'Purchases'],
-        'Value': [
-            f"${revenue_data['total_revenue']:.2f}",
-            f"${revenue_data['avg_order_value']:.2f}",
-            f"${revenue_data['max_order_value']:.2f}",
-            f"{revenue_data['total_purchases']}"
-        ]
-    })
+        st.dataframe(revenue_breakdown, use_container_width=True, hide_index=True)
 
-    st.dataframe(revenue_breakdown, use_container_width=True, hide_index=True)
+        revenue_per_session = revenue_data['total_revenue'] / user_data['total_sessions'] if user_data['total_sessions'] > 0 else 0
+        st.metric("Revenue/Session", f"${revenue_per_session:.2f}")
 
-    revenue_per_session = revenue_data['total_revenue'] / user_data['total_sessions'] if user_data['total_sessions'] > 0 else 0
-    st.metric("Revenue/Session", f"${revenue_per_session:.2f}")
+live_section(render_feed)(funnel_data, user_data, revenue_data, recent_events)
 
 # Footer
 st.markdown("<br><br>", unsafe_allow_html=True)
@@ -0,0 +1,169 @@
+"""
+Ingest latency under dashboard load - sync vs async database paths
+
+Runs a steady stream of single-event inserts while dashboard readers hammer the
+heavy analytics queries, first through the sync engine on a 40-thread pool (what
+FastAPI gives sync endpoints) and then through the async engines on the event loop,
+where ingest and analytics use separate pools, and reports ingest latency
+percentiles for both.
+
+Usage: python scripts/bench_async.py [seconds] [events_per_sec] [readers]
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import crud
+from backend.db import SessionLocal, ingest_session, analytics_session, dispose_engines
+from backend.ids import uuid7
+
+# Starlette's default threadpool size for sync endpoints
+THREADPOOL_SIZE = 40
+
+# Month-window dashboard queries, the most expensive reads the API serves
+HEAVY_READS = [
+    crud.USER_ANALYTICS_QUERY,
+    crud.CAMPAIGN_PERFORMANCE_QUERY,
+    crud.timeline_query(crud.default_interval(720))
+]
+
+def make_event():
+    """Build insert parameters for a synthetic event"""
+    return {
+        "id": uuid7(),
+        "event_type": "page_view",
+        "timestamp": datetime.now(timezone.utc),
+        "session_id": f"bench-{uuid.uuid4()}",
+        "user_id": None,
+        "page_url": "/bench",
+        "utm_source": "bench",
+        "utm_medium": None,
+        "utm_campaign": "bench",
+        "platform": "web",
+        "device": "desktop",
+        "revenue": 0,
+        "metadata": {"bench": True}
+    }
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def report(label, latencies, reads, errors):
+    """Print latency percentiles in milliseconds"""
+    ms = [latency * 1000 for latency in latencies]
+    print(f"📈 {label:<6} ingest p50={percentile(ms, 50):8.1f}ms  p99={percentile(ms, 99):8.1f}ms  "
+          f"max={max(ms):8.1f}ms | {len(ms)} inserts, {reads} heavy reads, {errors} errors")
+
+def run_sync(duration, rate, readers):
+    """Sync engine, with every DB call going through a shared 40-thread pool"""
+    pool = ThreadPoolExecutor(THREADPOOL_SIZE)
+    stop = threading.Event()
+    counts = {"reads": 0, "errors": 0}
+    params = crud.window_params(720)
+
+    def heavy_read(query):
+        with SessionLocal() as db:
+            db.execute(query, params).fetchall()
+
+    def reader(offset):
+        i = offset
+        while not stop.is_set():
+            try:
+                pool.submit(heavy_read, HEAVY_READS[i % len(HEAVY_READS)]).result()
+                counts["reads"] += 1
+            except Exception:
+                counts["errors"] += 1
+            i += 1
+
+    def ingest(submitted):
+        with SessionLocal() as db:
+            db.execute(crud.INSERT_EVENT_QUERY, make_event())
+            db.commit()
+        return time.perf_counter() - submitted
+
+    threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    futures = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        futures.append(pool.submit(ingest, time.perf_counter()))
+        # Sleep to an absolute schedule so overshoot doesn't lower the insert rate
+        time.sleep(max(0, started + len(futures) / rate - time.perf_counter()))
+
+    latencies = []
+    for future in futures:
+        try:
+            latencies.append(future.result())
+        except Exception:
+            counts["errors"] += 1
+    stop.set()
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+    report("sync", latencies, counts["reads"], counts["errors"])
+
+async def run_async(duration, rate, readers):
+    """Async engines, with every DB call awaited on the event loop"""
+    stop = asyncio.Event()
+    counts = {"reads": 0, "errors": 0}
+    params = crud.window_params(720)
+
+    async def reader(offset):
+        i = offset
+        while not stop.is_set():
+            try:
+                async with analytics_session() as db:
+                    (await db.execute(HEAVY_READS[i % len(HEAVY_READS)], params)).fetchall()
+                counts["reads"] += 1
+            except Exception:
+                counts["errors"] += 1
+            i += 1
+
+    async def ingest():
+        submitted = time.perf_counter()
+        async with ingest_session() as db:
+            await db.execute(crud.INSERT_EVENT_QUERY, make_event())
+            await db.commit()
+        return time.perf_counter() - submitted
+
+    reader_tasks = [asyncio.create_task(reader(i)) for i in range(readers)]
+
+    ingest_tasks = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        ingest_tasks.append(asyncio.create_task(ingest()))
+        await asyncio.sleep(max(0, started + len(ingest_tasks) / rate - time.perf_counter()))
+
+    results = await asyncio.gather(*ingest_tasks, return_exceptions=True)
+    latencies = [result for result in results if not isinstance(result, Exception)]
+    counts["errors"] += len(results) - len(latencies)
+    stop.set()
+    await asyncio.gather(*reader_tasks)
+    await dispose_engines()
+    report("async", latencies, counts["reads"], counts["errors"])
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+
+    print(f"\n🚀 {duration:.0f}s at {rate:.0f} inserts/sec with {readers} concurrent dashboard readers\n")
+    run_sync(duration, rate, readers)
+    asyncio.run(run_async(duration, rate, readers))
+    print()
+
+if __name__ == "__main__":
+    main()
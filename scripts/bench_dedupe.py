@@ -0,0 +1,57 @@
+"""
+Memory and speed of the ingest dedupe front-check (backend.dedupe.RecentIds)
+
+Fills the LRU with N client ids, measures its heap footprint with tracemalloc,
+and projects the cost of remembering a full day at 10M events/day.
+
+Usage: python scripts/bench_dedupe.py [num_ids]
+"""
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.dedupe import RecentIds
+from backend.ids import uuid7
+
+EVENTS_PER_DAY = 10_000_000
+
+def bloom_bytes(num_items, false_positive_rate):
+    """Optimal Bloom filter size for the given capacity and error rate"""
+    bits = -num_items * math.log(false_positive_rate) / (math.log(2) ** 2)
+    return bits / 8
+
+def main():
+    num_ids = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ids = [uuid7() for _ in range(num_ids)]
+
+    tracemalloc.start()
+    recent = RecentIds(capacity=num_ids)
+    started = time.perf_counter()
+    for event_id in ids:
+        recent.remember(event_id)
+    insert_s = time.perf_counter() - started
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for event_id in ids:
+        recent.seen(event_id)
+    lookup_s = time.perf_counter() - started
+
+    per_id = used / num_ids
+    print(f"\n📊 RecentIds with {num_ids:,} ids")
+    print(f"   heap: {used / 1e6:,.1f} MB ({per_id:.0f} bytes/id)")
+    print(f"   remember: {insert_s / num_ids * 1e9:,.0f} ns/id | seen: {lookup_s / num_ids * 1e9:,.0f} ns/id")
+    print(f"\n📈 Projected for {EVENTS_PER_DAY:,} ids/day")
+    print(f"   exact LRU, full day:    {per_id * EVENTS_PER_DAY / 1e9:,.2f} GB")
+    print(f"   exact LRU, last hour:   {per_id * EVENTS_PER_DAY / 24 / 1e6:,.0f} MB")
+    print(f"   Bloom filter @ 0.1% FP: {bloom_bytes(EVENTS_PER_DAY, 0.001) / 1e6:,.0f} MB "
+          f"(not used: a false positive would drop a real event)\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Export throughput in rows/sec - /api/export (Parquet, Arrow IPC) vs paging /api/events JSON
+
+Pulls the events of the last N hours through each path of a running API, the way
+a client would load them for offline modeling, and reports rows/sec and bytes on
+the wire. Every body is decoded into rows (pyarrow for the columnar formats,
+orjson for JSON) so the numbers include the client's parsing. The JSON path
+pages with next_cursor at the largest page the API serves until it has read as
+many rows as the export returned.
+
+Usage: python scripts/bench_export.py [hours] [--url http://localhost:8000]
+"""
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.main import EVENTS_PAGE_MAX_ROWS
+
+def export(url, start, end, export_format):
+    """(rows, bytes) for one /api/export download, decoded to a table"""
+    response = requests.get(f"{url}/api/export", params={
+        "start": start.isoformat(), "end": end.isoformat(), "format": export_format
+    })
+    response.raise_for_status()
+    body = response.content
+    if export_format == "parquet":
+        table = pq.read_table(io.BytesIO(body))
+    else:
+        table = pa.ipc.open_stream(body).read_all()
+    return table.num_rows, len(body)
+
+def json_pages(url, rows):
+    """(rows, bytes) for paging /api/events until rows have been read"""
+    read = size = 0
+    cursor = None
+    while read < rows:
+        params = {"limit": min(EVENTS_PAGE_MAX_ROWS, rows - read)}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{url}/api/events", params=params)
+        response.raise_for_status()
+        page = orjson.loads(response.content)
+        read += len(page["events"])
+        size += len(response.content)
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    return read, size
+
+def measure(fn, *args):
+    """(rows, bytes, seconds) of the best of three runs"""
+    best = None
+    for _ in range(3):
+        started = time.perf_counter()
+        rows, size = fn(*args)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best[2]:
+            best = (rows, size, elapsed)
+    return best
+
+def main():
+    args = sys.argv[1:]
+    url = "http://localhost:8000"
+    if "--url" in args:
+        index = args.index("--url")
+        url = args[index + 1]
+        del args[index:index + 2]
+    hours = int(args[0]) if args else 24
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(hours=hours)
+
+    results = {name: measure(export, url, start, end, name) for name in ("parquet", "arrow")}
+    rows = results["parquet"][0]
+    print(f"\n🚀 {rows:,} events in the last {hours}h\n")
+    results["json"] = measure(json_pages, url, rows)
+
+    json_rate = results["json"][0] / results["json"][2]
+    for name, (count, size, elapsed) in results.items():
+        rate = count / elapsed
+        print(f"📦 {name:<8}{rate:>12,.0f} rows/s{size / 1e6:>10.1f} MB{elapsed:>8.2f} s  ({rate / json_rate:.1f}x json)")
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Hot-window store vs SQL - load time, memory per event and query latency
+
+Loads the last N hours of events into a HotWindow (backend/hot_window.py), then
+times the funnel, revenue, timeline and campaign queries answered from memory
+against the same crud functions running their SQL (median of ten runs each, result
+cache bypassed) and checks both give the same answer.
+
+Usage: python scripts/bench_hot_window.py [hours]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import crud
+from backend.cache import bypass_cache
+from backend.db import dispose_engines
+from backend.hot_window import HotWindow
+
+RUNS = 10
+
+async def median_ms(fn, *args):
+    """(median milliseconds, last result) of RUNS calls"""
+    times = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        result = fn(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), result
+
+def same(hot, sql):
+    """Equal up to float rounding, and for campaigns up to which of those tied on
+    clicks made the top 10"""
+    if isinstance(hot, list):
+        if hot and "campaign" in hot[0]:
+            by_campaign = {row["campaign"]: row for row in sql}
+            return ([row["clicks"] for row in hot] == [row["clicks"] for row in sql]
+                    and all(same(row, by_campaign[row["campaign"]]) for row in hot if row["campaign"] in by_campaign))
+        return len(hot) == len(sql) and all(same(a, b) for a, b in zip(hot, sql))
+    return all(
+        abs(value - sql[name]) < 0.01 if isinstance(value, float) else value == sql[name]
+        for name, value in hot.items()
+    )
+
+def hot_timeline(store):
+    """The store's timeline shaped the way get_event_timeline shapes it"""
+    def timeline(hours):
+        interval = crud.default_interval(hours)
+        return crud.shape_timeline(store.timeline(hours, crud.TIMELINE_INTERVALS[interval]), hours, interval)
+    return timeline
+
+async def main():
+    hours = int(sys.argv[1]) if len(sys.argv) > 1 else 168
+    bypass_cache.set(True)
+
+    store = HotWindow(hours)
+    await store.load()
+    stats = store.stats()
+    used = stats["bytes_per_event"] * stats["events"]
+    print(f"\n🔥 {stats['events']:,} events loaded in {stats['load_ms'] / 1000:.1f} s, "
+          f"{used / 1e6:.1f} MB of columns ({stats['bytes_per_event']} bytes/event, "
+          f"{stats['bytes_per_event']} MB per million)\n")
+
+    pairs = (
+        ("funnel", store.funnel, crud.get_funnel_metrics),
+        ("revenue", store.revenue, crud.get_revenue_metrics),
+        ("timeline", hot_timeline(store), crud.get_event_timeline),
+        ("campaigns", store.campaigns, crud.get_campaign_performance)
+    )
+    for window in sorted({min(24, hours), hours}):
+        for name, hot_fn, sql_fn in pairs:
+            hot_ms, _ = await median_ms(hot_fn, window)
+            sql_ms, _ = await median_ms(sql_fn, window)
+            # Events cross the start of the window while the SQL runs, so it should
+            # match the store either just before or just after
+            before, sql, after = hot_fn(window), await sql_fn(window), hot_fn(window)
+            check = "✅" if same(before, sql) or same(after, sql) else "❌ results differ"
+            print(f"📈 {name:<10}{window:>5}h  hot {hot_ms:8.2f} ms   sql {sql_ms:8.1f} ms  "
+                  f"({sql_ms / hot_ms:.0f}x)  {check}")
+    print()
+    await dispose_engines()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Ingest throughput benchmark - compares POST /api/track (one event per request)
+against POST /api/track/batch (many events per request)
+"""
+import os
+import sys
+import time
+import uuid
+import requests
+from datetime import datetime
+
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000')
+
+def make_event(i):
+    """Build a synthetic event"""
+    return {
+        "event_type": "page_view",
+        "session_id": f"bench-{uuid.uuid4()}",
+        "timestamp": datetime.utcnow().isoformat(),
+        "page_url": "/bench",
+        "utm_source": "bench",
+        "utm_campaign": "bench",
+        "device": "desktop",
+        "platform": "web",
+        "metadata": {"bench": True, "seq": i}
+    }
+
+def bench_single(num_events):
+    """POST events one at a time, return rows/sec"""
+    session = requests.Session()
+    started = time.perf_counter()
+    for i in range(num_events):
+        session.post(f"{BACKEND_URL}/api/track", json=make_event(i), timeout=10).raise_for_status()
+    return num_events / (time.perf_counter() - started)
+
+def bench_batch(num_events, batch_size):
+    """POST events in batches, return client-side and server-reported rows/sec"""
+    session = requests.Session()
+    server_rates = []
+    started = time.perf_counter()
+    for start in range(0, num_events, batch_size):
+        batch = [make_event(i) for i in range(start, min(start + batch_size, num_events))]
+        response = session.post(f"{BACKEND_URL}/api/track/batch", json=batch, timeout=60)
+        response.raise_for_status()
+        server_rates.append(response.json()["rows_per_sec"])
+    client_rate = num_events / (time.perf_counter() - started)
+    return client_rate, sum(server_rates) / len(server_rates)
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    print(f"\n🚀 Benchmarking ingest against {BACKEND_URL} with {num_events} events\n")
+
+    single_rate = bench_single(num_events)
+    print(f"📈 /api/track        : {single_rate:,.0f} rows/sec")
+
+    batch_rate, server_rate = bench_batch(num_events, batch_size)
+    print(f"📈 /api/track/batch  : {batch_rate:,.0f} rows/sec end-to-end (batch size {batch_size})")
+    print(f"📈 /api/track/batch  : {server_rate:,.0f} rows/sec inside the database write")
+    print(f"\n⚡ Speedup: {batch_rate / single_rate:.1f}x\n")
+
+if __name__ == "__main__":
+    main()
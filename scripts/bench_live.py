@@ -0,0 +1,86 @@
+"""
+Live metrics stream vs poll-and-refetch - what keeping a dashboard current costs
+
+Opens N subscribers on /api/live of a running API, posts small batches of events
+for a few seconds, and reports how long each batch took to reach every subscriber
+(p50/p99) and the bytes per message. Then times the full /api/dashboard reload the
+old auto-refresh ran every 30 s (result cache bypassed) at each window, which is
+what a refresh cost per viewer before.
+
+Usage: python scripts/bench_live.py [subscribers] [seconds] [--url http://localhost:8000]
+"""
+import json
+import statistics
+import sys
+import threading
+import time
+import uuid
+import requests
+
+def subscribe(url, received, ready, stop):
+    """Append (arrival time, bytes, delta) for every message until stop is set"""
+    with requests.get(f"{url}/api/live", stream=True, timeout=(5, 60)) as response:
+        ready.release()
+        for line in response.iter_lines():
+            if stop.is_set():
+                return
+            if line.startswith(b"data: "):
+                received.append((time.perf_counter(), len(line), json.loads(line[len(b"data: "):])))
+
+def main():
+    args = sys.argv[1:]
+    url = "http://localhost:8000"
+    if "--url" in args:
+        index = args.index("--url")
+        url = args[index + 1]
+        del args[index:index + 2]
+    subscribers = int(args[0]) if args else 50
+    seconds = float(args[1]) if len(args) > 1 else 10
+
+    stop = threading.Event()
+    ready = threading.Semaphore(0)
+    inboxes = [[] for _ in range(subscribers)]
+    for inbox in inboxes:
+        threading.Thread(target=subscribe, args=(url, inbox, ready, stop), daemon=True).start()
+    for _ in inboxes:
+        ready.acquire()
+
+    # Each batch is tagged by its session, so its arrival can be found in the deltas
+    sent = {}
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        session_id = f"bench-live-{uuid.uuid4()}"
+        events = [{"event_type": "ad_click", "session_id": session_id}] * 2 + [
+            {"event_type": "purchase", "session_id": session_id, "revenue": 10.0}
+        ]
+        requests.post(f"{url}/api/track/batch", json=events).raise_for_status()
+        sent[session_id] = time.perf_counter()
+        time.sleep(0.25)
+    time.sleep(2)
+    stop.set()
+
+    latencies = []
+    sizes = []
+    for inbox in inboxes:
+        for arrived, size, delta in inbox:
+            sizes.append(size)
+            for event in delta["recent_events"]:
+                if event["session_id"] in sent and event["event_type"] == "purchase":
+                    latencies.append((arrived - sent[event["session_id"]]) * 1000)
+    latencies.sort()
+    messages = len(sizes) / subscribers
+    print(f"\n📡 {subscribers} subscribers, {len(sent)} batches in {seconds:g} s, "
+          f"{messages:.0f} messages each ({len(sent) / messages:.1f} batches per message)")
+    print(f"   delivery p50 {statistics.median(latencies):.0f} ms  p99 {latencies[int(len(latencies) * 0.99)]:.0f} ms  "
+          f"{statistics.mean(sizes) / 1000:.1f} KB per message\n")
+
+    for hours in (24, 168, 720):
+        response_started = time.perf_counter()
+        response = requests.get(f"{url}/api/dashboard", params={"hours": hours, "limit": 15, "approx": "true"},
+                                headers={"Cache-Control": "no-cache"})
+        elapsed = (time.perf_counter() - response_started) * 1000
+        print(f"🔄 full reload {hours:>4}h  {elapsed:8.0f} ms  {len(response.content) / 1000:6.1f} KB")
+    print()
+
+if __name__ == "__main__":
+    main()
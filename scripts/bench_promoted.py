@@ -0,0 +1,139 @@
+"""
+Raw-scan query time with jsonb extraction vs promoted metadata columns
+
+Times the funnel and campaign queries as full scans of events over the window,
+once extracting landing/campaign from metadata (how every query read them before
+PROMOTED_COLUMNS in scripts/init_db.py) and once from the generated columns,
+then the API's own rollup-backed crud queries for reference. Best of three runs.
+
+--seed N first inserts N synthetic events spread over the last 30 days (in 1M-row
+statements), for measuring at scale. Point DATABASE_URL at a scratch database.
+
+Usage: python scripts/bench_promoted.py [hours] [--seed N]
+"""
+import os
+import sys
+import time
+from sqlalchemy import text
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import crud
+from backend.db import SessionLocal
+
+SEED_STATEMENT_ROWS = 1_000_000
+
+SEED_QUERY = text("""
+    INSERT INTO events (event_type, timestamp, session_id, user_id, utm_source, utm_campaign, device, revenue, metadata)
+    SELECT
+        (ARRAY['ad_click', 'page_view', 'page_view', 'product_view', 'add_to_cart', 'purchase'])[1 + g % 6],
+        now() - random() * interval '30 days',
+        'bench-session-' || (g / 8),
+        'bench-user-' || (g % 5000),
+        (ARRAY['google', 'facebook', 'email'])[1 + g % 3],
+        (ARRAY['summer_sale', 'black_friday', 'new_arrivals', 'retargeting'])[1 + g % 4],
+        (ARRAY['mobile', 'desktop'])[1 + g % 2],
+        CASE WHEN g % 6 = 5 THEN 20 + g % 180 END,
+        jsonb_build_object(
+            'landing', g % 12 = 1,
+            'campaign', (ARRAY['summer_sale', 'black_friday', 'new_arrivals'])[1 + g % 3],
+            'product_name', 'AI Analytics Pro',
+            'user_email', 'user' || (g % 5000) || '@example.com',
+            'user_name', 'Bench User'
+        )
+    FROM generate_series(1, :rows) g
+""")
+
+FUNNEL_RAW = """
+    SELECT
+        COUNT(*) FILTER (WHERE event_type = 'ad_click'),
+        COUNT(*) FILTER (WHERE event_type = 'page_view' AND {landing}),
+        COUNT(*) FILTER (WHERE event_type = 'product_view'),
+        COUNT(*) FILTER (WHERE event_type = 'add_to_cart'),
+        COUNT(*) FILTER (WHERE event_type = 'purchase')
+    FROM events
+    WHERE timestamp >= :cutoff
+"""
+
+CAMPAIGN_RAW = """
+    SELECT
+        {campaign} as campaign,
+        COUNT(*) FILTER (WHERE event_type = 'ad_click') as clicks,
+        COUNT(DISTINCT session_id) as sessions,
+        COUNT(*) FILTER (WHERE event_type = 'purchase') as purchases,
+        COALESCE(SUM(revenue) FILTER (WHERE event_type = 'purchase'), 0) as revenue
+    FROM events
+    WHERE timestamp >= :cutoff
+    GROUP BY 1
+    ORDER BY clicks DESC
+    LIMIT 10
+"""
+
+JSONB_EXPRESSIONS = {
+    "landing": "metadata->>'landing' = 'true'",
+    "campaign": "COALESCE(metadata->>'campaign', utm_campaign, 'direct')"
+}
+
+PROMOTED_EXPRESSIONS = {
+    "landing": "landing",
+    "campaign": "campaign"
+}
+
+def seed(rows):
+    """Insert synthetic events through the rollup trigger, like any other write"""
+    db = SessionLocal()
+    try:
+        for start in range(0, rows, SEED_STATEMENT_ROWS):
+            batch = min(SEED_STATEMENT_ROWS, rows - start)
+            db.execute(SEED_QUERY, {"rows": batch})
+            db.commit()
+            print(f"🌱 Seeded {start + batch:,}/{rows:,} events")
+        db.execute(text("ANALYZE events"))
+        db.commit()
+    finally:
+        db.close()
+
+def measure(query, params):
+    """Best of three runs, in milliseconds"""
+    db = SessionLocal()
+    try:
+        db.execute(query, params).fetchall()  # warm the cache
+        best = float("inf")
+        for _ in range(3):
+            started = time.perf_counter()
+            db.execute(query, params).fetchall()
+            best = min(best, time.perf_counter() - started)
+        return best * 1000
+    finally:
+        db.close()
+
+def main():
+    args = sys.argv[1:]
+    if "--seed" in args:
+        index = args.index("--seed")
+        seed(int(args[index + 1]))
+        del args[index:index + 2]
+    hours = int(args[0]) if args else 720
+
+    db = SessionLocal()
+    try:
+        count = db.execute(text("SELECT COUNT(*) FROM events WHERE timestamp >= :cutoff"),
+                           {"cutoff": crud.cutoff_for(hours)}).scalar()
+    finally:
+        db.close()
+    print(f"\n🚀 {count:,} events in the last {hours}h\n")
+
+    params = crud.window_params(hours)
+    for name, query in (("funnel", FUNNEL_RAW), ("campaign", CAMPAIGN_RAW)):
+        before = measure(text(query.format(**JSONB_EXPRESSIONS)), params)
+        after = measure(text(query.format(**PROMOTED_EXPRESSIONS)), params)
+        print(f"📈 {name:<9} raw scan  jsonb {before:8.1f} ms   promoted {after:8.1f} ms  ({before / after:.1f}x)")
+
+    print()
+    for name, query in (("funnel", crud.FUNNEL_QUERY), ("campaign", crud.CAMPAIGN_PERFORMANCE_QUERY)):
+        print(f"📈 {name:<9} API query {measure(query, params):8.1f} ms")
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Per-event CPU cost of the /api/track serialization path - before and after the fast path
+
+"before" replays what the endpoint used to do: json.loads the body, build EventCreate
+from the dict, copy it with .dict(), json.dumps the metadata for CAST(... AS jsonb),
+and encode the response with jsonable_encoder + json.dumps. "after" is the current
+path: pydantic-core validates the raw bytes, prepare_event reads the model's fields,
+the engine's orjson serializer encodes metadata, and the response is orjson.dumps.
+
+Database time is excluded; this is the Python work per event on the event loop.
+
+Usage: python scripts/bench_serialize.py [events]
+"""
+import json
+import os
+import sys
+import time
+import uuid
+import warnings
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from backend.db import json_dumps
+from backend.ids import uuid7
+from backend.ingest import parse_event, prepare_event
+from backend.models import EventCreate
+import orjson
+
+def make_body(i):
+    """A purchase event shaped like the ones the demo site sends"""
+    return json.dumps({
+        "event_id": str(uuid.uuid4()),
+        "event_type": "purchase",
+        "timestamp": "2026-01-15T12:34:56.789Z",
+        "session_id": f"session-{i}",
+        "user_id": f"user-{i % 500}",
+        "page_url": "/checkout",
+        "utm_source": "google",
+        "utm_medium": "cpc",
+        "utm_campaign": "summer_sale",
+        "platform": "web",
+        "device": "mobile",
+        "revenue": 149.99,
+        "metadata": {
+            "campaign": "summer_sale",
+            "product_name": "AI Analytics Pro",
+            "user_email": f"user{i}@example.com",
+            "user_name": "Test User",
+            "cart": [{"sku": "AAP-1", "qty": 1, "price": 149.99}]
+        }
+    }).encode()
+
+# The old path used pydantic's deprecated .dict()
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+def before(body):
+    event = EventCreate(**json.loads(body))
+    event_dict = event.dict()
+    event_dict['id'] = event_dict.pop('event_id') or uuid7()
+    event_dict['metadata'] = json.dumps(event_dict['metadata'])
+    response = {"ok": True, "id": str(event_dict['id'])}
+    return json.dumps(jsonable_encoder(response)).encode()
+
+def after(body):
+    event_dict = prepare_event(parse_event(body))
+    json_dumps(event_dict['metadata'])
+    return orjson.dumps({"ok": True, "id": str(event_dict['id'])})
+
+def measure(path, bodies):
+    """Best of three passes, in microseconds per event"""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for body in bodies:
+            path(body)
+        best = min(best, time.perf_counter() - started)
+    return best / len(bodies) * 1e6
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bodies = [make_body(i) for i in range(count)]
+
+    print(f"\n🚀 Serializing {count} events ({len(bodies[0])} bytes each)\n")
+    before_us = measure(before, bodies)
+    after_us = measure(after, bodies)
+    print(f"📈 before  {before_us:6.1f} µs/event")
+    print(f"📈 after   {after_us:6.1f} µs/event  ({before_us / after_us:.1f}x faster)\n")
+
+if __name__ == "__main__":
+    main()
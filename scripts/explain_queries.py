@@ -0,0 +1,178 @@
+"""
+Index advisor - EXPLAIN (ANALYZE, BUFFERS) for every read query in backend/crud.py
+
+Runs each query the API serves with the same parameters it would use and reports
+execution time, shared buffer hits and reads, heap fetches, and which scans each
+relation got (partition indexes are reported under their parent index). Then lists
+every index on events with its size and how many scans these queries made of it,
+so an index that none of them use shows up as 0.
+
+Buffer counts are from a warm run: the first run of each query is discarded.
+
+Usage: python scripts/explain_queries.py [hours ...] [--plans]
+"""
+import os
+import sys
+from collections import Counter
+from sqlalchemy import text
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import crud
+from backend.db import SessionLocal
+from backend.matviews import MATVIEW_WINDOWS_HOURS
+
+RECENT_EVENTS_LIMIT = 20
+EVENTS_PAGE_LIMIT = 100
+
+# A recent session and user to filter /api/events pages on
+SAMPLE_FILTERS_QUERY = text("""
+    SELECT session_id, user_id
+    FROM events
+    WHERE session_id IS NOT NULL AND user_id IS NOT NULL
+    ORDER BY timestamp DESC
+    LIMIT 1
+""")
+
+# Every index on events or one of its partitions, with the parent index it belongs to
+INDEX_PARENTS_QUERY = text("""
+    SELECT c.relname, COALESCE(parent.relname, c.relname)
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    LEFT JOIN pg_inherits inh ON inh.inhrelid = c.oid
+    LEFT JOIN pg_class parent ON parent.oid = inh.inhparent
+    WHERE i.indrelid = 'events'::regclass
+       OR i.indrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'events'::regclass)
+""")
+
+INDEX_USAGE_QUERY = text("""
+    SELECT indexrelname, idx_scan, pg_relation_size(indexrelid)
+    FROM pg_stat_user_indexes
+    WHERE relid = 'events'::regclass
+       OR relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'events'::regclass)
+""")
+
+def analytics_queries(hours):
+    """(name, query, params) for each get_* query at this window"""
+    params = crud.window_params(hours)
+    queries = [
+        ("funnel", crud.FUNNEL_QUERY, params),
+        ("user_analytics", crud.USER_ANALYTICS_QUERY, params),
+        ("user_analytics approx", crud.USER_ANALYTICS_APPROX_QUERY, params),
+        ("campaign_performance", crud.CAMPAIGN_PERFORMANCE_QUERY, params),
+        ("campaign approx", crud.CAMPAIGN_PERFORMANCE_APPROX_QUERY, params),
+        ("revenue_metrics", crud.REVENUE_QUERY, params),
+        ("event_timeline", crud.timeline_query(crud.default_interval(hours)), params),
+        ("event_timeline 5min", crud.timeline_query("5min"), params),
+        ("breakdown", crud.breakdown_query(("campaign", "utm_source", "device")), {**params, "top_k": 10}),
+        ("dashboard", crud.dashboard_query(hours), params),
+        ("dashboard approx", crud.dashboard_query(hours, approx=True), params),
+        ("product_revenue", crud.PRODUCT_REVENUE_QUERY, {**params, "limit": 10})
+    ]
+    if hours in MATVIEW_WINDOWS_HOURS:
+        view_params = {**params, "window_hours": hours}
+        queries += [
+            ("user_analytics view", crud.USER_ANALYTICS_VIEW_QUERY, view_params),
+            ("campaign view", crud.CAMPAIGN_PERFORMANCE_VIEW_QUERY, view_params),
+            ("dashboard view", crud.dashboard_query(hours, from_view=True), view_params),
+            ("product_revenue view", crud.PRODUCT_REVENUE_VIEW_QUERY, {**view_params, "limit": 10})
+        ]
+    return queries
+
+def events_page_queries(db):
+    """(name, query, params) for /api/events pages, unfiltered and on each indexed filter;
+    the filtered pages are skipped when no event has a session and user to filter on"""
+    sample = db.execute(SAMPLE_FILTERS_QUERY).first()
+    filtered = (("session_id", sample[0]), ("user_id", sample[1])) if sample else ()
+    runs = []
+    for name, value in (("events_page", None), *filtered):
+        filters = {filter_name: None for filter_name in crud.EVENT_FILTERS}
+        if value is not None:
+            filters[name] = value
+            name = f"events_page {name}"
+        runs.append((name, crud.events_page_query(filters), {"limit": EVENTS_PAGE_LIMIT, **filters}))
+    return runs
+
+def explain(db, query, params, analyze_format="JSON"):
+    return db.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT {analyze_format}) {query.text}"),
+        params
+    ).fetchall()
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+def summarize(plan, parents):
+    """Totals and per-relation scan counts for one JSON plan"""
+    root = plan["Plan"]
+    scans = Counter()
+    heap_fetches = 0
+    for node in walk(root):
+        if "Index Name" in node:
+            scans[f"{node['Node Type']} {parents.get(node['Index Name'], node['Index Name'])}"] += 1
+        elif node["Node Type"] in ("Seq Scan", "Bitmap Heap Scan"):
+            relation = node["Relation Name"]
+            scans[f"{node['Node Type']} {'events' if relation.startswith('events_') else relation}"] += 1
+        heap_fetches += node.get("Heap Fetches", 0)
+    return {
+        "ms": plan["Execution Time"],
+        "hit": root.get("Shared Hit Blocks", 0),
+        "read": root.get("Shared Read Blocks", 0),
+        "heap_fetches": heap_fetches,
+        "scans": scans
+    }
+
+def index_usage(db, parents):
+    """{parent index: [scans, bytes]} summed over partitions"""
+    usage = {}
+    for name, scans, size in db.execute(INDEX_USAGE_QUERY):
+        entry = usage.setdefault(parents.get(name, name), [0, 0])
+        entry[0] += scans
+        entry[1] += size
+    return usage
+
+def main():
+    args = sys.argv[1:]
+    show_plans = "--plans" in args
+    windows = [int(arg) for arg in args if arg != "--plans"] or [24, 168, 720]
+
+    db = SessionLocal()
+    try:
+        parents = dict(db.execute(INDEX_PARENTS_QUERY).fetchall())
+        before = index_usage(db, parents)
+        db.commit()
+
+        runs = [(hours, *query) for hours in windows for query in analytics_queries(hours)]
+        runs.append((None, "recent_events", crud.RECENT_EVENTS_QUERY, {"limit": RECENT_EVENTS_LIMIT}))
+        runs.extend((None, *query) for query in events_page_queries(db))
+
+        print(f"\n🔍 {'query':<22}{'hours':>6}{'ms':>10}{'hit':>10}{'read':>10}{'heap':>10}  scans")
+        for hours, name, query, params in runs:
+            explain(db, query, params)  # warm up
+            summary = summarize(explain(db, query, params)[0][0][0], parents)
+            scans = ", ".join(f"{scan} ×{count}" if count > 1 else scan
+                              for scan, count in summary["scans"].most_common())
+            print(f"   {name:<22}{hours or '':>6}{summary['ms']:>10.1f}{summary['hit']:>10}"
+                  f"{summary['read']:>10}{summary['heap_fetches']:>10}  {scans}")
+            if show_plans:
+                print("\n".join(f"      {line}" for (line,) in explain(db, query, params, "TEXT")))
+                print()
+
+        # Flush this session's index statistics (PostgreSQL 15+) before reading them back
+        db.execute(text("SELECT pg_stat_force_next_flush()"))
+        db.commit()
+        after = index_usage(db, parents)
+    finally:
+        db.close()
+
+    print(f"\n📊 {'index':<40}{'size MB':>10}{'scans':>10}")
+    for name, (scans, size) in sorted(after.items()):
+        used = scans - before.get(name, [0, 0])[0]
+        print(f"   {name:<40}{size / 1e6:>10.1f}{used:>10}")
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,530 @@ from sqlalchemy import create_engine, text
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from seed_events import generate_session
+from backend.partitions import PARTITION_DAYS_AHEAD, PARTITION_DAYS_BACK
+from backend.sketches import HLL_PRECISION, HLL_REGISTERS, SKETCH_KINDS
+from backend.sessions import ORDERED_FUNNEL_STEPS
+from backend.matviews import MATVIEW_WINDOWS_HOURS, MATVIEW_WORK_MEM
+
+# Same function as sql/schema.sql; PostgreSQL 18+ also ships uuidv7() natively
+UUID_V7_FUNCTION = """
+CREATE OR REPLACE FUNCTION uuid_generate_v7() RETURNS uuid AS $$
+  SELECT encode(
+    set_bit(
+      set_bit(
+        overlay(uuid_send(gen_random_uuid())
+                placing substring(int8send(floor(extract(epoch FROM clock_timestamp()) * 1000)::bigint) FROM 3)
+                FROM 1 FOR 6),
+        52, 1),
+      53, 1),
+    'hex')::uuid
+$$ LANGUAGE sql VOLATILE;
+"""
+
+# Range-partitioned by day (UTC) on timestamp, so analytics windows only scan the
+# days they cover and retention drops whole partitions instead of DELETEing rows.
+# The primary key has to include the partition key.
+EVENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS events (
+    id uuid NOT NULL DEFAULT uuid_generate_v7(),
+    event_type text NOT NULL,
+    timestamp timestamptz NOT NULL DEFAULT now(),
+    session_id text,
+    user_id text,
+    page_url text,
+    utm_source text,
+    utm_medium text,
+    utm_campaign text,
+    platform text,
+    device text,
+    revenue numeric,
+    metadata jsonb,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp)
+"""
+
+# Hot metadata keys promoted to stored generated columns, so queries filter, group and
+# select typed columns instead of extracting from jsonb on every row. PostgreSQL
+# computes them on every insert path (API, COPY, psql), so writers don't change.
+# Promoting another key is one entry here; existing rows are filled in on startup,
+# which rewrites the table once.
+PROMOTED_COLUMNS = {
+    "campaign": "text GENERATED ALWAYS AS (COALESCE(metadata->>'campaign', utm_campaign, 'direct')) STORED",
+    "landing": "boolean GENERATED ALWAYS AS (COALESCE(metadata->>'landing' = 'true', false)) STORED",
+    "product_name": "text GENERATED ALWAYS AS (metadata->>'product_name') STORED",
+    "user_email": "text GENERATED ALWAYS AS (metadata->>'user_email') STORED",
+    "user_name": "text GENERATED ALWAYS AS (metadata->>'user_name') STORED"
+}
+
+# Catches events outside every daily partition (old backfills, far-future clocks)
+EVENTS_DEFAULT_PARTITION = "CREATE TABLE IF NOT EXISTS events_default PARTITION OF events DEFAULT"
+
+# Client event ids the (id, timestamp) key can't deduplicate: not UUIDv7 and sent
+# without a timestamp (see CLAIM_CLIENT_IDS_SQL in backend/crud.py). Pruned with
+# retention like the partitions.
+CLIENT_EVENT_IDS_TABLE = """
+CREATE TABLE IF NOT EXISTS client_event_ids (
+    id uuid PRIMARY KEY,
+    claimed_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+# Indexes on events, designed around the queries in backend/crud.py; run
+# scripts/explain_queries.py to see which plans use them. Created on every partition,
+# current and future.
+EVENT_INDEXES = {
+    # Raw side of every windowed query (the partial hour before the rollup takes
+    # over) as an index-only scan, and recent events in timestamp order
+    "idx_events_timestamp_covering": "(timestamp) INCLUDE (event_type, campaign, landing, revenue)",
+    # Distinct sessions per campaign read in order, without a sort
+    "idx_events_campaign_sessions": "(campaign, session_id) INCLUDE (timestamp)",
+    # A session's or user's events newest first, for event browsing filtered on them
+    # (and session refolds); other filters are common enough to read in timestamp order
+    "idx_events_session_timestamp": "(session_id, timestamp)",
+    "idx_events_user_timestamp": "(user_id, timestamp) WHERE user_id IS NOT NULL"
+}
+
+# Optional BRIN index on timestamp for ad-hoc range scans over wide windows: about
+# 1/150th the size of a btree. The built-in queries don't use it, and it can't
+# replace the btree, since it gives no order for recent events.
+EVENTS_BRIN_INDEX = os.getenv("EVENTS_BRIN_INDEX", "false").lower() == "true"
+if EVENTS_BRIN_INDEX:
+    EVENT_INDEXES["idx_events_timestamp_brin"] = "USING brin (timestamp) WITH (pages_per_range = 32)"
+
+# Superseded indexes, dropped on startup once their replacements exist
+RETIRED_EVENT_INDEXES = [
+    "idx_events_timestamp", "idx_events_legacy_timestamp", "idx_events_session", "idx_events_legacy_session"
+]
+if not EVENTS_BRIN_INDEX:
+    RETIRED_EVENT_INDEXES.append("idx_events_timestamp_brin")
+
+# Partition maintenance lives in the database so the API (backend/partitions.py),
+# this script and cron/pg_cron all run the same code. Daily partitions are named
+# events_pYYYYMMDD. Rows already sitting in events_default for a new day are moved
+# into its partition before it is attached. DDL gives up after lock_timeout rather
+# than queueing ingest behind a long analytics query; the next run retries.
+PARTITION_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION event_partition_bounds()
+RETURNS TABLE (partition_name text, lower_bound timestamptz, upper_bound timestamptz) AS $$
+    SELECT
+        c.relname::text,
+        substring(pg_get_expr(c.relpartbound, c.oid) FROM 'FROM \\(''([^'']+)''\\)')::timestamptz,
+        substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \\(''([^'']+)''\\)')::timestamptz
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'events'::regclass
+      AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION ensure_event_partitions(days_back int, days_ahead int) RETURNS int AS $$
+DECLARE
+    today timestamptz := date_trunc('day', now(), 'UTC');
+    day_start timestamptz;
+    day_end timestamptz;
+    partition_name text;
+    stored_columns text;
+    created int := 0;
+BEGIN
+    SET LOCAL lock_timeout = '5s';
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_event_partitions'));
+    -- Generated columns are recomputed on insert, so rows are moved without them
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO stored_columns
+    FROM pg_attribute
+    WHERE attrelid = 'events'::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    FOR i IN -days_back..days_ahead LOOP
+        day_start := today + make_interval(hours => 24 * i);
+        day_end := day_start + interval '24 hours';
+        CONTINUE WHEN EXISTS (
+            SELECT 1 FROM event_partition_bounds() b
+            WHERE (b.lower_bound IS NULL OR b.lower_bound < day_end) AND b.upper_bound > day_start
+        );
+        partition_name := 'events_p' || to_char(day_start AT TIME ZONE 'UTC', 'YYYYMMDD');
+        LOCK TABLE events_default IN SHARE ROW EXCLUSIVE MODE;
+        EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING GENERATED)', partition_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM events_default WHERE timestamp >= %L AND timestamp < %L RETURNING %s) '
+            'INSERT INTO %I (%s) SELECT * FROM moved',
+            day_start, day_end, stored_columns, partition_name, stored_columns);
+        EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name, day_start, day_end);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_expired_event_partitions(retention_days int) RETURNS int AS $$
+DECLARE
+    cutoff timestamptz := date_trunc('day', now(), 'UTC') - make_interval(hours => 24 * retention_days);
+    expired record;
+    dropped int := 0;
+BEGIN
+    SET LOCAL lock_timeout = '5s';
+    FOR expired IN SELECT partition_name FROM event_partition_bounds() WHERE upper_bound <= cutoff LOOP
+        EXECUTE format('DROP TABLE %I', expired.partition_name);
+        dropped := dropped + 1;
+    END LOOP;
+    DELETE FROM events_default WHERE timestamp < cutoff;
+    DELETE FROM session_funnels WHERE last_at < cutoff;
+    DELETE FROM client_event_ids WHERE claimed_at < cutoff;
+    RETURN dropped;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# Hourly rollup behind the analytics endpoints (same as sql/schema.sql). Hours are
+# UTC; NULL dimensions are stored as '' so they can be part of the primary key.
+ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS event_rollup_hourly (
+    hour timestamptz NOT NULL,
+    event_type text NOT NULL,
+    campaign text NOT NULL,
+    utm_source text NOT NULL,
+    device text NOT NULL,
+    events bigint NOT NULL,
+    landings bigint NOT NULL,
+    revenue numeric NOT NULL,
+    revenue_count bigint NOT NULL,
+    revenue_max numeric,
+    PRIMARY KEY (hour, event_type, campaign, utm_source, device)
+)
+"""
+
+# {source} is events for the initial backfill, the trigger's transition table otherwise.
+# Ordered so concurrent statements lock rollup rows in the same order.
+ROLLUP_UPSERT = """
+INSERT INTO event_rollup_hourly AS r
+SELECT
+    date_trunc('hour', timestamp, 'UTC'),
+    event_type,
+    campaign,
+    COALESCE(utm_source, ''),
+    COALESCE(device, ''),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE landing),
+    COALESCE(SUM(revenue), 0),
+    COUNT(revenue),
+    MAX(revenue)
+FROM {source}
+GROUP BY 1, 2, 3, 4, 5
+ORDER BY 1, 2, 3, 4, 5
+ON CONFLICT (hour, event_type, campaign, utm_source, device) DO UPDATE SET
+    events = r.events + EXCLUDED.events,
+    landings = r.landings + EXCLUDED.landings,
+    revenue = r.revenue + EXCLUDED.revenue,
+    revenue_count = r.revenue_count + EXCLUDED.revenue_count,
+    revenue_max = GREATEST(r.revenue_max, EXCLUDED.revenue_max)
+"""
+
+# HyperLogLog sketches of distinct users and sessions per hour and campaign (see
+# backend/sketches.py), stored sparsely: one row per register that has been set.
+# Merging sketches is MAX(rho) per register, so any window is a GROUP BY away.
+SKETCH_TABLE = """
+CREATE TABLE IF NOT EXISTS event_sketches_hourly (
+    hour timestamptz NOT NULL,
+    campaign text NOT NULL,
+    kind smallint NOT NULL,
+    register smallint NOT NULL,
+    rho smallint NOT NULL,
+    PRIMARY KEY (hour, campaign, kind, register)
+)
+"""
+
+# (kind, register, rho) for each value an event adds to the sketches. The register is
+# the top HLL_PRECISION bits of a 64-bit hash, rho the position of the first set bit
+# in the rest. Inlined by the planner, so the trigger and the raw side of approx
+# queries hash exactly the same way.
+SKETCH_ENTRIES_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION event_sketch_entries(user_id text, session_id text, event_type text)
+RETURNS TABLE (kind smallint, register smallint, rho smallint) AS $$
+  SELECT
+    v.kind,
+    ((h >> {64 - HLL_PRECISION}) & {HLL_REGISTERS - 1})::smallint,
+    COALESCE(NULLIF(position(B'1' IN substring(h::bit(64) FROM {HLL_PRECISION + 1})), 0), {65 - HLL_PRECISION})::smallint
+  FROM (VALUES
+    ({SKETCH_KINDS["total_users"]}::smallint, user_id),
+    ({SKETCH_KINDS["sessions"]}::smallint, session_id),
+    ({SKETCH_KINDS["new_users"]}::smallint, CASE WHEN event_type = 'user_signup' THEN user_id END),
+    ({SKETCH_KINDS["returning_users"]}::smallint, CASE WHEN event_type = 'user_login' THEN user_id END)
+  ) v(kind, value),
+  LATERAL (SELECT hashtextextended(v.value, 0) AS h) hashed
+  WHERE v.value IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+"""
+
+# Cardinality from a merged sketch's non-zero registers, with Ertl's improved raw
+# estimator ("New cardinality estimation algorithms for HyperLogLog sketches", 2017):
+# unbiased from zero to billions, so there is no switch-over to linear counting.
+# Registers left at the maximum rho (all hash bits zero) are counted like the one
+# below it; the correction for them only matters near 2^53 distinct values.
+SKETCH_ESTIMATE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION hll_estimate(registers smallint[]) RETURNS float8 AS $$
+DECLARE
+    m constant float8 := {HLL_REGISTERS};
+    x float8 := (m - COALESCE(cardinality(registers), 0)) / m;
+    y float8 := 1;
+    z float8 := x;
+    previous float8;
+    total float8 := 0;
+    rho smallint;
+BEGIN
+    IF x = 1 THEN
+        RETURN 0;
+    END IF;
+    FOREACH rho IN ARRAY registers LOOP
+        total := total + power(2::float8, -LEAST(rho, {64 - HLL_PRECISION}));
+    END LOOP;
+    -- sigma(share of zero registers)
+    LOOP
+        x := x * x;
+        previous := z;
+        z := z + x * y;
+        y := y + y;
+        EXIT WHEN z = previous;
+    END LOOP;
+    RETURN m * m / (2 * ln(2::float8)) / (m * z + total);
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+"""
+
+# {source} as in ROLLUP_UPSERT. Registers only ever grow, and rows that wouldn't
+# change aren't rewritten, so once an hour's sketches fill up ingest mostly reads.
+SKETCH_UPSERT = """
+INSERT INTO event_sketches_hourly AS s
+SELECT date_trunc('hour', timestamp, 'UTC'), campaign, kind, register, MAX(rho)
+FROM {source}, LATERAL event_sketch_entries(user_id, session_id, event_type)
+GROUP BY 1, 2, 3, 4
+ORDER BY 1, 2, 3, 4
+ON CONFLICT (hour, campaign, kind, register) DO UPDATE SET rho = EXCLUDED.rho
+WHERE s.rho < EXCLUDED.rho
+"""
+
+# Statement-level, so a batch or COPY chunk costs one upsert per distinct key; under
+# ON CONFLICT DO NOTHING the transition table only holds rows actually inserted
+ROLLUP_TRIGGER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION rollup_events() RETURNS trigger AS $$
+BEGIN
+    {ROLLUP_UPSERT.format(source="new_events").strip()};
+    {SKETCH_UPSERT.format(source="new_events").strip()};
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+ROLLUP_TRIGGER = """
+CREATE TRIGGER events_rollup AFTER INSERT ON events
+REFERENCING NEW TABLE AS new_events
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_events()
+"""
+
+# One row per session: when it started and last had an event, its first-touch campaign,
+# and when it reached each of ORDERED_FUNNEL_STEPS (steps[k] is the time of step k).
+# Ordered funnels read this instead of replaying raw events.
+SESSION_TABLE = """
+CREATE TABLE IF NOT EXISTS session_funnels (
+    session_id text PRIMARY KEY,
+    first_at timestamptz NOT NULL,
+    last_at timestamptz NOT NULL,
+    campaign text,
+    steps timestamptz[] NOT NULL,
+    furthest_step smallint GENERATED ALWAYS AS (cardinality(steps)) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_session_funnels_first_at ON session_funnels (first_at)
+"""
+
+# session_funnel_steps(prior, event_type, timestamp ORDER BY timestamp) folds a
+# session's events into its steps, carrying on from the prior steps
+SESSION_FUNNEL_AGGREGATE = f"""
+CREATE OR REPLACE FUNCTION session_funnel_step(
+    steps timestamptz[], prior timestamptz[], event_type text, happened_at timestamptz
+) RETURNS timestamptz[] AS $$
+BEGIN
+    steps := COALESCE(steps, prior);
+    IF event_type = (ARRAY{ORDERED_FUNNEL_STEPS!r})[cardinality(steps) + 1] THEN
+        RETURN steps || happened_at;
+    END IF;
+    RETURN steps;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE AGGREGATE session_funnel_steps(timestamptz[], text, timestamptz) (
+    SFUNC = session_funnel_step,
+    STYPE = timestamptz[]
+);
+"""
+
+# Sessions whose new events all come after the ones already folded carry on from their
+# stored steps; a session that gets an older event (or a tie) is refolded from its raw
+# events.
+# Placeholder rows are inserted and every touched row locked (in key order) before
+# folding, so concurrent statements on the same session take turns, and each
+# statement in the function sees what the one before it committed.
+SESSIONIZE_FUNCTION = """
+CREATE OR REPLACE FUNCTION sessionize_events() RETURNS trigger AS $$
+DECLARE
+    late text[];
+BEGIN
+    INSERT INTO session_funnels (session_id, first_at, last_at, steps)
+    SELECT DISTINCT session_id, 'infinity'::timestamptz, '-infinity'::timestamptz, '{}'::timestamptz[]
+    FROM new_events
+    WHERE session_id IS NOT NULL
+    ORDER BY session_id
+    ON CONFLICT (session_id) DO NOTHING;
+
+    PERFORM 1 FROM session_funnels
+    WHERE session_id IN (SELECT session_id FROM new_events)
+    ORDER BY session_id
+    FOR UPDATE;
+
+    late := ARRAY(
+        SELECT DISTINCT n.session_id
+        FROM new_events n
+        JOIN session_funnels f USING (session_id)
+        WHERE n.timestamp <= f.last_at
+    );
+
+    WITH folded AS (
+        SELECT
+            n.session_id,
+            MIN(n.timestamp) as first_at,
+            MAX(n.timestamp) as last_at,
+            (array_agg(n.campaign ORDER BY n.timestamp, n.id))[1] as campaign,
+            session_funnel_steps(f.steps, n.event_type, n.timestamp ORDER BY n.timestamp, n.id) as steps
+        FROM new_events n
+        JOIN session_funnels f USING (session_id)
+        WHERE n.session_id <> ALL (late)
+        GROUP BY n.session_id
+    )
+    UPDATE session_funnels f SET
+        first_at = LEAST(f.first_at, folded.first_at),
+        last_at = folded.last_at,
+        campaign = COALESCE(f.campaign, folded.campaign),
+        steps = folded.steps
+    FROM folded
+    WHERE f.session_id = folded.session_id;
+
+    IF cardinality(late) > 0 THEN
+        WITH folded AS (
+            SELECT
+                session_id,
+                MIN(timestamp) as first_at,
+                MAX(timestamp) as last_at,
+                (array_agg(campaign ORDER BY timestamp, id))[1] as campaign,
+                session_funnel_steps('{}', event_type, timestamp ORDER BY timestamp, id) as steps
+            FROM events
+            WHERE session_id = ANY (late)
+            GROUP BY session_id
+        )
+        UPDATE session_funnels f SET
+            first_at = folded.first_at,
+            last_at = folded.last_at,
+            campaign = folded.campaign,
+            steps = folded.steps
+        FROM folded
+        WHERE f.session_id = folded.session_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+SESSION_TRIGGER = """
+CREATE TRIGGER events_sessions AFTER INSERT ON events
+REFERENCING NEW TABLE AS new_events
+FOR EACH STATEMENT EXECUTE FUNCTION sessionize_events()
+"""
+
+SESSION_BACKFILL = """
+INSERT INTO session_funnels (session_id, first_at, last_at, campaign, steps)
+SELECT
+    session_id,
+    MIN(timestamp),
+    MAX(timestamp),
+    (array_agg(campaign ORDER BY timestamp, id))[1],
+    session_funnel_steps('{}', event_type, timestamp ORDER BY timestamp, id)
+FROM events
+WHERE session_id IS NOT NULL
+GROUP BY session_id
+"""
+
+# Materialized views refreshed in the background (see backend/matviews.py), one row
+# set per window in MATVIEW_WINDOWS_HOURS ending at the refresh. Created with data so
+# they can be read as soon as they exist; each needs a unique index to be refreshed
+# CONCURRENTLY.
+MATERIALIZED_VIEWS = {
+    # Same shape as distinct_counts in backend/crud.py
+    "window_distinct_counts": f"""
+SELECT
+    window_hours,
+    CASE WHEN GROUPING(campaign) = 0 THEN 'campaign' ELSE 'total' END as grouping_set,
+    campaign,
+    COUNT(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL) as total_users,
+    COUNT(DISTINCT session_id) as sessions,
+    COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_signup') as new_users,
+    COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_login') as returning_users,
+    now() as refreshed_at
+FROM unnest(ARRAY[{", ".join(map(str, MATVIEW_WINDOWS_HOURS))}]) window_hours
+JOIN events ON timestamp >= now() - window_hours * interval '1 hour'
+GROUP BY GROUPING SETS ((window_hours), (window_hours, campaign))
+""",
+    "product_revenue": f"""
+SELECT
+    window_hours,
+    product_name,
+    COUNT(*) as purchases,
+    COALESCE(SUM(revenue), 0) as revenue,
+    COALESCE(AVG(revenue), 0) as avg_order_value,
+    COALESCE(MAX(revenue), 0) as max_order_value,
+    now() as refreshed_at
+FROM unnest(ARRAY[{", ".join(map(str, MATVIEW_WINDOWS_HOURS))}]) window_hours
+JOIN events ON timestamp >= now() - window_hours * interval '1 hour'
+WHERE event_type = 'purchase'
+GROUP BY window_hours, product_name
+"""
+}
+
+MATERIALIZED_VIEW_KEYS = {
+    "window_distinct_counts": "(window_hours, grouping_set, campaign)",
+    "product_revenue": "(window_hours, product_name)"
+}
+
+def retire_unpartitioned_events(conn):
+    """Rename an unpartitioned events table out of the way, returning where its data ends.
+
+    Writers stay blocked until the transaction commits with the partitioned
+    table in place.
+    """
+    conn.execute(text("LOCK TABLE events IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("ALTER TABLE events RENAME TO events_legacy"))
+    conn.execute(text("ALTER INDEX IF EXISTS events_pkey RENAME TO events_legacy_pkey"))
+    conn.execute(text("ALTER INDEX IF EXISTS idx_events_timestamp RENAME TO idx_events_legacy_timestamp"))
+    conn.execute(text("ALTER INDEX IF EXISTS idx_events_session RENAME TO idx_events_legacy_session"))
+    # Rebuilt on the partitioned table along with the rollup (see create_schema)
+    conn.execute(text("DROP TRIGGER IF EXISTS events_rollup ON events_legacy"))
+    conn.execute(text("DROP TRIGGER IF EXISTS events_sessions ON events_legacy"))
+    # The end of the day after the newest row, and at least the end of today
+    return conn.execute(text("""
+        SELECT GREATEST(
+            date_trunc('day', now(), 'UTC'),
+            date_trunc('day', MAX(timestamp), 'UTC')
+        ) + interval '24 hours'
+        FROM events_legacy
+    """)).scalar()
+
+def attach_legacy_events(conn, boundary):
+    """Attach the old table as one partition covering everything before boundary.
+
+    No rows are copied: the CHECK constraint lets ATTACH skip its validation
+    scan, and the only index built is the new (id, timestamp) key. Retention
+    drops the whole partition once boundary has expired.
+    """
+    bound = boundary.isoformat()
+    # A partition can't keep its own primary key; ATTACH builds the (id, timestamp) one
+    conn.execute(text("ALTER TABLE events_legacy DROP CONSTRAINT events_legacy_pkey"))
+    conn.execute(text(f"ALTER TABLE events_legacy ADD CONSTRAINT events_legacy_range CHECK (timestamp < '{bound}')"))
+    conn.execute(text(f"ALTER TABLE events ATTACH PARTITION events_legacy FOR VALUES FROM (MINVALUE) TO ('{bound}')"))
+    # Redundant with the partition bound from here on
+    conn.execute(text("ALTER TABLE events_legacy DROP CONSTRAINT events_legacy_range"))
 
 def create_schema():
     """Create database schema if it doesn't exist"""
@@ -27,28 +551,98 @@ def create_schema():
             # Enable UUID extension
             conn.execute(text('CREATE EXTENSION IF NOT EXISTS "pgcrypto"'))
 
+            # Time-ordered UUIDv7 default for rows inserted without an id
+            conn.execute(text(UUID_V7_FUNCTION))
+
+            # Tables from before partitioning are attached as a partition below
+            events_kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('events')")).scalar()
+            legacy_boundary = None
+            if events_kind == 'r':
+                print("📦 Partitioning existing events table...")
+                legacy_boundary = retire_unpartitioned_events(conn)
+
             # Create events table
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS events (
-                    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
-                    event_type text NOT NULL,
-                    timestamp timestamptz NOT NULL DEFAULT now(),
-                    session_id text,
-                    user_id text,
-                    page_url text,
-                    utm_source text,
-                    utm_medium text,
-                    utm_campaign text,
-                    platform text,
-                    device text,
-                    revenue numeric,
-                    metadata jsonb
-                )
-            """))
-
-            # Create indexes
-            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp)"))
-            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_session ON events (session_id)"))
+            conn.execute(text(EVENTS_TABLE))
+
+            # Migrate tables created with random UUIDv4 ids; existing ids are kept
+            conn.execute(text("ALTER TABLE events ALTER COLUMN id SET DEFAULT uuid_generate_v7()"))
+
+            conn.execute(text(EVENTS_DEFAULT_PARTITION))
+            if legacy_boundary:
+                attach_legacy_events(conn, legacy_boundary)
+            conn.execute(text(CLIENT_EVENT_IDS_TABLE))
+
+            # Promoted metadata keys, added in a single pass over existing rows
+            existing = set(conn.execute(text(
+                "SELECT attname FROM pg_attribute WHERE attrelid = 'events'::regclass AND NOT attisdropped"
+            )).scalars())
+            missing = [name for name in PROMOTED_COLUMNS if name not in existing]
+            if missing:
+                print(f"📦 Promoting metadata keys to columns: {', '.join(missing)}")
+                conn.execute(text("ALTER TABLE events " + ", ".join(
+                    f"ADD COLUMN {name} {PROMOTED_COLUMNS[name]}" for name in missing
+                )))
+
+            # Create indexes (on every partition, current and future). Partitioned
+            # tables can't build indexes CONCURRENTLY, so writes wait for new ones.
+            for name, definition in EVENT_INDEXES.items():
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON events {definition}"))
+            for name in RETIRED_EVENT_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+            # Daily partitions around today; the API keeps creating them ahead
+            conn.execute(text(PARTITION_FUNCTIONS))
+            conn.execute(text("SELECT ensure_event_partitions(:days_back, :days_ahead)"), {
+                "days_back": PARTITION_DAYS_BACK,
+                "days_ahead": PARTITION_DAYS_AHEAD
+            })
+
+            # Hourly rollup and distinct-count sketches, kept current by a trigger on events
+            has_trigger = conn.execute(text(
+                "SELECT 1 FROM pg_trigger WHERE tgname = 'events_rollup' AND tgrelid = 'events'::regclass"
+            )).scalar()
+            has_sketches = conn.execute(text("SELECT to_regclass('event_sketches_hourly')")).scalar()
+            if not (has_trigger and has_sketches):
+                # Block writers until the trigger is in place and history is backfilled,
+                # so no event is counted twice or missed
+                conn.execute(text("LOCK TABLE events IN SHARE ROW EXCLUSIVE MODE"))
+            conn.execute(text(ROLLUP_TABLE))
+            conn.execute(text(SKETCH_TABLE))
+            conn.execute(text(SKETCH_ENTRIES_FUNCTION))
+            conn.execute(text(SKETCH_ESTIMATE_FUNCTION))
+            conn.execute(text(ROLLUP_TRIGGER_FUNCTION))
+            if not has_trigger:
+                conn.execute(text("TRUNCATE event_rollup_hourly"))
+                conn.execute(text(ROLLUP_TRIGGER))
+                conn.execute(text(ROLLUP_UPSERT.format(source="events")))
+            if not (has_trigger and has_sketches):
+                print("📦 Building distinct-count sketches...")
+                conn.execute(text("TRUNCATE event_sketches_hourly"))
+                conn.execute(text(SKETCH_UPSERT.format(source="events")))
+                conn.execute(text("ANALYZE event_sketches_hourly"))
+
+            # Per-session funnel state, kept current by a second trigger
+            conn.execute(text(SESSION_TABLE))
+            conn.execute(text(SESSION_FUNNEL_AGGREGATE))
+            conn.execute(text(SESSIONIZE_FUNCTION))
+            has_session_trigger = conn.execute(text(
+                "SELECT 1 FROM pg_trigger WHERE tgname = 'events_sessions' AND tgrelid = 'events'::regclass"
+            )).scalar()
+            if not has_session_trigger:
+                print("📦 Folding sessions into session_funnels...")
+                conn.execute(text("LOCK TABLE events IN SHARE ROW EXCLUSIVE MODE"))
+                conn.execute(text("TRUNCATE session_funnels"))
+                conn.execute(text(SESSION_TRIGGER))
+                conn.execute(text(SESSION_BACKFILL))
+                conn.execute(text("ANALYZE session_funnels"))
+
+            # Materialized views, populated here once and refreshed by the API or worker
+            for name, definition in MATERIALIZED_VIEWS.items():
+                if not conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+                    print(f"📦 Building materialized view {name}...")
+                    conn.execute(text("SELECT set_config('work_mem', :work_mem, true)"), {"work_mem": MATVIEW_WORK_MEM})
+                    conn.execute(text(f"CREATE MATERIALIZED VIEW {name} AS {definition}"))
+                    conn.execute(text(f"CREATE UNIQUE INDEX {name}_key ON {name} {MATERIALIZED_VIEW_KEYS[name]}"))
 
             conn.commit()
             print("✅ Schema created successfully")
@@ -0,0 +1,48 @@
+"""
+Materialized view refresher - companion worker to the API
+
+Refreshes the materialized views created by scripts/init_db.py on their intervals
+(MATVIEW_REFRESH_INTERVALS), the same background task the API runs when
+MATVIEW_REFRESHER=api. Run one of these and set MATVIEW_REFRESHER=worker on the API
+when it has several processes, so the views are refreshed once rather than by each.
+With --once, refreshes every view a single time and reports how long each took.
+
+Usage: python scripts/refresh_views.py [--once]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db import dispose_engines
+from backend.matviews import MatviewRefresher
+
+async def refresh_once(refresher):
+    for view in refresher.intervals:
+        started = time.perf_counter()
+        refreshed = await refresher.refresh(view)
+        elapsed = time.perf_counter() - started
+        if refreshed:
+            print(f"✅ {view:<24} refreshed in {elapsed:.1f} s")
+        else:
+            print(f"⏭️  {view:<24} skipped, already being refreshed")
+
+async def main():
+    refresher = MatviewRefresher()
+    if "--once" in sys.argv[1:]:
+        await refresh_once(refresher)
+    else:
+        intervals = ", ".join(f"{view} every {interval:g} s" for view, interval in refresher.intervals.items())
+        print(f"🔄 Refreshing {intervals}")
+        refresher.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await refresher.stop()
+    await dispose_engines()
+
+if __name__ == "__main__":
+    asyncio.run(main())
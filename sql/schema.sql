@@ -1,7 +1,25 @@
 CREATE EXTENSION IF NOT EXISTS "pgcrypto";
 
+-- Time-ordered UUIDv7 for rows inserted without an id (the API generates its own).
+-- Built from gen_random_uuid() with the first 48 bits replaced by Unix milliseconds
+-- and the version nibble set to 7. PostgreSQL 18+ ships uuidv7() natively.
+CREATE OR REPLACE FUNCTION uuid_generate_v7() RETURNS uuid AS $$
+  SELECT encode(
+    set_bit(
+      set_bit(
+        overlay(uuid_send(gen_random_uuid())
+                placing substring(int8send(floor(extract(epoch FROM clock_timestamp()) * 1000)::bigint) FROM 3)
+                FROM 1 FOR 6),
+        52, 1),
+      53, 1),
+    'hex')::uuid
+$$ LANGUAGE sql VOLATILE;
+
+-- Range-partitioned by day (UTC) on timestamp: analytics windows only scan the days
+-- they cover and retention drops whole partitions instead of DELETEing rows. The
+-- primary key has to include the partition key, so ingest dedupes on (id, timestamp).
 CREATE TABLE events (
-  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  id uuid NOT NULL DEFAULT uuid_generate_v7(),
   event_type text NOT NULL,
   timestamp timestamptz NOT NULL DEFAULT now(),
   session_id text,
@@ -13,8 +31,419 @@ CREATE TABLE events (
   platform text,
   device text,
   revenue numeric,
-  metadata jsonb
+  metadata jsonb,
+  -- Hot metadata keys promoted to typed columns (PROMOTED_COLUMNS in scripts/init_db.py),
+  -- computed by PostgreSQL on every insert so queries don't extract them from jsonb
+  campaign text GENERATED ALWAYS AS (COALESCE(metadata->>'campaign', utm_campaign, 'direct')) STORED,
+  landing boolean GENERATED ALWAYS AS (COALESCE(metadata->>'landing' = 'true', false)) STORED,
+  product_name text GENERATED ALWAYS AS (metadata->>'product_name') STORED,
+  user_email text GENERATED ALWAYS AS (metadata->>'user_email') STORED,
+  user_name text GENERATED ALWAYS AS (metadata->>'user_name') STORED,
+  PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Indexes designed around the queries in backend/crud.py (EVENT_INDEXES in
+-- scripts/init_db.py); scripts/explain_queries.py shows which plans use them.
+-- Raw side of every windowed query (the partial hour before the rollup takes over)
+-- as an index-only scan, and recent events in timestamp order
+CREATE INDEX idx_events_timestamp_covering ON events (timestamp) INCLUDE (event_type, campaign, landing, revenue);
+-- Distinct sessions per campaign read in order, without a sort
+CREATE INDEX idx_events_campaign_sessions ON events (campaign, session_id) INCLUDE (timestamp);
+-- A session's or user's events newest first, for event browsing filtered on them
+CREATE INDEX idx_events_session_timestamp ON events (session_id, timestamp);
+CREATE INDEX idx_events_user_timestamp ON events (user_id, timestamp) WHERE user_id IS NOT NULL;
+-- Optional (EVENTS_BRIN_INDEX=true), for ad-hoc range scans over wide windows:
+-- CREATE INDEX idx_events_timestamp_brin ON events USING brin (timestamp) WITH (pages_per_range = 32);
+
+-- Catches events outside every daily partition (old backfills, far-future clocks)
+CREATE TABLE events_default PARTITION OF events DEFAULT;
+
+-- Client event ids the (id, timestamp) key can't deduplicate: not UUIDv7 and sent
+-- without a timestamp, so each retry is stamped with a new receive time. The API
+-- claims them here in the insert's transaction; pruned with retention.
+CREATE TABLE client_event_ids (
+  id uuid PRIMARY KEY,
+  claimed_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Daily partitions are named events_pYYYYMMDD. The API calls these hourly (see
+-- backend/partitions.py); cron or pg_cron can as well. Rows already sitting in
+-- events_default for a new day are moved into its partition before it is attached.
+-- DDL gives up after lock_timeout rather than queueing ingest behind a long query.
+CREATE OR REPLACE FUNCTION event_partition_bounds()
+RETURNS TABLE (partition_name text, lower_bound timestamptz, upper_bound timestamptz) AS $$
+  SELECT
+    c.relname::text,
+    substring(pg_get_expr(c.relpartbound, c.oid) FROM 'FROM \(''([^'']+)''\)')::timestamptz,
+    substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::timestamptz
+  FROM pg_inherits i
+  JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = 'events'::regclass
+    AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT'
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION ensure_event_partitions(days_back int, days_ahead int) RETURNS int AS $$
+DECLARE
+  today timestamptz := date_trunc('day', now(), 'UTC');
+  day_start timestamptz;
+  day_end timestamptz;
+  partition_name text;
+  stored_columns text;
+  created int := 0;
+BEGIN
+  SET LOCAL lock_timeout = '5s';
+  PERFORM pg_advisory_xact_lock(hashtext('ensure_event_partitions'));
+  -- Generated columns are recomputed on insert, so rows are moved without them
+  SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO stored_columns
+  FROM pg_attribute
+  WHERE attrelid = 'events'::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+  FOR i IN -days_back..days_ahead LOOP
+    day_start := today + make_interval(hours => 24 * i);
+    day_end := day_start + interval '24 hours';
+    CONTINUE WHEN EXISTS (
+      SELECT 1 FROM event_partition_bounds() b
+      WHERE (b.lower_bound IS NULL OR b.lower_bound < day_end) AND b.upper_bound > day_start
+    );
+    partition_name := 'events_p' || to_char(day_start AT TIME ZONE 'UTC', 'YYYYMMDD');
+    LOCK TABLE events_default IN SHARE ROW EXCLUSIVE MODE;
+    EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING GENERATED)', partition_name);
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM events_default WHERE timestamp >= %L AND timestamp < %L RETURNING %s) '
+      'INSERT INTO %I (%s) SELECT * FROM moved',
+      day_start, day_end, stored_columns, partition_name, stored_columns);
+    EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+      partition_name, day_start, day_end);
+    created := created + 1;
+  END LOOP;
+  RETURN created;
+END
+$$ LANGUAGE plpgsql;
+
+-- Retention (EVENTS_RETENTION_DAYS): drops partitions that ended before the cutoff
+CREATE OR REPLACE FUNCTION drop_expired_event_partitions(retention_days int) RETURNS int AS $$
+DECLARE
+  cutoff timestamptz := date_trunc('day', now(), 'UTC') - make_interval(hours => 24 * retention_days);
+  expired record;
+  dropped int := 0;
+BEGIN
+  SET LOCAL lock_timeout = '5s';
+  FOR expired IN SELECT partition_name FROM event_partition_bounds() WHERE upper_bound <= cutoff LOOP
+    EXECUTE format('DROP TABLE %I', expired.partition_name);
+    dropped := dropped + 1;
+  END LOOP;
+  DELETE FROM events_default WHERE timestamp < cutoff;
+  DELETE FROM session_funnels WHERE last_at < cutoff;
+  DELETE FROM client_event_ids WHERE claimed_at < cutoff;
+  RETURN dropped;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_event_partitions(30, 7);
+
+-- Hourly rollup behind the analytics endpoints. Hours are UTC; NULL dimensions are
+-- stored as '' so they can be part of the primary key. The analytics queries read
+-- whole hours from here and only scan events for the partial hour at the start of
+-- their window.
+CREATE TABLE event_rollup_hourly (
+  hour timestamptz NOT NULL,
+  event_type text NOT NULL,
+  campaign text NOT NULL,
+  utm_source text NOT NULL,
+  device text NOT NULL,
+  events bigint NOT NULL,
+  landings bigint NOT NULL,
+  revenue numeric NOT NULL,
+  revenue_count bigint NOT NULL,
+  revenue_max numeric,
+  PRIMARY KEY (hour, event_type, campaign, utm_source, device)
+);
+
+-- HyperLogLog sketches of distinct users (kind 1), sessions (2), signed-up users (3)
+-- and logged-in users (4) per hour and campaign, 2^11 registers each, stored sparsely
+-- as one row per register that has been set. Merging sketches is MAX(rho) per
+-- register; approx=true queries merge a window's sketches and estimate with
+-- hll_estimate (standard error 1.04 / sqrt(2048) = 2.3%).
+CREATE TABLE event_sketches_hourly (
+  hour timestamptz NOT NULL,
+  campaign text NOT NULL,
+  kind smallint NOT NULL,
+  register smallint NOT NULL,
+  rho smallint NOT NULL,
+  PRIMARY KEY (hour, campaign, kind, register)
+);
+
+-- (kind, register, rho) for each value an event adds: the register is the top 11 bits
+-- of a 64-bit hash, rho the position of the first set bit in the other 53
+CREATE OR REPLACE FUNCTION event_sketch_entries(user_id text, session_id text, event_type text)
+RETURNS TABLE (kind smallint, register smallint, rho smallint) AS $$
+  SELECT
+    v.kind,
+    ((h >> 53) & 2047)::smallint,
+    COALESCE(NULLIF(position(B'1' IN substring(h::bit(64) FROM 12)), 0), 54)::smallint
+  FROM (VALUES
+    (1::smallint, user_id),
+    (2::smallint, session_id),
+    (3::smallint, CASE WHEN event_type = 'user_signup' THEN user_id END),
+    (4::smallint, CASE WHEN event_type = 'user_login' THEN user_id END)
+  ) v(kind, value),
+  LATERAL (SELECT hashtextextended(v.value, 0) AS h) hashed
+  WHERE v.value IS NOT NULL
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Ertl's improved raw estimator ("New cardinality estimation algorithms for
+-- HyperLogLog sketches", 2017), unbiased over the whole range
+CREATE OR REPLACE FUNCTION hll_estimate(registers smallint[]) RETURNS float8 AS $$
+DECLARE
+  m constant float8 := 2048;
+  x float8 := (m - COALESCE(cardinality(registers), 0)) / m;
+  y float8 := 1;
+  z float8 := x;
+  previous float8;
+  total float8 := 0;
+  rho smallint;
+BEGIN
+  IF x = 1 THEN
+    RETURN 0;
+  END IF;
+  FOREACH rho IN ARRAY registers LOOP
+    total := total + power(2::float8, -LEAST(rho, 53));
+  END LOOP;
+  -- sigma(share of zero registers)
+  LOOP
+    x := x * x;
+    previous := z;
+    z := z + x * y;
+    y := y + y;
+    EXIT WHEN z = previous;
+  END LOOP;
+  RETURN m * m / (2 * ln(2::float8)) / (m * z + total);
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+-- Kept current at ingest by a statement-level trigger: a batch or COPY chunk costs one
+-- upsert per distinct key, and under ON CONFLICT DO NOTHING the transition table only
+-- holds rows that were actually inserted. Ordered so concurrent statements lock rollup
+-- rows in the same order.
+CREATE OR REPLACE FUNCTION rollup_events() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO event_rollup_hourly AS r
+  SELECT
+    date_trunc('hour', timestamp, 'UTC'),
+    event_type,
+    campaign,
+    COALESCE(utm_source, ''),
+    COALESCE(device, ''),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE landing),
+    COALESCE(SUM(revenue), 0),
+    COUNT(revenue),
+    MAX(revenue)
+  FROM new_events
+  GROUP BY 1, 2, 3, 4, 5
+  ORDER BY 1, 2, 3, 4, 5
+  ON CONFLICT (hour, event_type, campaign, utm_source, device) DO UPDATE SET
+    events = r.events + EXCLUDED.events,
+    landings = r.landings + EXCLUDED.landings,
+    revenue = r.revenue + EXCLUDED.revenue,
+    revenue_count = r.revenue_count + EXCLUDED.revenue_count,
+    revenue_max = GREATEST(r.revenue_max, EXCLUDED.revenue_max);
+
+  -- Registers only ever grow; rows that wouldn't change aren't rewritten
+  INSERT INTO event_sketches_hourly AS s
+  SELECT date_trunc('hour', timestamp, 'UTC'), campaign, kind, register, MAX(rho)
+  FROM new_events, LATERAL event_sketch_entries(user_id, session_id, event_type)
+  GROUP BY 1, 2, 3, 4
+  ORDER BY 1, 2, 3, 4
+  ON CONFLICT (hour, campaign, kind, register) DO UPDATE SET rho = EXCLUDED.rho
+  WHERE s.rho < EXCLUDED.rho;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_rollup AFTER INSERT ON events
+REFERENCING NEW TABLE AS new_events
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_events();
+
+-- One row per session: when it started and last had an event, its first-touch
+-- campaign, and when it reached each step of the ordered funnel ad_click ->
+-- product_view -> add_to_cart -> purchase (steps[k] is the time of step k). Ordered
+-- funnels read this instead of replaying raw events.
+CREATE TABLE session_funnels (
+  session_id text PRIMARY KEY,
+  first_at timestamptz NOT NULL,
+  last_at timestamptz NOT NULL,
+  campaign text,
+  steps timestamptz[] NOT NULL,
+  furthest_step smallint GENERATED ALWAYS AS (cardinality(steps)) STORED
 );
+CREATE INDEX idx_session_funnels_first_at ON session_funnels (first_at);
+
+-- session_funnel_steps(prior, event_type, timestamp ORDER BY timestamp) folds a
+-- session's events into its steps, carrying on from the prior steps
+CREATE OR REPLACE FUNCTION session_funnel_step(
+  steps timestamptz[], prior timestamptz[], event_type text, happened_at timestamptz
+) RETURNS timestamptz[] AS $$
+BEGIN
+  steps := COALESCE(steps, prior);
+  IF event_type = (ARRAY['ad_click', 'product_view', 'add_to_cart', 'purchase'])[cardinality(steps) + 1] THEN
+    RETURN steps || happened_at;
+  END IF;
+  RETURN steps;
+END
+$$ LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE;
+
+CREATE OR REPLACE AGGREGATE session_funnel_steps(timestamptz[], text, timestamptz) (
+  SFUNC = session_funnel_step,
+  STYPE = timestamptz[]
+);
+
+-- Sessions whose new events all come after the ones already folded carry on from
+-- their stored steps; a session that gets an older event (or a tie) is refolded from
+-- its raw events. Placeholder rows are inserted and every touched row locked (in key
+-- order) before folding, so concurrent statements on the same session take turns.
+CREATE OR REPLACE FUNCTION sessionize_events() RETURNS trigger AS $$
+DECLARE
+  late text[];
+BEGIN
+  INSERT INTO session_funnels (session_id, first_at, last_at, steps)
+  SELECT DISTINCT session_id, 'infinity'::timestamptz, '-infinity'::timestamptz, '{}'::timestamptz[]
+  FROM new_events
+  WHERE session_id IS NOT NULL
+  ORDER BY session_id
+  ON CONFLICT (session_id) DO NOTHING;
+
+  PERFORM 1 FROM session_funnels
+  WHERE session_id IN (SELECT session_id FROM new_events)
+  ORDER BY session_id
+  FOR UPDATE;
+
+  late := ARRAY(
+    SELECT DISTINCT n.session_id
+    FROM new_events n
+    JOIN session_funnels f USING (session_id)
+    WHERE n.timestamp <= f.last_at
+  );
+
+  WITH folded AS (
+    SELECT
+      n.session_id,
+      MIN(n.timestamp) as first_at,
+      MAX(n.timestamp) as last_at,
+      (array_agg(n.campaign ORDER BY n.timestamp, n.id))[1] as campaign,
+      session_funnel_steps(f.steps, n.event_type, n.timestamp ORDER BY n.timestamp, n.id) as steps
+    FROM new_events n
+    JOIN session_funnels f USING (session_id)
+    WHERE n.session_id <> ALL (late)
+    GROUP BY n.session_id
+  )
+  UPDATE session_funnels f SET
+    first_at = LEAST(f.first_at, folded.first_at),
+    last_at = folded.last_at,
+    campaign = COALESCE(f.campaign, folded.campaign),
+    steps = folded.steps
+  FROM folded
+  WHERE f.session_id = folded.session_id;
+
+  IF cardinality(late) > 0 THEN
+    WITH folded AS (
+      SELECT
+        session_id,
+        MIN(timestamp) as first_at,
+        MAX(timestamp) as last_at,
+        (array_agg(campaign ORDER BY timestamp, id))[1] as campaign,
+        session_funnel_steps('{}', event_type, timestamp ORDER BY timestamp, id) as steps
+      FROM events
+      WHERE session_id = ANY (late)
+      GROUP BY session_id
+    )
+    UPDATE session_funnels f SET
+      first_at = folded.first_at,
+      last_at = folded.last_at,
+      campaign = folded.campaign,
+      steps = folded.steps
+    FROM folded
+    WHERE f.session_id = folded.session_id;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER events_sessions AFTER INSERT ON events
+REFERENCING NEW TABLE AS new_events
+FOR EACH STATEMENT EXECUTE FUNCTION sessionize_events();
+
+-- Materialized views refreshed in the background (backend/matviews.py, or
+-- scripts/refresh_views.py as a worker) with REFRESH MATERIALIZED VIEW CONCURRENTLY,
+-- which needs the unique indexes. Each holds one row set per window in
+-- MATVIEW_WINDOWS_HOURS ending at its last refresh (refreshed_at); the API reads them
+-- for those windows while they are fresh and queries events otherwise.
+CREATE MATERIALIZED VIEW window_distinct_counts AS
+SELECT
+  window_hours,
+  CASE WHEN GROUPING(campaign) = 0 THEN 'campaign' ELSE 'total' END as grouping_set,
+  campaign,
+  COUNT(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL) as total_users,
+  COUNT(DISTINCT session_id) as sessions,
+  COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_signup') as new_users,
+  COUNT(DISTINCT user_id) FILTER (WHERE event_type = 'user_login') as returning_users,
+  now() as refreshed_at
+FROM unnest(ARRAY[168, 720]) window_hours
+JOIN events ON timestamp >= now() - window_hours * interval '1 hour'
+GROUP BY GROUPING SETS ((window_hours), (window_hours, campaign));
+CREATE UNIQUE INDEX window_distinct_counts_key ON window_distinct_counts (window_hours, grouping_set, campaign);
+
+CREATE MATERIALIZED VIEW product_revenue AS
+SELECT
+  window_hours,
+  product_name,
+  COUNT(*) as purchases,
+  COALESCE(SUM(revenue), 0) as revenue,
+  COALESCE(AVG(revenue), 0) as avg_order_value,
+  COALESCE(MAX(revenue), 0) as max_order_value,
+  now() as refreshed_at
+FROM unnest(ARRAY[168, 720]) window_hours
+JOIN events ON timestamp >= now() - window_hours * interval '1 hour'
+WHERE event_type = 'purchase'
+GROUP BY window_hours, product_name;
+CREATE UNIQUE INDEX product_revenue_key ON product_revenue (window_hours, product_name);
+
+-- Adding the rollup to an existing database (scripts/init_db.py does this on startup):
+-- BEGIN;
+-- LOCK TABLE events IN SHARE ROW EXCLUSIVE MODE;
+-- (create the table, function and trigger above, then roll up history:)
+-- INSERT INTO event_rollup_hourly SELECT ... FROM events GROUP BY ...;  -- same SELECT as the trigger
+-- INSERT INTO event_sketches_hourly SELECT ... FROM events, LATERAL ...;  -- likewise
+-- COMMIT;
+-- and the same for session_funnels, folding every session once:
+-- INSERT INTO session_funnels (session_id, first_at, last_at, campaign, steps)
+-- SELECT session_id, MIN(timestamp), MAX(timestamp),
+--   (array_agg(campaign ORDER BY timestamp, id))[1],
+--   session_funnel_steps('{}', event_type, timestamp ORDER BY timestamp, id)
+-- FROM events WHERE session_id IS NOT NULL GROUP BY session_id;
+
+-- Migrating a table created with gen_random_uuid(): existing ids stay as they are,
+-- new rows get time-ordered ids. REINDEX INDEX CONCURRENTLY events_pkey afterwards
+-- reclaims the bloat the random keys left behind.
+-- ALTER TABLE events ALTER COLUMN id SET DEFAULT uuid_generate_v7();
+
+-- Partitioning a table created before partitioning (scripts/init_db.py does this on
+-- startup). No rows are copied: the old table becomes one partition covering
+-- everything up to the end of the day of its newest row, and retention drops it
+-- whole once that has expired. Writers are blocked until COMMIT.
+-- BEGIN;
+-- LOCK TABLE events IN ACCESS EXCLUSIVE MODE;
+-- ALTER TABLE events RENAME TO events_legacy;
+-- ALTER INDEX events_pkey RENAME TO events_legacy_pkey;
+-- ALTER INDEX idx_events_timestamp RENAME TO idx_events_legacy_timestamp;  -- dropped once the covering index exists
+-- ALTER INDEX idx_events_session RENAME TO idx_events_legacy_session;  -- dropped once the (session_id, timestamp) index exists
+-- DROP TRIGGER events_rollup ON events_legacy;
+-- (create events, its indexes and events_default as above)
+-- ALTER TABLE events_legacy DROP CONSTRAINT events_legacy_pkey;
+-- ALTER TABLE events_legacy ADD CONSTRAINT events_legacy_range CHECK (timestamp < '<boundary>');
+-- ALTER TABLE events ATTACH PARTITION events_legacy FOR VALUES FROM (MINVALUE) TO ('<boundary>');
+-- ALTER TABLE events_legacy DROP CONSTRAINT events_legacy_range;
+-- (create the functions above, then the rollup trigger and backfill as for adding the rollup)
+-- COMMIT;
 
-CREATE INDEX idx_events_timestamp ON events (timestamp);
-CREATE INDEX idx_events_session ON events (session_id);
+-- Promoting another metadata key: one pass that rewrites every partition.
+-- ALTER TABLE events ADD COLUMN <key> text GENERATED ALWAYS AS (metadata->>'<key>') STORED;
@@ -1,6 +1,17 @@
+import asyncio
+import gzip
+import io
+import json
 import pytest
 import requests
+import subprocess
+import sys
 import time
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta, timezone
+from backend.ids import uuid7
 
 API_BASE = "http://localhost:8000"
 
@@ -50,3 +61,421 @@ def test_insights_endpoint():
     assert "recommendations" in data
     assert len(data["observations"]) > 0
     assert len(data["recommendations"]) > 0
+
+def test_track_batch():
+    """Test batch event tracking endpoint"""
+    events = [
+        {"event_type": "page_view", "session_id": "test-batch-123", "page_url": "/test"},
+        {"event_type": "add_to_cart", "session_id": "test-batch-123", "metadata": {"test": True}},
+        {"session_id": "test-batch-123"}
+    ]
+    response = requests.post(f"{API_BASE}/api/track/batch", json=events)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 2
+    assert data["rejected"] == 1
+    assert data["results"][0]["ok"] == True
+    assert "id" in data["results"][0]
+    assert data["results"][2]["ok"] == False
+    assert "rows_per_sec" in data
+
+def test_stats_endpoint():
+    """Test ingest stats endpoint"""
+    response = requests.get(f"{API_BASE}/api/stats")
+    assert response.status_code == 200
+    assert "ingest_mode" in response.json()
+    assert "spool" in response.json()
+    assert "load" in response.json()["admission"]
+    assert response.json()["partitions"]["partitions"] > 0
+
+def test_track_event_client_id():
+    """Test that a client-generated event id is used as the row id"""
+    event_id = str(uuid.uuid4())
+    event = {"event_id": event_id, "event_type": "page_view", "session_id": "test-session-123"}
+    response = requests.post(f"{API_BASE}/api/track", json=event)
+    assert response.status_code == 200
+    assert response.json()["id"] == event_id
+
+def test_track_event_idempotent():
+    """Test that retrying an event with the same event id is not double-counted"""
+    event = {"event_id": str(uuid.uuid4()), "event_type": "purchase", "session_id": "test-session-123", "revenue": 10}
+    first = requests.post(f"{API_BASE}/api/track", json=event)
+    retry = requests.post(f"{API_BASE}/api/track", json=event)
+    assert first.status_code == 200
+    assert "duplicate" not in first.json()
+    assert retry.status_code == 200
+    assert retry.json()["duplicate"] == True
+    assert retry.json()["id"] == event["event_id"]
+
+def test_flush_ack_retry_after_failed_flush(monkeypatch):
+    """Test that an event whose flush failed is written on retry, not acked as a duplicate"""
+    from fastapi import HTTPException
+    from backend import main
+    from backend.ingest_buffer import IngestBuffer
+    from backend.models import EventCreate
+
+    async def failing_writer(events):
+        raise ConnectionError("database unavailable")
+
+    written = []
+    async def writer(events):
+        written.extend(events)
+        return len(events)
+
+    async def track(buffer, event):
+        monkeypatch.setattr(main, "ingest_buffer", buffer)
+        buffer.start()
+        try:
+            return await main.ingest_event(event)
+        finally:
+            await buffer.stop()
+
+    monkeypatch.setattr(main, "BUFFER_ACK", "flush")
+    event = EventCreate(event_id=uuid7(), event_type="purchase", session_id="test-flush-retry", revenue=10)
+    with pytest.raises(HTTPException) as failed:
+        asyncio.run(track(IngestBuffer(writer=failing_writer), event))
+    assert failed.value.status_code == 500
+    retry = asyncio.run(track(IngestBuffer(writer=writer), event))
+    assert retry == {"ok": True, "id": str(event.event_id)}
+    assert [row["id"] for row in written] == [event.event_id]
+
+def test_track_event_rejects_nul():
+    """Test that values PostgreSQL can't store are rejected up front"""
+    for event in ({"event_type": "page_view\u0000"}, {"event_type": "page_view", "metadata": {"note": ["a\u0000"]}}):
+        response = requests.post(f"{API_BASE}/api/track", json=event)
+        assert response.status_code == 422
+
+class RejectedRow(Exception):
+    """Stands in for the driver error Postgres raises for a row it can't store"""
+    sqlstate = "22021"
+
+def test_spool_dead_letters_rejected_rows(tmp_path):
+    """Test that a spooled row the database rejects is moved aside instead of blocking replay"""
+    from backend.ingest import prepare_event
+    from backend.models import EventCreate
+    from backend.spool import SPOOL_DEAD_LETTER, Spool
+
+    written = []
+    async def writer(events):
+        if any(event["event_type"] == "rejected" for event in events):
+            raise RejectedRow("invalid byte sequence for encoding \"UTF8\": 0x00")
+        written.extend(events)
+        return len(events)
+
+    async def replay():
+        spool = Spool(directory=str(tmp_path), writer=writer)
+        spool.start()
+        for event_type in ("page_view", "rejected", "page_view", "purchase"):
+            await spool.append(prepare_event(EventCreate(event_type=event_type)))
+        while spool.counters["depth"]:
+            await asyncio.sleep(0.05)
+        await spool.stop()
+        return spool
+
+    spool = asyncio.run(asyncio.wait_for(replay(), 10))
+    assert [event["event_type"] for event in written] == ["page_view", "page_view", "purchase"]
+    assert spool.counters["dead_lettered"] == 1
+    assert not spool.degraded
+    dead_letter = [json.loads(line) for line in (tmp_path / SPOOL_DEAD_LETTER).read_text().splitlines()]
+    assert [line["event"]["event_type"] for line in dead_letter] == ["rejected"]
+    assert "0x00" in dead_letter[0]["error"]
+
+def test_buffer_retries_flush_and_isolates_rejected_rows():
+    """Test that a buffered flush retries a dropped connection and only fails rejected rows"""
+    from backend.ingest import prepare_event
+    from backend.ingest_buffer import IngestBuffer
+    from backend.models import EventCreate
+
+    attempts = []
+    written = []
+    async def writer(events):
+        attempts.append(len(events))
+        if len(attempts) == 1:
+            raise ConnectionError("connection reset by peer")
+        if any(event["event_type"] == "rejected" for event in events):
+            raise RejectedRow("invalid byte sequence for encoding \"UTF8\": 0x00")
+        written.extend(events)
+        return len(events)
+
+    async def flush():
+        buffer = IngestBuffer(writer=writer, retry_backoff_ms=1)
+        buffer.start()
+        futures = [
+            buffer.submit(prepare_event(EventCreate(event_type=event_type)))
+            for event_type in ("page_view", "rejected", "purchase", "page_view")
+        ]
+        await buffer.stop()
+        return buffer, futures
+
+    buffer, futures = asyncio.run(flush())
+    assert [event["event_type"] for event in written] == ["page_view", "purchase", "page_view"]
+    assert [future.exception() is not None for future in futures] == [False, True, False, False]
+    assert buffer.counters["flush_retries"] == 1
+    assert buffer.counters["db_rejected_rows"] == 1
+    assert buffer.counters["failed_rows"] == 0
+
+def test_track_ndjson():
+    """Test gzip NDJSON bulk ingest with per-line rejects"""
+    duplicate_id = str(uuid.uuid4())
+    lines = [
+        {"event_id": duplicate_id, "event_type": "page_view", "session_id": "test-ndjson-123"},
+        {"event_id": duplicate_id, "event_type": "page_view", "session_id": "test-ndjson-123"},
+        {"session_id": "test-ndjson-123"},
+        {"event_type": "purchase", "session_id": "test-ndjson-123", "revenue": 25, "metadata": {"test": True}}
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n"
+    response = requests.post(
+        f"{API_BASE}/api/track/ndjson",
+        data=gzip.compress(body.encode()),
+        headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["lines"] == 5
+    assert data["accepted"] == 2
+    assert data["duplicates"] == 1
+    assert data["rejected"] == 2
+    assert [error["line"] for error in data["errors"]] == [3, 5]
+
+def test_ndjson_rejects_nul_per_line():
+    """Test that lines PostgreSQL couldn't store are per-line rejects, not a failed upload"""
+    lines = [
+        {"event_type": "page_view", "session_id": "test-ndjson-nul"},
+        {"event_type": "page_view", "session_id": "test-ndjson-nul\u0000"},
+        {"event_type": "purchase", "session_id": "test-ndjson-nul", "metadata": {"product_name": "a\u0000"}},
+        {"event_type": "purchase", "session_id": "test-ndjson-nul", "revenue": 5}
+    ]
+    body = "\n".join(json.dumps(line) for line in lines)
+    response = requests.post(f"{API_BASE}/api/track/ndjson", data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 2
+    assert [error["line"] for error in data["errors"]] == [2, 3]
+
+def test_ndjson_retry_without_timestamp():
+    """Test that a re-sent UUIDv7 event without a timestamp lands in the same partition row"""
+    body = json.dumps({"event_id": str(uuid7()), "event_type": "page_view", "session_id": "test-ndjson-123"})
+    headers = {"Content-Type": "application/x-ndjson"}
+    first = requests.post(f"{API_BASE}/api/track/ndjson", data=body, headers=headers)
+    time.sleep(0.01)
+    retry = requests.post(f"{API_BASE}/api/track/ndjson", data=body, headers=headers)
+    assert first.json()["accepted"] == 1
+    assert retry.json()["accepted"] == 0
+    assert retry.json()["duplicates"] == 1
+
+def test_retry_without_timestamp_past_front_check():
+    """Test that a re-sent non-v7 event id without a timestamp is stored once, even when
+    the retry misses the in-memory front-check (NDJSON skips it, as a restart would)"""
+    body = json.dumps({"event_id": str(uuid.uuid4()), "event_type": "page_view", "session_id": "test-ndjson-123"})
+    headers = {"Content-Type": "application/x-ndjson"}
+    first = requests.post(f"{API_BASE}/api/track/ndjson", data=body, headers=headers)
+    retry = requests.post(f"{API_BASE}/api/track/ndjson", data=body, headers=headers)
+    batch = requests.post(f"{API_BASE}/api/track/batch", json=[json.loads(body)])
+    assert first.json()["accepted"] == 1
+    assert retry.json()["duplicates"] == 1
+    assert batch.json()["duplicates"] == 1
+
+def test_funnel_counts_new_events_once():
+    """Test that ingested events show up in the funnel immediately, duplicates excluded"""
+    no_cache = {"Cache-Control": "no-cache"}
+    before = requests.get(f"{API_BASE}/api/funnel", params={"hours": 1}, headers=no_cache).json()
+    event = {"event_id": str(uuid.uuid4()), "event_type": "ad_click", "session_id": "test-rollup-123"}
+    response = requests.post(f"{API_BASE}/api/track/batch", json=[event, event])
+    assert response.json()["accepted"] == 1
+    after = requests.get(f"{API_BASE}/api/funnel", params={"hours": 1}, headers=no_cache).json()
+    assert after["ad_clicks"] == before["ad_clicks"] + 1
+
+def test_promoted_metadata_columns():
+    """Test that promoted metadata keys are served from their columns"""
+    metadata = {"product_name": "Test Product", "user_email": "promoted@example.com", "user_name": "Promoted User"}
+    event = {"event_type": "purchase", "session_id": "test-promoted-123", "revenue": 5, "metadata": metadata}
+    # The batch endpoint writes before responding in every ingest mode
+    requests.post(f"{API_BASE}/api/track/batch", json=[event])
+    response = requests.get(f"{API_BASE}/api/recent_events", params={"limit": 1}, headers={"Cache-Control": "no-cache"})
+    assert response.status_code == 200
+    latest = response.json()[0]
+    assert {key: latest[key] for key in metadata} == metadata
+
+def test_approx_distinct_counts():
+    """Test that sketch-based distinct counts stay within the documented error of the exact ones"""
+    requests.post(f"{API_BASE}/api/track", json={"event_type": "page_view", "session_id": "test-sketch-123", "user_id": "test-sketch-user"})
+    no_cache = {"Cache-Control": "no-cache"}
+    exact = requests.get(f"{API_BASE}/api/user_analytics", params={"hours": 24}, headers=no_cache).json()
+    approx = requests.get(f"{API_BASE}/api/user_analytics", params={"hours": 24, "approx": "true"}, headers=no_cache).json()
+    for key in ["total_users", "total_sessions"]:
+        # Three standard errors (2.3% each)
+        assert abs(approx[key] - exact[key]) <= 0.07 * exact[key]
+
+def test_ordered_funnel():
+    """Test that the ordered funnel only counts steps taken in order, including late events"""
+    campaign = f"test-ordered-{uuid.uuid4()}"
+    start = time.time() - 600
+
+    def post(*steps):
+        events = [
+            {"event_type": event_type, "session_id": campaign, "utm_campaign": campaign,
+             "timestamp": datetime.fromtimestamp(start + offset, timezone.utc).isoformat()}
+            for event_type, offset in steps
+        ]
+        requests.post(f"{API_BASE}/api/track/batch", json=events)
+        response = requests.get(f"{API_BASE}/api/ordered_funnel", params={"hours": 1, "campaign": campaign},
+                                headers={"Cache-Control": "no-cache"})
+        assert response.status_code == 200
+        return [step["sessions"] for step in response.json()["steps"]]
+
+    # add_to_cart before the product_view doesn't count
+    assert post(("product_view", 10), ("ad_click", 20), ("add_to_cart", 30)) == [1, 0, 0, 0]
+    assert post(("product_view", 40), ("purchase", 50)) == [1, 1, 0, 0]
+    # An earlier ad_click arriving late completes the funnel
+    assert post(("ad_click", 0)) == [1, 1, 1, 1]
+
+def test_events_pagination():
+    """Test paging through raw events with a cursor and a filter"""
+    session_id = f"test-pages-{uuid.uuid4()}"
+    start = time.time() - 60
+    events = [
+        {"event_type": "page_view", "session_id": session_id, "page_url": f"/page/{i}",
+         "timestamp": datetime.fromtimestamp(start + i, timezone.utc).isoformat()}
+        for i in range(3)
+    ]
+    requests.post(f"{API_BASE}/api/track/batch", json=events)
+    first = requests.get(f"{API_BASE}/api/events", params={"session_id": session_id, "limit": 2}).json()
+    second = requests.get(f"{API_BASE}/api/events",
+                          params={"session_id": session_id, "limit": 2, "cursor": first["next_cursor"]}).json()
+    pages = first["events"] + second["events"]
+    assert [event["page_url"] for event in pages] == ["/page/2", "/page/1", "/page/0"]
+    assert second["next_cursor"] is None
+    response = requests.get(f"{API_BASE}/api/events", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_export_events():
+    """Test exporting a time range as Parquet and Arrow with metadata flattened"""
+    session_id = f"test-export-{uuid.uuid4()}"
+    start = datetime.now(timezone.utc) - timedelta(minutes=5)
+    events = [
+        {"event_type": "product_view", "session_id": session_id, "revenue": 0,
+         "timestamp": (start + timedelta(seconds=i)).isoformat(),
+         "metadata": {"campaign": "export_test", "product_name": "AI Analytics Pro", "sku": f"AAP-{i}"}}
+        for i in range(3)
+    ]
+    requests.post(f"{API_BASE}/api/track/batch", json=events)
+    params = {"start": start.isoformat(), "end": (start + timedelta(seconds=3)).isoformat()}
+    parquet = requests.get(f"{API_BASE}/api/export", params={**params, "format": "parquet"})
+    arrow = requests.get(f"{API_BASE}/api/export", params={**params, "format": "arrow"})
+    assert parquet.status_code == 200 and arrow.status_code == 200
+    for table in (pq.read_table(io.BytesIO(parquet.content)), pa.ipc.open_stream(arrow.content).read_all()):
+        rows = sorted((row for row in table.to_pylist() if row["session_id"] == session_id),
+                      key=lambda row: row["timestamp"])
+        assert [row["campaign"] for row in rows] == ["export_test"] * 3
+        assert [json.loads(row["metadata"]) for row in rows] == [{"sku": f"AAP-{i}"} for i in range(3)]
+    response = requests.get(f"{API_BASE}/api/export", params={**params, "format": "csv"})
+    assert response.status_code == 400
+
+def test_windowed_metrics_see_new_events():
+    """Test that funnel, revenue and timeline include events as soon as they are stored
+    (from SQL, or from the hot window when HOT_WINDOW_HOURS is set)"""
+    fresh = {"Cache-Control": "no-cache"}
+
+    def metrics():
+        funnel = requests.get(f"{API_BASE}/api/funnel", params={"hours": 1}, headers=fresh).json()
+        revenue = requests.get(f"{API_BASE}/api/revenue_metrics", params={"hours": 1}, headers=fresh).json()
+        timeline = requests.get(f"{API_BASE}/api/event_timeline", params={"hours": 1}, headers=fresh).json()
+        return funnel["ad_clicks"], revenue["total_purchases"], sum(bucket["purchases"] for bucket in timeline)
+
+    before = metrics()
+    session_id = f"test-window-{uuid.uuid4()}"
+    events = [{"event_type": "ad_click", "session_id": session_id}] * 2 + [
+        {"event_type": "purchase", "session_id": session_id, "revenue": 49.99}
+    ]
+    requests.post(f"{API_BASE}/api/track/batch", json=events)
+    assert metrics() == (before[0] + 2, before[1] + 1, before[2] + 1)
+
+def test_live_stream():
+    """Test that ingested events are pushed to /api/live subscribers as one coalesced delta"""
+    with requests.get(f"{API_BASE}/api/live", stream=True, timeout=10) as stream:
+        assert stream.headers["content-type"].startswith("text/event-stream")
+        session_id = f"test-live-{uuid.uuid4()}"
+        events = [{"event_type": "ad_click", "session_id": session_id}] * 2 + [
+            {"event_type": "purchase", "session_id": session_id, "revenue": 25.0}
+        ]
+        requests.post(f"{API_BASE}/api/track/batch", json=events)
+        deltas = []
+        for line in stream.iter_lines():
+            if line.startswith(b"data: "):
+                deltas.append(json.loads(line[len(b"data: "):]))
+                if sum(delta["total_events"] for delta in deltas) >= 3:
+                    break
+    assert sum(delta["funnel"]["ad_clicks"] for delta in deltas) >= 2
+    assert sum(delta["revenue"]["total_revenue"] for delta in deltas) >= 25.0
+    assert any(event["session_id"] == session_id for delta in deltas for event in delta["recent_events"])
+
+def test_event_timeline_intervals():
+    """Test timeline buckets: gap-filled at the requested interval, downsampled to max_points"""
+    minutes = requests.get(f"{API_BASE}/api/event_timeline", params={"hours": 2, "interval": "minute"}).json()
+    starts = [datetime.fromisoformat(point["timestamp"]) for point in minutes]
+    assert len(starts) in (120, 121)
+    assert all((b - a).total_seconds() == 60 for a, b in zip(starts, starts[1:]))
+    sampled = requests.get(f"{API_BASE}/api/event_timeline",
+                           params={"hours": 24, "interval": "5min", "max_points": 50}).json()
+    assert len(sampled) == 50
+    response = requests.get(f"{API_BASE}/api/event_timeline", params={"interval": "week"})
+    assert response.status_code == 400
+
+def test_breakdown():
+    """Test breakdowns by several dimensions, their combinations and top_k per breakdown"""
+    response = requests.get(f"{API_BASE}/api/breakdown",
+                            params={"hours": 24, "dimensions": "campaign,device", "top_k": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"]["clicks"] >= 0
+    assert [b["dimensions"] for b in data["breakdowns"]] == [["campaign"], ["device"]]
+    assert all(len(b["groups"]) <= 2 for b in data["breakdowns"])
+    cube = requests.get(f"{API_BASE}/api/breakdown",
+                        params={"hours": 24, "dimensions": "campaign,device", "cube": True}).json()
+    assert [b["dimensions"] for b in cube["breakdowns"]] == [["campaign"], ["device"], ["campaign", "device"]]
+    response = requests.get(f"{API_BASE}/api/breakdown", params={"dimensions": "country"})
+    assert response.status_code == 400
+
+def test_product_revenue():
+    """Test revenue per product, from the materialized view or raw events"""
+    for hours in (24, 168):
+        response = requests.get(f"{API_BASE}/api/product_revenue", params={"hours": hours, "limit": 3})
+        assert response.status_code == 200
+        products = response.json()
+        assert len(products) <= 3
+        assert [p["revenue"] for p in products] == sorted((p["revenue"] for p in products), reverse=True)
+    views = requests.get(f"{API_BASE}/api/stats").json()["matviews"]["views"]
+    assert set(views) == {"window_distinct_counts", "product_revenue"}
+
+def test_precomputed_views_report_refresh_time():
+    """Test that view-backed counts are opt-in beyond the cache TTL and carry refreshed_at"""
+    no_cache = {"Cache-Control": "no-cache"}
+    live = requests.get(f"{API_BASE}/api/user_analytics", params={"hours": 24}, headers=no_cache).json()
+    assert live["refreshed_at"] is None
+    subprocess.run([sys.executable, "scripts/refresh_views.py", "--once"], check=True, capture_output=True)
+    users = requests.get(f"{API_BASE}/api/user_analytics",
+                         params={"hours": 168, "precomputed": True}, headers=no_cache).json()
+    refreshed_at = datetime.fromisoformat(users["refreshed_at"])
+    assert datetime.now(timezone.utc) - refreshed_at < timedelta(minutes=1)
+    dashboard = requests.get(f"{API_BASE}/api/dashboard",
+                             params={"hours": 168, "precomputed": True}, headers=no_cache).json()
+    assert dashboard["user_analytics"]["refreshed_at"] is not None
+
+def test_dashboard_endpoint():
+    """Test consolidated dashboard endpoint"""
+    response = requests.get(f"{API_BASE}/api/dashboard", params={"hours": 24, "limit": 5})
+    assert response.status_code == 200
+    data = response.json()
+    for section in ["funnel", "user_analytics", "campaign_performance", "revenue_metrics", "event_timeline", "recent_events"]:
+        assert section in data
+    assert "ad_clicks" in data["funnel"]
+    assert len(data["recent_events"]) <= 5
+
+def test_analytics_cache():
+    """Test that repeated analytics reads are served from the result cache"""
+    requests.get(f"{API_BASE}/api/revenue_metrics", params={"hours": 5})
+    before = requests.get(f"{API_BASE}/api/stats").json()["cache"]
+    response = requests.get(f"{API_BASE}/api/revenue_metrics", params={"hours": 5})
+    assert response.status_code == 200
+    after = requests.get(f"{API_BASE}/api/stats").json()["cache"]
+    assert after["hits"] + after["stale_hits"] == before["hits"] + before["stale_hits"] + 1